@@ -0,0 +1,19 @@
+from .models import Member
+
+
+class MemberMiddleware:
+    """
+    Один раз за запрос загружает участника текущего пользователя вместе с его ролью и прикрепляет его
+    к request.user.member, чтобы миксины, декораторы и шаблоны не запрашивали его повторно.
+    Должен стоять после AuthenticationMiddleware
+    """
+
+    def __init__(self, get_response):
+        self._get_response = get_response
+
+    def __call__(self, request):
+        if request.user.is_authenticated:
+            member = Member.objects.select_related('role').filter(user=request.user).first()
+            if member:
+                request.user.member = member
+        return self._get_response(request)
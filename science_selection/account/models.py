@@ -37,6 +37,26 @@ class Affiliation(models.Model):
         return f'{self.company} рота, {self.platoon} взвод'
 
 
+class MasterContext:
+    """
+    Принадлежности и направления мастера, загружаемые одним запросом:
+    affiliations_id - id принадлежностей в порядке сортировки Affiliation,
+    directions_id - id направлений этих принадлежностей без повторов,
+    affiliation_directions - словарь {id принадлежности: id направления}.
+    По нему проверяются права мастера, поэтому между запросами он не кэшируется
+    """
+
+    def __init__(self, affiliation_directions):
+        self.affiliation_directions = dict(affiliation_directions)
+        self.affiliations_id = list(self.affiliation_directions)
+        self.directions_id = list(dict.fromkeys(self.affiliation_directions.values()))
+
+    @classmethod
+    def load(cls, member_id):
+        """Загружает контекст мастера с id member_id из БД"""
+        return cls(Affiliation.objects.filter(member__id=member_id).values_list('id', 'direction_id'))
+
+
 class Member(models.Model):
     class Validator:
         phone_regex = RegexValidator(regex=r'^\+?1?\d{9,15}$',
@@ -64,11 +84,27 @@ class Member(models.Model):
     def is_moderator(self):
         return self.role.role_name == MODERATOR_ROLE_NAME
 
+    def get_master_context(self):
+        """
+        Возвращает MasterContext участника. Загружается один раз на экземпляр участника, т.е. для request.user.member
+        один раз за запрос
+        """
+        if not hasattr(self, '_master_context'):
+            self._master_context = MasterContext.load(self.pk)
+        return self._master_context
+
     @staticmethod
     def if_member_exists(phone=None, email=None):
         return Member.objects.filter(models.Q(phone=phone) | models.Q(user__email=email)).first()
 
 
+@receiver(models.signals.m2m_changed, sender=Member.affiliations.through)
+def clear_master_context_on_affiliations_change(sender, instance, action, reverse, **kwargs):
+    """Сбрасывает загруженный MasterContext участника, у которого изменились принадлежности"""
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        instance.__dict__.pop('_master_context', None)
+
+
 def create_activation_link(user):
     token = uuid4()
     ActivationLink.objects.create(user=user, token=token)
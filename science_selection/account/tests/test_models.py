@@ -2,7 +2,8 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 
-from account.models import Role, Member, BookingType, ActivationLink
+from account.models import Role, Member, BookingType, ActivationLink, Affiliation
+from application.models import Direction
 from utils.constants import SLAVE_ROLE_NAME, MASTER_ROLE_NAME, BOOKED
 
 
@@ -55,6 +56,26 @@ class MemberModelTest(TestCase):
         member = Member.objects.get(id=2)
         self.assertEquals(member.is_master(), True)
 
+    def test_master_context(self):
+        """Проверяет, что контекст мастера загружается один раз на участника и видит изменения принадлежностей"""
+        directions = [Direction.objects.create(name=f'test{i}', description='description') for i in range(2)]
+        affiliations = [Affiliation.objects.create(direction=directions[i % 2], company=i, platoon=i) for i in range(3)]
+        master = Member.objects.get(user__username='test_master')
+        master.affiliations.add(affiliations[0], affiliations[1])
+        with self.assertNumQueries(1):
+            context = master.get_master_context()
+            master.get_master_context()
+        self.assertEqual(context.affiliations_id, [affiliations[0].id, affiliations[1].id])
+        self.assertEqual(context.affiliation_directions,
+                         {affiliations[0].id: directions[0].id, affiliations[1].id: directions[1].id})
+        # следующий запрос загружает контекст заново и видит изменения, сделанные в других процессах
+        affiliations[2].member_set.add(master)
+        context = Member.objects.get(pk=master.pk).get_master_context()
+        self.assertEqual(context.directions_id, [directions[0].id, directions[1].id])
+        self.assertEqual(len(context.affiliations_id), 3)
+        master.affiliations.clear()
+        self.assertEqual(master.get_master_context().affiliations_id, [])
+
 
 class BookingTypeModelTest(TestCase):
 
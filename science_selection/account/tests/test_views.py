@@ -1,6 +1,8 @@
 import datetime
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
 
@@ -245,6 +247,20 @@ class HomeMasterViewTest(TestCase):
         self.assertEqual(resp.context['count_apps'], 1)
         self.assertEqual(list(resp.context['master_affiliations']), [])
 
+    def test_member_in_request(self):
+        """Проверяет, что участник с ролью загружается один раз за запрос и прикрепляется к пользователю"""
+        self.client.login(username='officer', password='test_officer')
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('home_master'))
+        member_queries = [query['sql'] for query in queries
+                          if 'FROM "account_member"' in query['sql'] or 'FROM "account_role"' in query['sql']]
+        self.assertEqual(len(member_queries), 1)
+        self.assertIn('JOIN "account_role"', member_queries[0])
+        member = resp.wsgi_request.user.member
+        self.assertEqual(member, Member.objects.get(user=self.user_officer))
+        with self.assertNumQueries(0):
+            self.assertTrue(member.is_master())
+
 
 class HomeViewTest(TestCase):
 
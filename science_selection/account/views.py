@@ -123,6 +123,7 @@ class GetUserProfileView(LoginRequiredMixin, View):
             new_user.save()
             if request.user.member.father_name != user_form.cleaned_data['father_name']:
                 Member.objects.filter(user=new_user).update(father_name=user_form.cleaned_data['father_name'])
+                Application.update_search_documents(Application.objects.filter(member__user=new_user))
             update_session_auth_hash(request, new_user)
             return redirect('home')
         else:
@@ -1,11 +1,12 @@
 from django.contrib import admin
 from django.conf.urls import url
-from django.shortcuts import render
+from django.http import JsonResponse, HttpResponse
+from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 
 from engine.middleware import logger
 
 from . import models
-from .utils import Questionnaires
 
 
 class CompetenciesInlineAdmin(admin.TabularInline):
@@ -23,19 +24,50 @@ class ApplicationAdmin(admin.ModelAdmin):
     def get_urls(self):
         urls = super(ApplicationAdmin, self).get_urls()
         custom_urls = [
-            url('^import/$', self.process_import, name='process_import')]
+            url('^import/$', self.admin_site.admin_view(self.process_import), name='process_import'),
+            url(r'^import/(?P<pk>\d+)/progress/$', self.admin_site.admin_view(self.import_progress),
+                name='import_job_progress'),
+            url(r'^import/(?P<pk>\d+)/report/$', self.admin_site.admin_view(self.import_report),
+                name='import_job_report'),
+        ]
         return custom_urls + urls
 
     def process_import(self, request):
-        # TODO; было бы хорошо создавать таски на выполнение этих задач, но вряд ли это будем делать)))
+        """Сохраняет загруженные файлы и ставит их в очередь импорта, которую обрабатывает manage.py run_jobs"""
         new_files = request.FILES.getlist('downloaded_files')
-        overall_result = []
-        for file in new_files:
-            questionnaires = Questionnaires(file=file)
-            result = questionnaires.add_applications_to_db()
-            overall_result.append(result)
-            logger.info(result)
-        return render(request, 'import.html', context={'results': overall_result, 'uri': request.META.get('HTTP_REFERER')})
+        jobs = [models.ImportJob.objects.create(file=file, file_name=file.name, author=request.user)
+                for file in new_files]
+        logger.info(f'Поставлены в очередь задачи импорта: {[job.pk for job in jobs]}')
+        return render(request, 'import.html', context={'jobs': jobs, 'uri': request.META.get('HTTP_REFERER')})
+
+    def import_progress(self, request, pk):
+        """Возвращает состояние задачи импорта"""
+        job = get_object_or_404(models.ImportJob, pk=pk)
+        return JsonResponse({
+            'status': job.status,
+            'status_display': job.get_status_display(),
+            'is_finished': job.is_finished(),
+            'rows_processed': job.rows_processed,
+            'accepted_count': job.accepted_count,
+            'errors_count': job.errors_count,
+            'error': job.error,
+            'report_url': reverse('admin:import_job_report', args=[job.pk]) if job.is_finished() else None,
+        })
+
+    def import_report(self, request, pk):
+        """Выгружает отчет о выполненной задаче импорта"""
+        job = get_object_or_404(models.ImportJob, pk=pk)
+        response = HttpResponse(job.get_report_text(), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="import_report_{job.pk}.txt"'
+        return response
+
+
+@admin.register(models.ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'author', 'status', 'rows_processed', 'accepted_count', 'errors_count', 'create_date',
+                    'end_date')
+    list_filter = ('status', 'create_date')
+    readonly_fields = ('start_date', 'end_date', 'rows_processed', 'accepted_count', 'errors_count', 'report', 'error')
 
 
 @admin.register(models.Education)
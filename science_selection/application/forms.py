@@ -58,7 +58,8 @@ class ApplicationMasterForm(forms.ModelForm):
     class Meta:
         model = Application
         exclude = ('create_date', 'update_date', 'fullness', 'final_score', 'member', 'unsuitable',
-                   'competencies', 'directions', 'id', 'is_final', 'work_group')
+                   'competencies', 'directions', 'id', 'is_final', 'work_group', 'last_university',
+                   'last_specialization', 'last_avg_score', 'last_education_type', 'search_document')
         widgets = {
             'birth_place': Input(attrs={'class': 'form-control'}),
             'nationality': Input(attrs={'class': 'form-control'}),
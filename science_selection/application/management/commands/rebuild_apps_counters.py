@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from application.models import SeasonAppsCounter, ViewedAppsCounter, rebuild_apps_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики заявок призывов и просмотренных мастерами заявок (значок непросмотренных заявок)'
+
+    def handle(self, *args, **options):
+        rebuild_apps_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано счетчиков призывов: {SeasonAppsCounter.objects.count()}, '
+            f'счетчиков просмотров: {ViewedAppsCounter.objects.count()}'))
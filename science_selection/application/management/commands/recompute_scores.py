@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from application.models import Application
+from application.utils import recompute_scores
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает оценки a1-a7 и итоговый балл заявок (например, после изменения MEANING_COEFFICIENTS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--draft-year', type=int, help='Год призыва, заявки которого нужно пересчитать')
+        parser.add_argument('--season', type=int, choices=[s[0] for s in Application.season],
+                            help='Сезон призыва (1 - весна, 2 - осень)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество заявок, обрабатываемых за раз')
+
+    def handle(self, *args, **options):
+        apps = Application.objects.all()
+        if options['draft_year']:
+            apps = apps.filter(draft_year=options['draft_year'])
+        if options['season']:
+            apps = apps.filter(draft_season=options['season'])
+        count = recompute_scores(apps, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано заявок: {count}'))
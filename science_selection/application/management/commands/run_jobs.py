@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from application.models import ImportJob
+from application.utils import run_import_job
+from utils import constants as const
+
+
+class Command(BaseCommand):
+    help = 'Обработчик очереди задач импорта анкет: забирает задачи из БД и выполняет их по одной'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задачи, которые уже есть в очереди, и завершить работу')
+        parser.add_argument('--poll-interval', type=float, default=const.JOBS_POLL_INTERVAL,
+                            help='Интервал проверки очереди в секундах, если задач нет')
+        parser.add_argument('--running-timeout', type=int, default=const.JOBS_RUNNING_TIMEOUT,
+                            help='Время в секундах, после которого выполняющаяся задача считается прерванной')
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            stale = ImportJob.fail_stale(options['running_timeout'])
+            if stale:
+                self.stdout.write(self.style.WARNING(f'Завершено прерванных задач: {stale}'))
+            job = ImportJob.take_next()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            self.stdout.write(f'Выполняется задача импорта {job.pk}: {job.file_name}')
+            run_import_job(job)
+            processed += 1
+            self.stdout.write(self.style.SUCCESS(
+                f'Задача импорта {job.pk} завершена ({job.get_status_display()}): загружено анкет '
+                f'{job.accepted_count}, ошибок {job.errors_count}'))
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {processed}'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from application.models import Application, Education
+
+
+class Command(BaseCommand):
+    help = 'Заполняет поля последнего образования (last_*) во всех заявках по данным из Education'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество заявок, обновляемых за раз')
+
+    def handle(self, *args, **options):
+        last_educations = {}
+        for education in Education.objects.order_by('application_id', '-end_year').only(
+                'application_id', 'university', 'specialization', 'avg_score', 'education_type').iterator():
+            last_educations.setdefault(education.application_id, education)
+
+        apps = list(Application.objects.only('id'))
+        for app in apps:
+            last_education = last_educations.get(app.id)
+            app.last_university = last_education.university if last_education else ''
+            app.last_specialization = last_education.specialization if last_education else ''
+            app.last_avg_score = last_education.avg_score if last_education else None
+            app.last_education_type = last_education.education_type if last_education else ''
+
+        with transaction.atomic():
+            Application.objects.bulk_update(apps, ['last_university', 'last_specialization', 'last_avg_score',
+                                                   'last_education_type'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено заявок: {len(apps)}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from application.models import Application
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает поисковые документы всех заявок (поиск в списке заявок)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество заявок, обновляемых за раз')
+
+    def handle(self, *args, **options):
+        app_ids = list(Application.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+        for i in range(0, len(app_ids), batch_size):
+            Application.update_search_documents(Application.objects.filter(id__in=app_ids[i:i + batch_size]))
+        self.stdout.write(self.style.SUCCESS(f'Обновлено заявок: {len(app_ids)}'))
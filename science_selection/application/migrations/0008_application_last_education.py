@@ -0,0 +1,33 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0007_rename_suitable_application_unsuitable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='last_avg_score',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Средний балл последнего образования'),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='last_education_type',
+            field=models.CharField(blank=True, default='', max_length=1, verbose_name='Программа последнего образования'),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='last_specialization',
+            field=models.CharField(blank=True, default='', max_length=256, verbose_name='Специальность последнего образования'),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='last_university',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=256, verbose_name='Университет последнего образования'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.9 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+SEARCH_TABLE_NAME = 'application_search'
+
+
+def create_search_index(apps, schema_editor):
+    """PostgreSQL: триграммный индекс по search_document. SQLite: FTS5 таблица с триграммным токенайзером"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute('CREATE INDEX application_search_document_trgm ON application_application '
+                              'USING gin (search_document gin_trgm_ops)')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {SEARCH_TABLE_NAME} USING fts5(search_document, "
+                              f"tokenize='trigram')")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS application_search_document_trgm')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0008_application_last_education'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='search_document',
+            field=models.TextField(blank=True, default='', help_text='ФИО, ВУЗ и субъект военкомата в нижнем регистре', verbose_name='Поисковый документ'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.9 on 2026-10-18 12:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('application', '0009_application_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/%d', verbose_name='Файл импорта')),
+                ('file_name', models.CharField(max_length=256, verbose_name='Название файла')),
+                ('status', models.CharField(choices=[('q', 'В очереди'), ('r', 'Выполняется'), ('d', 'Завершена'), ('f', 'Ошибка')], db_index=True, default='q', max_length=1, verbose_name='Статус')),
+                ('create_date', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('start_date', models.DateTimeField(blank=True, null=True, verbose_name='Дата начала обработки')),
+                ('end_date', models.DateTimeField(blank=True, null=True, verbose_name='Дата окончания обработки')),
+                ('rows_processed', models.IntegerField(default=0, verbose_name='Обработано анкет')),
+                ('accepted_count', models.IntegerField(default=0, verbose_name='Загружено анкет')),
+                ('errors_count', models.IntegerField(default=0, verbose_name='Ошибок')),
+                ('report', models.JSONField(blank=True, default=dict, help_text='Сообщения импорта вида {"accepted": [...], "errors": [...]}', verbose_name='Отчет')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка выполнения')),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Задача импорта анкет',
+                'verbose_name_plural': 'Задачи импорта анкет',
+                'ordering': ['-create_date'],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.9 on 2026-10-18 13:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_apps_counters(apps, schema_editor):
+    """Заполняет счетчики по уже существующим заявкам и меткам просмотра (как команда rebuild_apps_counters)"""
+    Application = apps.get_model('application', 'Application')
+    AppsViewedByMaster = apps.get_model('application', 'AppsViewedByMaster')
+    SeasonAppsCounter = apps.get_model('application', 'SeasonAppsCounter')
+    ViewedAppsCounter = apps.get_model('application', 'ViewedAppsCounter')
+    SeasonAppsCounter.objects.bulk_create(
+        SeasonAppsCounter(draft_year=draft_year, draft_season=draft_season, count=count)
+        for draft_year, draft_season, count in Application.objects.order_by().values_list(
+            'draft_year', 'draft_season').annotate(models.Count('id')))
+    ViewedAppsCounter.objects.bulk_create(
+        ViewedAppsCounter(member_id=member_id, draft_year=draft_year, draft_season=draft_season, count=count)
+        for member_id, draft_year, draft_season, count in AppsViewedByMaster.objects.order_by().values_list(
+            'member', 'application__draft_year', 'application__draft_season').annotate(
+            models.Count('application', distinct=True)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_alter_member_father_name'),
+        ('application', '0010_import_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeasonAppsCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('draft_year', models.IntegerField(verbose_name='Год призыва')),
+                ('draft_season', models.IntegerField(choices=[(1, 'Весна'), (2, 'Осень')], verbose_name='Сезон призыва')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество заявок')),
+            ],
+            options={
+                'verbose_name': 'Счетчик заявок призыва',
+                'verbose_name_plural': 'Счетчики заявок призывов',
+            },
+        ),
+        migrations.CreateModel(
+            name='ViewedAppsCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('draft_year', models.IntegerField(verbose_name='Год призыва')),
+                ('draft_season', models.IntegerField(choices=[(1, 'Весна'), (2, 'Осень')], verbose_name='Сезон призыва')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество заявок')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='account.member', verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Счетчик просмотренных заявок',
+                'verbose_name_plural': 'Счетчики просмотренных заявок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='seasonappscounter',
+            constraint=models.UniqueConstraint(fields=('draft_year', 'draft_season'), name='unique_season_apps_counter'),
+        ),
+        migrations.AddConstraint(
+            model_name='viewedappscounter',
+            constraint=models.UniqueConstraint(fields=('member', 'draft_year', 'draft_season'), name='unique_viewed_apps_counter'),
+        ),
+        migrations.RunPython(fill_apps_counters, migrations.RunPython.noop),
+    ]
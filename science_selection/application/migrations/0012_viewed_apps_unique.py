@@ -0,0 +1,26 @@
+# Generated by Django 3.2.9 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+def delete_duplicate_viewed_apps(apps, schema_editor):
+    """Удаляет повторные метки просмотра одной заявки одним участником, оставляя самую раннюю"""
+    AppsViewedByMaster = apps.get_model('application', 'AppsViewedByMaster')
+    first_marks = AppsViewedByMaster.objects.order_by().values('member', 'application').annotate(
+        first_id=models.Min('id')).values('first_id')
+    AppsViewedByMaster.objects.exclude(id__in=first_marks).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0011_apps_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_viewed_apps, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appsviewedbymaster',
+            constraint=models.UniqueConstraint(fields=('member', 'application'), name='unique_viewed_app'),
+        ),
+    ]
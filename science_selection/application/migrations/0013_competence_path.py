@@ -0,0 +1,41 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:06
+
+from django.db import migrations, models
+
+
+def fill_competence_paths(apps, schema_editor):
+    """Заполняет пути и глубину уже существующих компетенций, начиная с корней"""
+    Competence = apps.get_model('application', 'Competence')
+    parents = dict(Competence.objects.values_list('id', 'parent_node_id'))
+    paths = {}
+
+    def get_path(competence_id):
+        if competence_id not in paths:
+            parent_id = parents[competence_id]
+            paths[competence_id] = (get_path(parent_id) if parent_id else '') + f'{competence_id}/'
+        return paths[competence_id]
+
+    competences = [Competence(id=competence_id, path=get_path(competence_id),
+                              depth=get_path(competence_id).count('/') - 1) for competence_id in parents]
+    Competence.objects.bulk_update(competences, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0012_viewed_apps_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='competence',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Глубина в дереве'),
+        ),
+        migrations.AddField(
+            model_name='competence',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255, verbose_name='Путь в дереве'),
+        ),
+        migrations.RunPython(fill_competence_paths, migrations.RunPython.noop),
+    ]
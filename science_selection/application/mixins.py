@@ -4,8 +4,8 @@ from django.shortcuts import redirect
 
 from account.models import Affiliation
 from application.models import Competence, Direction
-from application.utils import check_role
-from utils.constants import MASTER_ROLE_NAME, MODERATOR_ROLE_NAME
+from application.utils import check_role, set_booking_status, set_application_notes, KeysetPaginator
+from utils.constants import MASTER_ROLE_NAME, MODERATOR_ROLE_NAME, PAGINATOR_COUNT_CACHE_TIMEOUT
 from utils.exceptions import MasterHasNoDirectionsException, NoHTTPReferer
 
 
@@ -27,24 +27,62 @@ class OnlySlaveAccessMixin:
         return super().dispatch(request, *args, **kwargs)
 
 
+class KeysetPaginationMixin:
+    """
+    Добавляет ListView режим пагинации по ключу сортировки, который включается параметром cursor в GET-запросе.
+    В этом режиме страница выбирается по значениям ключа крайней записи соседней страницы, а не через OFFSET,
+    а общее количество записей берется из кэша (см. KeysetPaginator)
+    """
+    paginator_class = KeysetPaginator
+    cursor_kwarg = 'cursor'
+
+    def get_keyset_ordering(self):
+        """
+        Возвращает ключ сортировки - список пар (поле, по убыванию) с уникальным последним полем,
+        или None, если при текущей сортировке пагинация по ключу невозможна
+        """
+        return None
+
+    def paginate_queryset(self, queryset, page_size):
+        keys = self.get_keyset_ordering()
+        if self.cursor_kwarg not in self.request.GET or not keys:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = self.get_paginator(queryset, page_size, count_cache_timeout=PAGINATOR_COUNT_CACHE_TIMEOUT)
+        page = paginator.keyset_page(keys, self.request.GET[self.cursor_kwarg])
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
 class DataApplicationMixin:
     def get_root_competences(self):
-        return Competence.objects.filter(parent_node__isnull=True).prefetch_related('child', 'child__child')
+        """Возвращает корни дерева компетенций, собранного одним запросом (см. Competence.get_tree)"""
+        return Competence.get_tree()
+
+    def get_master_context(self):
+        """Возвращает MasterContext текущего мастера, загруженный один раз за запрос"""
+        return self.request.user.member.get_master_context()
 
     def get_master_affiliations(self):
-        return Affiliation.objects.filter(member=self.request.user.member)
+        return Affiliation.objects.filter(id__in=self.get_master_context().affiliations_id)
 
     def get_master_affiliations_id(self):
-        return Affiliation.objects.filter(member=self.request.user.member).values_list('id', flat=True)
+        return self.get_master_context().affiliations_id
 
     def get_all_directions(self):
         return Direction.objects.all()
 
     def get_master_directions(self):
-        return Direction.objects.filter(affiliation__in=self.get_master_affiliations()).distinct()
+        return Direction.objects.filter(id__in=self.get_master_context().directions_id)
 
     def get_master_directions_id(self):
-        return self.get_master_affiliations().values_list('direction__id', flat=True)
+        return self.get_master_context().directions_id
+
+    def add_booking_status_to_apps(self, apps):
+        """Добавляет заявкам apps статусы бронирования относительно текущего мастера (см. set_booking_status)"""
+        return set_booking_status(apps, self.request.user.member, self.get_master_affiliations_id())
+
+    def add_notes_to_apps(self, apps):
+        """Добавляет заявкам apps заметки, видимые текущему мастеру (см. set_application_notes)"""
+        return set_application_notes(apps, self.request.user.member, self.get_master_affiliations_id())
 
     def get_redirect_on_previous_page(self, request):
         """Возвращает редирект на предыдущую страницу или вызывает ошибку NoHTTPReferer"""
@@ -59,19 +97,17 @@ class DataApplicationMixin:
          если принадлежность с affiliation_id не принадлежит мастеру"""
         if isinstance(affiliation_id, int):
             affiliation_id = [affiliation_id]
-        if not set(affiliation_id).issubset(set(self.get_master_affiliations().values_list('id', flat=True))):
+        if not set(affiliation_id).issubset(set(self.get_master_affiliations_id())):
             raise PermissionDenied(error_message)
 
     def get_first_master_direction_or_exception(self):
-        master_directions = self.get_master_directions()
-        chosen_direction = master_directions.first() if master_directions else None
+        chosen_direction = self.get_master_directions().first() if self.get_master_directions_id() else None
         if not chosen_direction:
             raise MasterHasNoDirectionsException('У вас нет направлений для отбора.')
         return chosen_direction
 
     def get_first_master_affiliation_or_exception(self):
-        master_affiliations = self.get_master_affiliations()
-        chosen_affiliation = master_affiliations.first() if master_affiliations else None
+        chosen_affiliation = self.get_master_affiliations().first() if self.get_master_affiliations_id() else None
         if not chosen_affiliation:
             raise MasterHasNoDirectionsException('У вас нет направлений для отбора.')
         return chosen_affiliation
@@ -85,9 +121,9 @@ class DataApplicationMixin:
         """
         master_directions_affiliations = {}
         for affiliation in master_affiliations:
-            old = master_directions_affiliations.pop(affiliation.direction.id, None)
+            old = master_directions_affiliations.pop(affiliation.direction_id, None)
             item = [*old, affiliation] if old else [affiliation]
-            master_directions_affiliations.update({affiliation.direction.id: item})
+            master_directions_affiliations.update({affiliation.direction_id: item})
         return master_directions_affiliations
 
 
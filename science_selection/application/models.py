@@ -1,18 +1,72 @@
 import datetime
-
-from django.db import models
+import logging
+import threading
+from collections import Counter, namedtuple
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import models, connection, transaction, DatabaseError
+from django.db.models.functions import Concat, Substr, StrIndex
 from django.core.exceptions import ValidationError
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from utils import constants as const
+from utils.docx_templates import docx_template_cache
 from account.models import Member, Affiliation
 
+# тот же логгер, что и engine.middleware.logger (импорт оттуда циклический)
+logger = logging.getLogger('django.server')
+
 
 def validate_draft_year(value: int):
     if value < datetime.date.today().year:
         raise ValidationError(_(f'Год призыва {value} раньше текущего'))
 
 
+# FTS5 таблица поисковых документов заявок, используется только в SQLite (rowid = id заявки)
+SEARCH_TABLE_NAME = 'application_search'
+
+
+def calculate_scores(app, has_ended_postgraduate) -> dict:
+    """
+    Подсчет оценок кандидата по критериям a1-a7 и рейтингового балла по формуле без обращений к БД
+    :param app: заявка с заполненными полями достижений и последнего образования (last_*)
+    :param has_ended_postgraduate: есть ли в заявке оконченная аспирантура
+    :return: словарь вида {'a1': оценка, ..., 'a7': оценка, 'final_score': рейтинговый балл}
+    """
+    scores = {'a1': round(int(app.international_articles) * const.INTERNATIONAL_ARTICLES_SCORE + int(
+        app.patents) * const.PATENTS_SCORE + int(app.vac_articles) * const.VAC_ARTICLES_SCORE + int(
+        app.innovation_proposals) * const.INNOVATION_PROPOSALS_SCORE + int(
+        app.rinc_articles) * const.RINC_ARTICLES_SCORE + int(app.evm_register) * const.EVM_REGISTER_SCORE, 2),
+              'a2': 0.0, 'a5': 0.0}
+    if app.last_avg_score is not None:
+        if app.last_education_type == 'b':
+            scores['a2'] = round(app.last_avg_score * const.BACHELOR_COEF, 2)
+        else:
+            scores['a2'] = round(app.last_avg_score * const.SPECIAL_AND_MORE_COEF, 2)
+    scores['a3'] = round(int(app.compliance_prior_direction) * const.COMPLIANCE_PRIOR_DIRECTION_SCORE + int(
+        app.compliance_additional_direction) * const.COMPLIANCE_ADDITIONAL_DIRECTION_SCORE, 2)
+    scores['a4'] = round(int(app.international_olympics) * const.INTERNATIONAL_OLYMPICS_SCORE + int(
+        app.president_scholarship) * const.PRESIDENT_SCHOLARSHIP_SCORE + int(
+        app.country_olympics) * const.COUNTRY_OLYMPICS_SCORE + int(
+        app.government_scholarship) * const.GOVERNMENT_SCHOLARSHIP_SCORE + int(
+        app.military_grants) * const.MILITARY_GRANTS_SCORE + int(
+        app.region_olympics) * const.REGION_OLYMPICS_SCORE + int(app.city_olympics) * const.CITY_OLYMPICS_SCORE, 2)
+    if has_ended_postgraduate:
+        scores['a5'] = round(const.POSTGRADUATE_ENDED_SCORE + int(
+            app.postgraduate_prior_direction) * const.POSTGRADUATE_PRIOR_DIRECTION_SCORE + int(
+            app.compliance_additional_direction) * const.POSTGRADUATE_ADDITIONAL_DIRECTION_SCORE, 2)
+    scores['a6'] = round(int(app.science_experience) * const.SCIENCE_EXPERIENCE_SCORE + int(
+        app.opk_experience) * const.OPK_EXPERIENCE_SCORE + int(
+        app.commercial_experience) * const.COMMERCIAL_EXPERIENCE_SCORE, 2)
+    scores['a7'] = round(int(app.military_sport_achievements) * const.MILITARY_SPORT_ACHIEVEMENTS_SCORE + int(
+        app.sport_achievements) * const.SPORT_ACHIEVEMENTS_SCORE, 2)
+    scores['final_score'] = round(sum(scores[f'a{i}'] * const.MEANING_COEFFICIENTS[f'k{i}'] for i in range(1, 8)), 2)
+    return scores
+
+
 class WorkGroup(models.Model):
     """Рабочая группа, в которую происходит распрежедение забронированных заявок"""
     name = models.CharField(max_length=256, verbose_name='Название рабочей группы')
@@ -73,6 +127,17 @@ class Application(models.Model):
     work_group = models.ForeignKey(WorkGroup, on_delete=models.SET_NULL, blank=True, null=True,
                                    verbose_name="Рабочая группа",
                                    related_name='application')
+    # поля последнего образования, поддерживаются в актуальном состоянии через update_last_education
+    last_university = models.CharField(max_length=256, blank=True, default='', db_index=True,
+                                       verbose_name='Университет последнего образования')
+    last_specialization = models.CharField(max_length=256, blank=True, default='',
+                                           verbose_name='Специальность последнего образования')
+    last_avg_score = models.FloatField(null=True, blank=True, db_index=True,
+                                       verbose_name='Средний балл последнего образования')
+    last_education_type = models.CharField(max_length=1, blank=True, default='',
+                                           verbose_name='Программа последнего образования')
+    search_document = models.TextField(blank=True, default='', verbose_name='Поисковый документ',
+                                       help_text='ФИО, ВУЗ и субъект военкомата в нижнем регистре')
     # дальше идут новые поля для калькулятора
     international_articles = models.BooleanField(default=False,
                                                  verbose_name="Наличие опубликованных научных статей в международных изданиях")
@@ -145,6 +210,58 @@ class Application(models.Model):
         """
         return self.education.all().order_by('-end_year').first()
 
+    def update_last_education(self):
+        """
+        Обновляет поля последнего образования заявки (last_*) по данным из Education
+        """
+        last_education = self.get_last_education()
+        last_education_fields = {
+            'last_university': last_education.university if last_education else '',
+            'last_specialization': last_education.specialization if last_education else '',
+            'last_avg_score': last_education.avg_score if last_education else None,
+            'last_education_type': last_education.education_type if last_education else '',
+        }
+        for field, value in last_education_fields.items():
+            setattr(self, field, value)
+        Application.objects.filter(pk=self.pk).update(**last_education_fields)
+        self.update_search_document()
+
+    def get_search_document(self, subject=''):
+        """
+        Собирает поисковый документ заявки из ФИО кандидата, ВУЗа последнего образования и субъекта военкомата
+        :param subject: субъект военного комиссариата заявки
+        :return: строка в нижнем регистре
+        """
+        return ' '.join(filter(None, [self.member.user.last_name, self.member.user.first_name,
+                                      self.member.father_name, self.last_university, subject])).lower()
+
+    def update_search_document(self):
+        """Обновляет поисковый документ заявки"""
+        search_documents = Application.update_search_documents(Application.objects.filter(pk=self.pk))
+        self.search_document = search_documents.get(self.pk, '')
+
+    @staticmethod
+    def update_search_documents(apps):
+        """
+        Пересчитывает поисковые документы заявок. В SQLite дополнительно обновляет FTS5 таблицу SEARCH_TABLE_NAME
+        :param apps: queryset заявок
+        :return: словарь {id заявки: поисковый документ}
+        """
+        apps = list(apps.select_related('member__user').only(
+            'id', 'military_commissariat', 'last_university', 'member__father_name', 'member__user__first_name',
+            'member__user__last_name'))
+        subjects = dict(MilitaryCommissariat.objects.filter(
+            name__in={app.military_commissariat for app in apps}).values_list('name', 'subject'))
+        for app in apps:
+            app.search_document = app.get_search_document(subjects.get(app.military_commissariat, ''))
+        Application.objects.bulk_update(apps, ['search_document'], batch_size=500)
+        if connection.vendor == 'sqlite' and apps:
+            with connection.cursor() as cursor:
+                cursor.executemany(f'DELETE FROM {SEARCH_TABLE_NAME} WHERE rowid = %s', [(app.id,) for app in apps])
+                cursor.executemany(f'INSERT INTO {SEARCH_TABLE_NAME}(rowid, search_document) VALUES (%s, %s)',
+                                   [(app.id, app.search_document) for app in apps])
+        return {app.id: app.search_document for app in apps}
+
     def calculate_fullness(self) -> int:
         """
         Подсчет заполненности анкеты
@@ -159,45 +276,20 @@ class Application(models.Model):
         Подсчет рейтингового балла заявки оператора по формуле
         :return: рассчитание значение
         """
-        self.scores.a1 = round(int(self.international_articles) * const.INTERNATIONAL_ARTICLES_SCORE + int(
-            self.patents) * const.PATENTS_SCORE + int(self.vac_articles) * const.VAC_ARTICLES_SCORE + int(
-            self.innovation_proposals) * const.INNOVATION_PROPOSALS_SCORE + int(
-            self.rinc_articles) * const.RINC_ARTICLES_SCORE + int(self.evm_register) * const.EVM_REGISTER_SCORE, 2)
-        last_education = self.get_last_education()
-        if last_education:
-            if last_education.education_type == 'b':
-                score = round(last_education.avg_score * const.BACHELOR_COEF, 2)
-            else:
-                score = round(last_education.avg_score * const.SPECIAL_AND_MORE_COEF, 2)
-            self.scores.a2 = score
-        self.scores.a3 = round(int(self.compliance_prior_direction) * const.COMPLIANCE_PRIOR_DIRECTION_SCORE + int(
-            self.compliance_additional_direction) * const.COMPLIANCE_ADDITIONAL_DIRECTION_SCORE, 2)
-        self.scores.a4 = round(int(self.international_olympics) * const.INTERNATIONAL_OLYMPICS_SCORE + int(
-            self.president_scholarship) * const.PRESIDENT_SCHOLARSHIP_SCORE + int(
-            self.country_olympics) * const.COUNTRY_OLYMPICS_SCORE + int(
-            self.government_scholarship) * const.GOVERNMENT_SCHOLARSHIP_SCORE + int(
-            self.military_grants) * const.MILITARY_GRANTS_SCORE + int(
-            self.region_olympics) * const.REGION_OLYMPICS_SCORE + int(self.city_olympics) * const.CITY_OLYMPICS_SCORE,
-                               2)
-        if self.education.filter(education_type=Education.education_program[2][0], is_ended=True).exists():
-            self.scores.a5 = round(const.POSTGRADUATE_ENDED_SCORE + int(
-                self.postgraduate_prior_direction) * const.POSTGRADUATE_PRIOR_DIRECTION_SCORE + int(
-                self.compliance_additional_direction) * const.POSTGRADUATE_ADDITIONAL_DIRECTION_SCORE, 2)
-        self.scores.a6 = round(int(self.science_experience) * const.SCIENCE_EXPERIENCE_SCORE + int(
-            self.opk_experience) * const.OPK_EXPERIENCE_SCORE + int(
-            self.commercial_experience) * const.COMMERCIAL_EXPERIENCE_SCORE, 2)
-        self.scores.a7 = round(int(self.military_sport_achievements) * const.MILITARY_SPORT_ACHIEVEMENTS_SCORE + int(
-            self.sport_achievements) * const.SPORT_ACHIEVEMENTS_SCORE, 2)
+        has_ended_postgraduate = self.education.filter(education_type=Education.education_program[2][0],
+                                                       is_ended=True).exists()
+        scores = calculate_scores(self, has_ended_postgraduate)
+        final_score = scores.pop('final_score')
+        for criterion, score in scores.items():
+            setattr(self.scores, criterion, score)
         self.scores.save()
-        return round(self.scores.a1 * const.MEANING_COEFFICIENTS['k1'] + self.scores.a2 * const.MEANING_COEFFICIENTS[
-            'k2'] + self.scores.a3 * const.MEANING_COEFFICIENTS['k3'] + self.scores.a4 * const.MEANING_COEFFICIENTS[
-                         'k4'] + self.scores.a5 * const.MEANING_COEFFICIENTS['k5'] + self.scores.a6 * \
-                     const.MEANING_COEFFICIENTS['k6'] + self.scores.a7 * const.MEANING_COEFFICIENTS['k7'], 2)
+        return final_score
 
     def get_draft_time(self):
         return f'{self.season[self.draft_season - 1][1]} {self.draft_year}'
 
     def update_scores(self, *args, **kwargs):
+        self.update_last_education()
         self.fullness = self.calculate_fullness()
         if not ApplicationScores.objects.filter(application=self).exists():
             ApplicationScores(application=self).save()
@@ -239,6 +331,15 @@ class Education(models.Model):
     def check_name_uni(self):
         return True if Universities.objects.filter(name=self.university).exists() else False
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.application.update_last_education()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.application.update_last_education()
+        return result
+
     class Meta:
         verbose_name = "Образование"
         verbose_name_plural = "Образование"
@@ -314,11 +415,18 @@ class AdditionFieldApp(models.Model):
 
 
 class Competence(models.Model):
+    """
+    Компетенция в дереве компетенций. Кроме ссылки на родителя хранится материализованный путь path - id всех
+    предков и самой компетенции через "/" ("1/5/12/"), и глубина depth (0 у корня). Путь и глубина поддерживаются
+    сигналом при сохранении, поэтому поддерево и предки любой глубины выбираются одним индексным запросом
+    """
     parent_node = models.ForeignKey('self', on_delete=models.CASCADE, verbose_name='Компетенция-родитель', null=True,
                                     blank=True, related_name='child')
     directions = models.ManyToManyField(Direction, verbose_name='Название направления', blank=True)
     name = models.CharField(max_length=128, verbose_name='Название компетенции')
     is_estimated = models.BooleanField(default=False, verbose_name='Есть оценка')
+    path = models.CharField(max_length=255, default='', db_index=True, editable=False, verbose_name='Путь в дереве')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Глубина в дереве')
 
     def __str__(self):
         return self.name
@@ -328,6 +436,109 @@ class Competence(models.Model):
         verbose_name_plural = "Компетенции"
         ordering = ['name']
 
+    def clean(self):
+        if self.pk and self.parent_node_id and str(self.pk) in self.parent_node.path.split('/'):
+            raise ValidationError({'parent_node': 'Компетенция не может быть дочерней для самой себя или своих потомков'})
+
+    @staticmethod
+    def subtree_q(path, prefix=''):
+        """
+        Условие на компетенции поддерева с путем path (включая его корень). В SQLite строки сравниваются побайтово,
+        поэтому используется диапазон путей [path, path без "/" + "0") ("0" - следующий за "/" символ), который
+        идет по индексу, в отличие от LIKE. В других БД порядок строк зависит от collation (в PostgreSQL с локалью
+        "/" не учитывается при сравнении и "1/5/" оказывается после "10"), поэтому там используется startswith,
+        а для PostgreSQL Django сам создает к db_index полю индекс varchar_pattern_ops для LIKE 'path%'
+        :param prefix: префикс поля для условия через связь, например 'competence__'
+        """
+        if connection.vendor == 'sqlite':
+            return models.Q(**{f'{prefix}path__gte': path, f'{prefix}path__lt': path[:-1] + '0'})
+        return models.Q(**{f'{prefix}path__startswith': path})
+
+    def get_descendants(self, include_self=True):
+        descendants = Competence.objects.filter(Competence.subtree_q(self.path))
+        return descendants if include_self else descendants.exclude(pk=self.pk)
+
+    def get_ancestors(self, include_self=False):
+        ancestor_ids = [int(competence_id) for competence_id in self.path.split('/') if competence_id]
+        if not include_self:
+            ancestor_ids = ancestor_ids[:-1]
+        return Competence.objects.filter(id__in=ancestor_ids).order_by('depth')
+
+    @staticmethod
+    def get_tree(competences=None):
+        """
+        Собирает дерево компетенций любой глубины из одного запроса: у каждой компетенции children - список дочерних
+        в порядке имени
+        :param competences: загружаемые компетенции (по умолчанию все)
+        :return: список корней - компетенций, родителя которых нет среди загруженных
+        """
+        competences = list(Competence.objects.all() if competences is None else competences)
+        competences_by_id = {competence.id: competence for competence in competences}
+        roots = []
+        for competence in competences:
+            competence.children = []
+        for competence in competences:
+            parent = competences_by_id.get(competence.parent_node_id)
+            (parent.children if parent else roots).append(competence)
+        return roots
+
+    @staticmethod
+    def get_direction_coverage(direction):
+        """
+        Возвращает покрытие деревьев компетенций направлением одним запросом:
+        {id корня: (количество компетенций дерева в направлении, всего компетенций в дереве)}
+        """
+        root_id = Substr('path', 1, StrIndex('path', models.Value('/')) - 1)
+        coverage = Competence.objects.order_by().annotate(root_id=root_id).values('root_id').annotate(
+            picked=models.Count('id', filter=models.Q(directions=direction), distinct=True),
+            total=models.Count('id', distinct=True)).values_list('root_id', 'picked', 'total')
+        return {int(root_id): (picked, total) for root_id, picked, total in coverage if root_id}
+
+
+class DirectionCompetences:
+    """
+    Компетенции направления: picked_ids - id выбранных в направлении компетенций,
+    chosen_roots_id - корни деревьев, в которых выбрана хотя бы одна компетенция,
+    completed_roots_id - корни деревьев, все компетенции которых выбраны.
+    Хранится в кэше DIRECTION_COMPETENCES_CACHE_TIMEOUT секунд и сбрасывается при изменении компетенций направления
+    или дерева компетенций
+    """
+
+    def __init__(self, picked_ids, coverage):
+        self.picked_ids = set(picked_ids)
+        self.chosen_roots_id = {root_id for root_id, (picked, total) in coverage.items() if picked > 0}
+        self.completed_roots_id = {root_id for root_id, (picked, total) in coverage.items() if picked == total}
+
+    @staticmethod
+    def get_cache_key(direction_id):
+        return f'direction_competences_{direction_id}'
+
+    @classmethod
+    def load(cls, direction_id):
+        """Возвращает компетенции направления с id direction_id из кэша или из БД"""
+        key = cls.get_cache_key(direction_id)
+        data = cache.get(key)
+        if data is None:
+            data = (list(Competence.objects.filter(directions=direction_id).order_by().values_list('id', flat=True)),
+                    Competence.get_direction_coverage(direction_id))
+            cache.set(key, data, const.DIRECTION_COMPETENCES_CACHE_TIMEOUT)
+        return cls(*data)
+
+    @classmethod
+    def clear_cache(cls, directions_id=None):
+        """
+        Сбрасывает кэш направлений directions_id или всех направлений, если они не переданы. Кэш сбрасывается после
+        фиксации транзакции, иначе параллельный запрос успел бы снова закэшировать еще не измененные данные
+        """
+        if directions_id is not None:
+            directions_id = list(directions_id)
+
+        def clear():
+            keys_id = Direction.objects.values_list('id', flat=True) if directions_id is None else directions_id
+            cache.delete_many([cls.get_cache_key(direction_id) for direction_id in keys_id])
+
+        transaction.on_commit(clear)
+
 
 class ApplicationCompetencies(models.Model):
     competence_levels = [
@@ -356,16 +567,15 @@ class Universities(models.Model):
     def __str__(self):
         return self.name
 
-    @staticmethod
-    def get_by_name_or_leave(name):
-        uni = Universities.objects.filter(name=name).first()
-        return uni if uni else name
-
     class Meta:
         verbose_name = 'Университет'
         verbose_name_plural = 'Университеты'
 
 
+# заметки к заявке, видимые мастеру: own - его заметка (или None), others - список заметок других авторов
+ApplicationNotes = namedtuple('ApplicationNotes', ['own', 'others'])
+
+
 class ApplicationNote(models.Model):
     application = models.ForeignKey(Application, verbose_name='Анкета', on_delete=models.CASCADE, related_name='notes')
     affiliations = models.ManyToManyField(Affiliation, verbose_name="Принадлежность", blank=True)
@@ -379,6 +589,30 @@ class ApplicationNote(models.Model):
     def __str__(self):
         return f'{self.text}'
 
+    @staticmethod
+    def get_visible_notes(app_ids, member, master_affiliations_id):
+        """
+        Возвращает заметки к заявкам app_ids, видимые мастеру member (привязанные к его принадлежностям),
+        одним запросом: {id заявки: ApplicationNotes}, где own - заметка мастера или None, others - заметки других
+        авторов в порядке создания
+        """
+        notes = {}
+        app_ids = list(app_ids)
+        if not app_ids or not master_affiliations_id:
+            return notes
+        visible_notes = ApplicationNote.objects.filter(
+            application__in=app_ids, affiliations__in=master_affiliations_id).distinct().select_related(
+            'author', 'author__user').only('id', 'application_id', 'text', 'author__father_name',
+                                           'author__user__first_name', 'author__user__last_name').order_by('id')
+        for note in visible_notes:
+            app_notes = notes.setdefault(note.application_id, ApplicationNotes(None, []))
+            if note.author_id == member.id:
+                if app_notes.own is None:
+                    notes[note.application_id] = app_notes._replace(own=note)
+            else:
+                app_notes.others.append(note)
+        return notes
+
 
 class ApplicationScores(models.Model):
     application = models.OneToOneField(Application, on_delete=models.CASCADE, verbose_name='Заявка',
@@ -413,6 +647,16 @@ class MilitaryCommissariat(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        old_name = MilitaryCommissariat.objects.filter(pk=self.pk).values_list('name', flat=True).first()
+        super().save(*args, **kwargs)
+        Application.update_search_documents(Application.objects.filter(military_commissariat__in={self.name, old_name}))
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        Application.update_search_documents(Application.objects.filter(military_commissariat=self.name))
+        return result
+
     class Meta:
         verbose_name = 'Военный комиссариат'
         verbose_name_plural = 'Военные комиссариаты'
@@ -424,11 +668,6 @@ class Specialization(models.Model):
     def __str__(self):
         return self.name
 
-    @staticmethod
-    def get_by_name_or_leave(name):
-        spec = Specialization.objects.filter(name=name).first()
-        return spec if spec else name
-
     class Meta:
         verbose_name = 'Специальность'
         verbose_name_plural = 'Специальности'
@@ -442,9 +681,418 @@ class AppsViewedByMaster(models.Model):
     class Meta:
         verbose_name = 'Просмотренная заявка пользователем'
         verbose_name_plural = 'Просмотренные заявки пользователями'
+        constraints = [models.UniqueConstraint(fields=['member', 'application'], name='unique_viewed_app')]
 
     @staticmethod
     def get_viewed_app_ids_from_member(member, apps):
-        """ Возвращает список id анкет, которые были просмотрены переданным мембером"""
-        return AppsViewedByMaster.objects.filter(member=member, application__in=apps).values_list('application_id',
-                                                                                                  flat=True)
+        """ Возвращает множество id анкет, которые были просмотрены переданным мембером (в том числе еще не
+        сохраненные метки из буфера просмотров)"""
+        apps = list(apps)
+        viewed_app_ids = set(AppsViewedByMaster.objects.filter(member=member, application__in=apps).values_list(
+            'application_id', flat=True))
+        return viewed_app_ids | viewed_apps_buffer.get_pending_app_ids(member.id, apps)
+
+    @staticmethod
+    def add_viewed_apps(marks):
+        """
+        Сохраняет метки просмотра marks - пары (id участника, id заявки). Уже сохраненные метки и метки удаленных
+        заявок и участников пропускаются, счетчики просмотренных заявок увеличиваются на число новых меток
+        (bulk_create не отправляет post_save)
+        :return: количество новых меток
+        """
+        marks = set(marks)
+        member_ids = {member_id for member_id, _ in marks}
+        app_ids = {app_id for _, app_id in marks}
+        marks -= set(AppsViewedByMaster.objects.filter(member__in=member_ids, application__in=app_ids).values_list(
+            'member_id', 'application_id'))
+        draft_times = {app_id: (draft_year, draft_season) for app_id, draft_year, draft_season in
+                       Application.objects.filter(pk__in={app_id for _, app_id in marks}).values_list(
+                           'id', 'draft_year', 'draft_season')}
+        member_ids = set(Member.objects.filter(pk__in={member_id for member_id, _ in marks}).values_list('id', flat=True))
+        marks = [(member_id, app_id) for member_id, app_id in marks if member_id in member_ids and app_id in draft_times]
+        with transaction.atomic():
+            AppsViewedByMaster.objects.bulk_create(
+                [AppsViewedByMaster(member_id=member_id, application_id=app_id) for member_id, app_id in marks],
+                ignore_conflicts=True)
+            for (member_id, draft_year, draft_season), count in Counter(
+                    (member_id, *draft_times[app_id]) for member_id, app_id in marks).items():
+                ViewedAppsCounter.change_count(count, member_id=member_id, draft_year=draft_year,
+                                               draft_season=draft_season)
+        return len(marks)
+
+
+class AppsCounter(models.Model):
+    """
+    Счетчик заявок призыва, который поддерживается инкрементально сигналами заявок и просмотров.
+    Полностью пересчитывается командой rebuild_apps_counters
+    """
+    draft_year = models.IntegerField(verbose_name='Год призыва')
+    draft_season = models.IntegerField(choices=Application.season, verbose_name='Сезон призыва')
+    count = models.IntegerField(default=0, verbose_name='Количество заявок')
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def change_count(cls, delta, **keys):
+        """Изменяет на delta счетчик с ключом keys одним UPDATE, а если счетчика еще нет - создает его"""
+        if cls.objects.filter(**keys).update(count=models.F('count') + delta):
+            return
+        _, created = cls.objects.get_or_create(**keys, defaults={'count': delta})
+        if not created:
+            cls.objects.filter(**keys).update(count=models.F('count') + delta)
+
+
+class SeasonAppsCounter(AppsCounter):
+    """ Количество заявок призыва """
+
+    class Meta:
+        verbose_name = 'Счетчик заявок призыва'
+        verbose_name_plural = 'Счетчики заявок призывов'
+        constraints = [models.UniqueConstraint(fields=['draft_year', 'draft_season'], name='unique_season_apps_counter')]
+
+    @staticmethod
+    def count_not_viewed(member, draft_year, draft_season):
+        """Возвращает количество заявок призыва, которые мастер member еще не просматривал, одним запросом"""
+        viewed = ViewedAppsCounter.objects.filter(member=member, draft_year=models.OuterRef('draft_year'),
+                                                  draft_season=models.OuterRef('draft_season')).values('count')[:1]
+        counts = SeasonAppsCounter.objects.filter(draft_year=draft_year, draft_season=draft_season).annotate(
+            viewed=models.Subquery(viewed)).values_list('count', 'viewed').first()
+        if not counts:
+            return 0
+        total, viewed = counts
+        return max(total - (viewed or 0), 0)
+
+
+class ViewedAppsCounter(AppsCounter):
+    """ Количество заявок призыва, просмотренных мастером """
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, verbose_name='Пользователь')
+
+    class Meta:
+        verbose_name = 'Счетчик просмотренных заявок'
+        verbose_name_plural = 'Счетчики просмотренных заявок'
+        constraints = [models.UniqueConstraint(fields=['member', 'draft_year', 'draft_season'],
+                                               name='unique_viewed_apps_counter')]
+
+
+def rebuild_apps_counters():
+    """Пересчитывает все счетчики заявок по заявкам и меткам просмотра"""
+    with transaction.atomic():
+        SeasonAppsCounter.objects.all().delete()
+        SeasonAppsCounter.objects.bulk_create(
+            SeasonAppsCounter(draft_year=draft_year, draft_season=draft_season, count=count)
+            for draft_year, draft_season, count in Application.objects.order_by().values_list(
+                'draft_year', 'draft_season').annotate(models.Count('id')))
+        ViewedAppsCounter.objects.all().delete()
+        ViewedAppsCounter.objects.bulk_create(
+            ViewedAppsCounter(member_id=member_id, draft_year=draft_year, draft_season=draft_season, count=count)
+            for member_id, draft_year, draft_season, count in AppsViewedByMaster.objects.order_by().values_list(
+                'member', 'application__draft_year', 'application__draft_season').annotate(
+                models.Count('application', distinct=True)))
+
+
+class ViewedAppsBuffer:
+    """
+    Буфер меток просмотра заявок мастерами в памяти процесса. Метки накапливаются при просмотре заявки и
+    сохраняются одной пачкой (AppsViewedByMaster.add_viewed_apps), когда их набирается flush_size или через
+    flush_interval секунд после первой несохраненной метки (по таймеру в фоновом потоке)
+    """
+
+    def __init__(self, flush_size=const.VIEWED_APPS_FLUSH_SIZE, flush_interval=const.VIEWED_APPS_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, member_id, application_id):
+        """Добавляет метку просмотра и сохраняет буфер, если он заполнен, иначе запускает таймер сохранения"""
+        with self._lock:
+            self._pending.add((member_id, application_id))
+            need_flush = len(self._pending) >= self.flush_size
+            if not need_flush:
+                self._start_timer()
+        if need_flush:
+            self.flush()
+
+    def get_pending_app_ids(self, member_id, app_ids):
+        """Возвращает id заявок из app_ids, метки просмотра которых участником member_id еще не сохранены"""
+        with self._lock:
+            return {app_id for app_id in app_ids if (member_id, app_id) in self._pending}
+
+    def flush(self):
+        """Сохраняет накопленные метки. Если БД недоступна, метки возвращаются в буфер до следующего сохранения"""
+        with self._lock:
+            marks, self._pending = self._pending, set()
+            self._cancel_timer()
+        if not marks:
+            return 0
+        try:
+            return AppsViewedByMaster.add_viewed_apps(marks)
+        except DatabaseError as e:
+            logger.error(f'Не удалось сохранить метки просмотра заявок - {e}')
+            with self._lock:
+                self._pending |= marks
+                self._start_timer()
+            return 0
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._cancel_timer()
+
+    def _start_timer(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_by_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _flush_by_timer(self):
+        """Сохраняет метки из потока таймера и закрывает соединение с БД, открытое в этом потоке"""
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def __len__(self):
+        return len(self._pending)
+
+
+viewed_apps_buffer = ViewedAppsBuffer()
+
+
+class ImportJob(models.Model):
+    """Задача импорта анкет из excel файла, которую выполняет обработчик очереди (manage.py run_jobs)"""
+    QUEUED, RUNNING, DONE, FAILED = 'q', 'r', 'd', 'f'
+    statuses = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Завершена'),
+        (FAILED, 'Ошибка'),
+    ]
+    file = models.FileField(upload_to='imports/%Y/%m/%d', verbose_name='Файл импорта')
+    file_name = models.CharField(max_length=256, verbose_name='Название файла')
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Автор')
+    status = models.CharField(max_length=1, choices=statuses, default=QUEUED, db_index=True, verbose_name='Статус')
+    create_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    start_date = models.DateTimeField(null=True, blank=True, verbose_name='Дата начала обработки')
+    end_date = models.DateTimeField(null=True, blank=True, verbose_name='Дата окончания обработки')
+    rows_processed = models.IntegerField(default=0, verbose_name='Обработано анкет')
+    accepted_count = models.IntegerField(default=0, verbose_name='Загружено анкет')
+    errors_count = models.IntegerField(default=0, verbose_name='Ошибок')
+    report = models.JSONField(default=dict, blank=True, verbose_name='Отчет',
+                              help_text='Сообщения импорта вида {"accepted": [...], "errors": [...]}')
+    error = models.TextField(blank=True, verbose_name='Ошибка выполнения')
+
+    class Meta:
+        verbose_name = 'Задача импорта анкет'
+        verbose_name_plural = 'Задачи импорта анкет'
+        ordering = ['-create_date']
+
+    def __str__(self):
+        return f'{self.file_name} ({self.get_status_display()})'
+
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @staticmethod
+    def take_next():
+        """
+        Забирает из очереди самую раннюю задачу и переводит ее в статус выполнения. Задача забирается условным
+        UPDATE, поэтому одну задачу не получат несколько обработчиков
+        :return: задача или None, если очередь пуста
+        """
+        while job := ImportJob.objects.filter(status=ImportJob.QUEUED).order_by('id').first():
+            start_date = timezone.now()
+            if ImportJob.objects.filter(pk=job.pk, status=ImportJob.QUEUED).update(status=ImportJob.RUNNING,
+                                                                                    start_date=start_date):
+                job.status, job.start_date = ImportJob.RUNNING, start_date
+                return job
+        return None
+
+    @staticmethod
+    def fail_stale(timeout=const.JOBS_RUNNING_TIMEOUT):
+        """
+        Завершает с ошибкой задачи, которые выполняются дольше timeout секунд: их обработчик упал или был
+        перезапущен, и без этого задача осталась бы в статусе выполнения навсегда
+        :return: количество завершенных задач
+        """
+        now = timezone.now()
+        return ImportJob.objects.filter(status=ImportJob.RUNNING, start_date__lt=now - datetime.timedelta(
+            seconds=timeout)).update(status=ImportJob.FAILED, end_date=now,
+                                     error=f'Задача прервана: обработчик не завершил ее за {timeout} с')
+
+    def update_progress(self, rows_processed, result):
+        """Сохраняет количество обработанных анкет, загруженных анкет и ошибок"""
+        self.rows_processed = rows_processed
+        self.accepted_count = len(result['accepted'])
+        self.errors_count = len(result['errors'])
+        ImportJob.objects.filter(pk=self.pk).update(rows_processed=self.rows_processed,
+                                                    accepted_count=self.accepted_count, errors_count=self.errors_count)
+
+    def finish(self, result=None, error=''):
+        """Сохраняет отчет и завершает задачу. Если передана ошибка, задача завершается со статусом FAILED"""
+        if result is not None:
+            self.report = result
+            self.accepted_count = len(result['accepted'])
+            self.errors_count = len(result['errors'])
+        self.error = error
+        self.status = self.FAILED if error else self.DONE
+        self.end_date = timezone.now()
+        self.save(update_fields=['report', 'accepted_count', 'errors_count', 'error', 'status', 'end_date'])
+
+    def get_report_text(self):
+        """Возвращает отчет об импорте в текстовом виде"""
+        lines = [f'Файл: {self.file_name}', f'Статус: {self.get_status_display()}',
+                 f'Обработано анкет: {self.rows_processed}', '']
+        if self.error:
+            lines.extend(['Ошибка выполнения:', self.error, ''])
+        lines.extend(['Успешно добавленные анкеты:', *self.report.get('accepted', []), ''])
+        lines.extend(['Ошибки:', *self.report.get('errors', [])])
+        return '\n'.join(lines)
+
+
+@receiver(models.signals.post_save, sender=File)
+@receiver(models.signals.post_delete, sender=File)
+def invalidate_docx_template_cache(sender, instance, **kwargs):
+    """Удаляет из кэша ворд шаблонов измененный или удаленный файл-шаблон"""
+    if instance.is_template and instance.file_path:
+        docx_template_cache.invalidate(instance.file_path.path)
+
+
+@receiver(models.signals.post_save, sender=User)
+@receiver(models.signals.post_save, sender=Member)
+def update_member_search_documents(sender, instance, created, update_fields=None, **kwargs):
+    """Обновляет поисковые документы заявок при изменении ФИО пользователя"""
+    if created or (update_fields and not {'first_name', 'last_name', 'father_name'} & set(update_fields)):
+        return
+    user_filter = {'member__user': instance} if sender is User else {'member': instance}
+    Application.update_search_documents(Application.objects.filter(**user_filter))
+
+
+@receiver(models.signals.pre_save, sender=Competence)
+def set_competence_path(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Пересчитывает путь и глубину сохраняемой компетенции по пути родителя из БД (путь в памяти может быть
+    устаревшим) и запоминает прежний путь, чтобы после сохранения перенести ее поддерево
+    """
+    if raw or instance.pk is None or (update_fields is not None and 'parent_node' not in update_fields):
+        return
+    paths = dict(Competence.objects.filter(pk__in=[instance.pk, instance.parent_node_id]).values_list('id', 'path'))
+    parent_path = paths.get(instance.parent_node_id, '') if instance.parent_node_id else ''
+    instance._old_path = paths.get(instance.pk)
+    instance.path = f'{parent_path}{instance.pk}/'
+    instance.depth = instance.path.count('/') - 1
+
+
+@receiver(models.signals.post_save, sender=Competence)
+def update_competence_subtree_paths(sender, instance, created, raw=False, **kwargs):
+    """
+    Сохраняет путь новой компетенции (id известен только после вставки), а при смене родителя обновляет пути
+    и глубину всего поддерева одним UPDATE
+    """
+    if raw:
+        return
+    old_path = instance.__dict__.pop('_old_path', None)
+    if created and not instance.path:
+        parent_path = ''
+        if instance.parent_node_id:
+            parent_path = Competence.objects.filter(pk=instance.parent_node_id).values_list('path', flat=True).get()
+        instance.path = f'{parent_path}{instance.pk}/'
+        instance.depth = instance.path.count('/') - 1
+        Competence.objects.filter(pk=instance.pk).update(path=instance.path, depth=instance.depth)
+    elif old_path and old_path != instance.path:
+        Competence.objects.filter(Competence.subtree_q(old_path)).exclude(pk=instance.pk).update(
+            path=Concat(models.Value(instance.path), Substr('path', len(old_path) + 1)),
+            depth=models.F('depth') + instance.depth - (old_path.count('/') - 1))
+
+
+@receiver(models.signals.post_save, sender=Competence)
+@receiver(models.signals.post_delete, sender=Competence)
+def clear_direction_competences_on_competence_change(sender, instance, **kwargs):
+    """Сбрасывает кэш компетенций всех направлений: изменилось дерево компетенций"""
+    DirectionCompetences.clear_cache()
+
+
+@receiver(models.signals.m2m_changed, sender=Competence.directions.through)
+def clear_direction_competences_on_directions_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает кэш компетенций направлений, в которые добавили или из которых удалили компетенции"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        DirectionCompetences.clear_cache([instance.pk])
+    elif action == 'pre_clear':
+        DirectionCompetences.clear_cache(instance.directions.values_list('id', flat=True))
+    else:
+        DirectionCompetences.clear_cache(pk_set)
+
+
+@receiver(models.signals.pre_save, sender=Application)
+def remember_application_draft_time(sender, instance, raw=False, **kwargs):
+    """Запоминает год и сезон призыва, которые были у заявки до сохранения"""
+    if instance.pk and not raw:
+        instance._old_draft_time = Application.objects.filter(pk=instance.pk).values_list(
+            'draft_year', 'draft_season').first()
+
+
+@receiver(models.signals.post_save, sender=Application)
+def update_apps_counters_on_application_save(sender, instance, created, raw=False, **kwargs):
+    """Обновляет счетчики заявок при создании заявки или изменении ее года/сезона призыва"""
+    if raw:
+        return
+    new_draft_time = (instance.draft_year, instance.draft_season)
+    old_draft_time = None if created else instance.__dict__.pop('_old_draft_time', None)
+    if created or not old_draft_time:
+        SeasonAppsCounter.change_count(1, draft_year=instance.draft_year, draft_season=instance.draft_season)
+        return
+    if old_draft_time == new_draft_time:
+        return
+    old_year, old_season = old_draft_time
+    SeasonAppsCounter.change_count(-1, draft_year=old_year, draft_season=old_season)
+    SeasonAppsCounter.change_count(1, draft_year=instance.draft_year, draft_season=instance.draft_season)
+    for member_id in AppsViewedByMaster.objects.filter(application=instance).values_list('member_id', flat=True):
+        ViewedAppsCounter.change_count(-1, member_id=member_id, draft_year=old_year, draft_season=old_season)
+        ViewedAppsCounter.change_count(1, member_id=member_id, draft_year=instance.draft_year,
+                                       draft_season=instance.draft_season)
+
+
+@receiver(models.signals.post_delete, sender=Application)
+def update_apps_counters_on_application_delete(sender, instance, **kwargs):
+    SeasonAppsCounter.change_count(-1, draft_year=instance.draft_year, draft_season=instance.draft_season)
+
+
+@receiver(models.signals.post_delete, sender=Application)
+def delete_application_search_document(sender, instance, **kwargs):
+    """Удаляет поисковый документ удаленной заявки из FTS5 таблицы SQLite, иначе он продолжит находиться поиском"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE_NAME} WHERE rowid = %s', [instance.pk])
+
+
+def _change_viewed_apps_counter(viewed_app, delta):
+    if AppsViewedByMaster._meta.get_field('application').is_cached(viewed_app):
+        draft_time = viewed_app.application.draft_year, viewed_app.application.draft_season
+    else:
+        draft_time = Application.objects.filter(pk=viewed_app.application_id).values_list(
+            'draft_year', 'draft_season').first()
+    if draft_time:
+        ViewedAppsCounter.change_count(delta, member_id=viewed_app.member_id, draft_year=draft_time[0],
+                                       draft_season=draft_time[1])
+
+
+@receiver(models.signals.post_save, sender=AppsViewedByMaster)
+def update_viewed_apps_counter_on_view(sender, instance, created, raw=False, **kwargs):
+    """Увеличивает счетчик просмотренных мастером заявок при добавлении метки просмотра"""
+    if created and not raw:
+        _change_viewed_apps_counter(instance, 1)
+
+
+@receiver(models.signals.post_delete, sender=AppsViewedByMaster)
+def update_viewed_apps_counter_on_delete(sender, instance, **kwargs):
+    """Уменьшает счетчик просмотренных мастером заявок при удалении метки просмотра (в том числе вместе с заявкой)"""
+    _change_viewed_apps_counter(instance, -1)
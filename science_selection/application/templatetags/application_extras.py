@@ -1,8 +1,8 @@
 from django import template
 
-from account.models import Affiliation
-from application.models import ApplicationNote, Education, Application, AppsViewedByMaster
-from application.utils import is_booked_our
+from application.models import Education, SeasonAppsCounter
+from application.utils import is_booked_our, set_application_notes
+from utils.calculations import get_current_draft_year
 
 register = template.Library()
 
@@ -12,6 +12,12 @@ def get_key(value, arg):
     return value.get(arg, None)
 
 
+@register.filter(name='competence_font_size')
+def get_competence_font_size(depth):
+    """Возвращает класс размера шрифта компетенции по ее глубине в дереве: fs-4 у корня, не меньше fs-6 у потомков"""
+    return f'fs-{min(depth + 4, 6)}'
+
+
 @register.filter(name='intersections')
 def get_intersections(value, arg):
     if value and arg:
@@ -48,12 +54,10 @@ def init_field(field, init):
 
 @register.inclusion_tag('application/tags/application_note_tag.html')
 def get_application_note(application, user):
-    master_affiliations = Affiliation.objects.filter(member=user.member)
-    other_notes = ApplicationNote.objects.filter(application=application, affiliations__in=master_affiliations,
-                                                 ).exclude(author=user.member).distinct()
-    app_note = ApplicationNote.objects.filter(application=application, affiliations__in=master_affiliations,
-                                              author=user.member).distinct()
-    return {'app_note': app_note.first(), 'application': application, 'other_notes': other_notes}
+    """Рендерит заметки к заявке. Заметки, уже загруженные представлением (set_application_notes), не загружаются"""
+    if not hasattr(application, 'other_notes'):
+        set_application_notes([application], user.member, user.member.get_master_context().affiliations_id)
+    return {'app_note': application.app_note, 'application': application, 'other_notes': application.other_notes}
 
 
 @register.inclusion_tag('application/tags/is_final_switch_tag.html')
@@ -102,6 +106,6 @@ def get_test_result(test_id, results):
 
 @register.simple_tag
 def count_number_apps_not_viewed(user):
-    total_apps = Application.objects.count()
-    num_apps_viewed = AppsViewedByMaster.objects.filter(member=user.member).count()
-    return total_apps - num_apps_viewed
+    """Количество заявок текущего призыва, которые мастер еще не просматривал (по счетчикам, одним запросом)"""
+    current_year, current_season = get_current_draft_year()
+    return SeasonAppsCounter.count_not_viewed(user.member, current_year, current_season[0])
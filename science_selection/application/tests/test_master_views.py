@@ -1,16 +1,32 @@
 import datetime
+import re
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.db.models import Q
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from openpyxl import load_workbook
 
 from account.models import Affiliation, Booking, BookingType
 from account.models import Role, Member
-from application.models import Direction, Education, Application, Competence, WorkGroup
+from application.models import Direction, Education, Application, Competence, WorkGroup, ApplicationCompetencies, \
+    ImportJob, AppsViewedByMaster, ApplicationNote, viewed_apps_buffer, DirectionCompetences
+from application.tests.test_models import create_import_workbook
+from application.views import ApplicationListView
+from application.utils import set_booking_status
 from testing.models import Test, TypeOfTest
 from utils.calculations import get_current_draft_year
-from utils.constants import SLAVE_ROLE_NAME, MASTER_ROLE_NAME, BOOKED, IN_WISHLIST
+from utils.constants import SLAVE_ROLE_NAME, MASTER_ROLE_NAME, BOOKED, IN_WISHLIST, HEADERS_FOR_EXCEL_APP_TABLES, \
+    WORK_LIST_HEADERS_FOR_EXCEL
 
 
 class ApplicationListTest(TestCase):
@@ -65,7 +81,9 @@ class ApplicationListTest(TestCase):
         cls.master_member = master_member
 
     def setUp(self) -> None:
-        pass
+        # метки просмотра заявок копятся в буфере процесса и не должны переходить в другие тесты
+        viewed_apps_buffer.clear()
+        self.addCleanup(viewed_apps_buffer.clear)
 
     def test_redirect_if_not_logged_in(self):
         resp = self.client.get(reverse('application_list'))
@@ -93,6 +111,28 @@ class ApplicationListTest(TestCase):
         resp = self.client.get(reverse('application_list'))
         self.assertEqual(resp.status_code, 403)
 
+    def test_member_query_in_master_views(self):
+        """
+        Проверяет, что на страницах отбирающего его участник загружается одним запросом вместе с ролью,
+        а участники кандидатов на странице не учитываются
+        """
+        self.client.login(username='master', password='master')
+        application = Application.objects.get(member__user__username='testuser1')
+        master = self.master_member
+        own_member = re.compile(rf'"account_member"\."(user_id" = {master.user_id}|id" = {master.pk})\b')
+        urls = [reverse('home_master'), reverse('application_list'), reverse('application', args=[application.pk]),
+                reverse('competence_list'), reverse('work_list'), reverse('work_group_list'), reverse('test_list'),
+                reverse('test_results'), reverse('documents_templates')]
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    resp = self.client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                member_queries = [query['sql'] for query in queries if 'FROM "account_role"' in query['sql']
+                                  or 'FROM "account_member"' in query['sql'] and own_member.search(query['sql'])]
+                self.assertEqual(len(member_queries), 1)
+                self.assertIn('JOIN "account_role"', member_queries[0])
+
     def test_objects_list(self):
         """Проверяет, что на начальном экране показываются анкеты только для текущего года и сезона"""
         self.client.login(username='master', password='master')
@@ -150,6 +190,71 @@ class ApplicationListTest(TestCase):
             reverse('application_list') + '?ordering=member__user__last_name&draft_season=1')
         self.assertEqual(len(resp.context['object_list']), 3)
 
+    def test_search(self):
+        """Проверяет поиск по фамилии и названию вуза без учета регистра"""
+        self.client.login(username='master', password='master')
+        url = reverse('application_list') + '?draft_season=1&draft_season=2&search='
+        resp = self.client.get(url + 'testuser3')
+        self.assertEqual([app.member.user.username for app in resp.context['object_list']], ['testuser3'])
+        resp = self.client.get(url + 'мэи')
+        self.assertEqual(len(resp.context['object_list']), 5)
+        resp = self.client.get(url + 'TESTUSER4 Москва')
+        self.assertEqual([app.member.user.username for app in resp.context['object_list']], ['testuser4'])
+
+    @mock.patch.object(ApplicationListView, 'paginate_by', 4)
+    def test_keyset_pagination(self):
+        """Проверяет, что пагинация по ключу выдает те же заявки в том же порядке, что и обычная"""
+        self.client.login(username='master', password='master')
+        url = reverse('application_list') + '?ordering=-final_score&draft_season=1&draft_season=2'
+        offset_apps = [*self.client.get(url).context['object_list'],
+                       *self.client.get(url + '&page=2').context['object_list']]
+        resp = self.client.get(url + '&cursor=')
+        first_page = resp.context['page_obj']
+        self.assertEqual((first_page.number, first_page.paginator.count), (1, 6))
+        self.assertFalse(first_page.has_previous())
+        resp = self.client.get(url + '&cursor=' + first_page.next_cursor)
+        second_page = resp.context['page_obj']
+        self.assertEqual(second_page.number, 2)
+        self.assertFalse(second_page.has_next())
+        self.assertEqual([*first_page.object_list, *second_page.object_list], offset_apps)
+        # нумерация строк (get_object_number) продолжается со второй страницы
+        self.assertTrue(resp.context['is_paginated'])
+        self.assertEqual((second_page.start_index(), second_page.paginator.per_page), (5, 4))
+        resp = self.client.get(url + '&cursor=' + second_page.previous_cursor)
+        self.assertEqual(list(resp.context['page_obj'].object_list), list(first_page.object_list))
+        resp = self.client.get(url + '&cursor=broken')
+        self.assertEqual(list(resp.context['page_obj'].object_list), list(first_page.object_list))
+
+    def test_download_applications(self):
+        """Проверяет, что список заявок выгружается в excel файлом, который отдается потоком"""
+        self.client.login(username='master', password='master')
+        resp = self.client.get(reverse('downloading_applications') + '?draft_season=1&draft_season=2')
+        self.assertTrue(resp.streaming)
+        sheet = load_workbook(BytesIO(b''.join(resp.streaming_content))).active
+        rows = list(sheet.values)
+        self.assertEqual(list(rows[0]), HEADERS_FOR_EXCEL_APP_TABLES)
+        self.assertEqual(len(rows), 7)
+
+    @mock.patch('utils.constants.PATH_TO_INTERVIEW_LIST', 'static/docx/templates/interview_list.docx')
+    def test_download_interview_lists(self):
+        """Проверяет, что листы собеседования отфильтрованных заявок отдаются потоком в zip архиве и совпадают
+        с листами, которые создаются по одному"""
+        self.client.login(username='master', password='master')
+        resp = self.client.get(reverse('downloading_interview_lists') + '?draft_season=1&draft_season=2')
+        self.assertTrue(resp.streaming)
+        with zipfile.ZipFile(BytesIO(b''.join(resp.streaming_content))) as archive:
+            documents = {name: archive.read(name) for name in archive.namelist()}
+        self.assertEqual(len(documents), 6)
+        for app in Application.objects.select_related('member__user'):
+            single = self.client.get(reverse('create_word_app', kwargs={'pk': app.id})).content
+            with zipfile.ZipFile(BytesIO(documents[f'Анкета_{app.member.user.last_name}_{app.id}.docx'])) as bulk_docx, \
+                    zipfile.ZipFile(BytesIO(single)) as single_docx:
+                self.assertEqual(bulk_docx.read('word/document.xml'), single_docx.read('word/document.xml'))
+
+        resp = self.client.get(reverse('downloading_interview_lists') + '?draft_season=1')
+        with zipfile.ZipFile(BytesIO(b''.join(resp.streaming_content))) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+
     def test_booked_wishlist_flags(self):
         self.client.login(username='master', password='master')
         resp = self.client.get(
@@ -163,6 +268,64 @@ class ApplicationListTest(TestCase):
                 wishlist += 1
         self.assertEqual((wishlist, booked), (1, 1))
 
+    def test_booking_status_in_one_query(self):
+        """Проверяет, что статусы бронирования всех заявок рассчитываются одним запросом"""
+        apps = list(Application.objects.all())
+        master_affiliations_id = Affiliation.objects.filter(member=ApplicationListTest.master_member).values_list(
+            'id', flat=True)
+        master_affiliations_id = list(master_affiliations_id)
+        with self.assertNumQueries(1):
+            set_booking_status(apps, ApplicationListTest.master_member, master_affiliations_id)
+        booked_app = next(app for app in apps if app.member.user.username == 'testuser1')
+        wishlist_app = next(app for app in apps if app.member.user.username == 'testuser2')
+        self.assertEqual((booked_app.is_booked, booked_app.is_booked_our, booked_app.can_unbook), (True, True, True))
+        self.assertEqual((booked_app.company, booked_app.platoon), (1, 1))
+        self.assertEqual((wishlist_app.is_booked, wishlist_app.is_in_wishlist, wishlist_app.wishlist_len),
+                         (False, True, 1))
+        self.assertEqual(sum(app.is_booked for app in apps), 1)
+
+    def test_notes(self):
+        master_role = Role.objects.get(role_name=MASTER_ROLE_NAME)
+        other_master = Member.objects.create(user=User.objects.create_user(username='other', last_name='Другой'),
+                                             role=master_role, phone='89998887765')
+        aff1, aff2, foreign_aff = (Affiliation.objects.get(company=i, platoon=i) for i in (1, 2, 3))
+        self.client.login(username='master', password='master')
+        app1, app2, app3 = self.client.get(reverse('application_list')).context['application_list'][:3]
+        own_note = ApplicationNote.objects.create(application=app1, author=self.master_member, text='Своя заметка')
+        own_note.affiliations.add(aff1)
+        for app, affiliations, text in ((app1, [aff1, aff2], 'Чужая заметка'), (app2, [aff2], 'Вторая заметка'),
+                                        (app3, [foreign_aff], 'Невидимая заметка')):
+            note = ApplicationNote.objects.create(application=app, author=other_master, text=text)
+            note.affiliations.add(*affiliations)
+
+        resp = self.client.get(reverse('application_list'))
+        notes = {app.id: (app.author_note, app.note) for app in resp.context['application_list']}
+        self.assertEqual(notes[app1.id], ('Своя заметка', 'Чужая заметка'))
+        self.assertEqual(notes[app2.id], (None, 'Вторая заметка'))
+        self.assertEqual(notes[app3.id], (None, None))
+
+        resp = self.client.get(reverse('application', kwargs={'pk': app1.id}))
+        self.assertEqual(resp.context['app'].app_note, own_note)
+        self.assertEqual([note.text for note in resp.context['app'].other_notes], ['Чужая заметка'])
+        self.assertContains(resp, 'Чужая заметка')
+        self.assertContains(resp, 'Своя заметка')
+
+    def test_viewed_apps(self):
+        self.client.login(username='master', password='master')
+        app = Application.objects.get(member__user__username='testuser1')
+        with mock.patch.object(viewed_apps_buffer, 'flush_interval', 3600):
+            self.client.get(reverse('application', kwargs={'pk': app.id}))
+            self.client.get(reverse('application', kwargs={'pk': app.id}))
+        self.assertFalse(AppsViewedByMaster.objects.exists())
+        resp = self.client.get(reverse('application_list'))
+        self.assertEqual(resp.context['viewed_apps'], {app.id})
+
+        viewed_apps_buffer.flush()
+        self.assertEqual(list(AppsViewedByMaster.objects.values_list('member', 'application')),
+                         [(self.master_member.id, app.id)])
+        resp = self.client.get(reverse('application_list'))
+        self.assertEqual(resp.context['viewed_apps'], {app.id})
+
 
 class CompetenceListViewTest(TestCase):
     @classmethod
@@ -171,6 +334,8 @@ class CompetenceListViewTest(TestCase):
         Role.objects.create(role_name=MASTER_ROLE_NAME)
 
     def setUp(self) -> None:
+        # кэш компетенций направлений сбрасывается после коммита, которого в TestCase нет
+        cache.clear()
         slave_role = Role.objects.create(role_name=SLAVE_ROLE_NAME)
         slave = User.objects.create_user(username=f'slave', password='slave')
         slave_member = Member.objects.create(user=slave, role=slave_role, phone='89998887766')
@@ -280,6 +445,72 @@ class CompetenceListViewTest(TestCase):
         self.assertEqual(list(resp.context['picking_competences']),
                          list(Competence.objects.filter(parent_node__isnull=True)))
 
+    def test_fourth_level(self):
+        """Проверяет, что компетенции глубже третьего уровня показываются и удаляются из направления вместе с деревом"""
+        parent = Competence.objects.get(name='test432')
+        Competence.objects.create(name='test4321', parent_node=parent).directions.add(self.master_direction_1)
+        self.client.login(username='master', password='master')
+        resp = self.client.get(reverse('competence_list'))
+        self.assertContains(resp, 'test4321')
+        self.assertIn(Competence.objects.get(name='test4'), resp.context['competences_list'])
+
+        root = Competence.objects.get(name='test4')
+        resp = self.client.get(reverse('delete_competence', kwargs={'competence_id': root.id,
+                                                                    'direction_id': self.master_direction_1.id}))
+        self.assertRedirects(resp, reverse('competence_list') + f'?direction={self.master_direction_1.id}')
+        self.assertFalse(Competence.objects.filter(path__startswith=root.path,
+                                                   directions=self.master_direction_1).exists())
+        self.assertTrue(Competence.objects.filter(name='test1', directions=self.master_direction_1).exists())
+
+    def test_direction_competences_cache(self):
+        """Проверяет, что компетенции направления берутся из кэша и кэш сбрасывается при их изменении"""
+        self.client.login(username='master', password='master')
+        url = reverse('competence_list') + f'?direction={self.master_direction_1.id}'
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([query for query in queries if 'application_competence_directions' in query['sql']])
+
+        comp = Competence.objects.get(name='test3')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_competences', kwargs={'direction_id': self.master_direction_1.id}),
+                             {'chosen_competences': [comp.id]})
+        resp = self.client.get(url)
+        self.assertIn(comp, resp.context['picked_competences'])
+        self.assertIn(comp, resp.context['competences_list'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('delete_competence', kwargs={'competence_id': comp.id,
+                                                                 'direction_id': self.master_direction_1.id}))
+        resp = self.client.get(url)
+        self.assertNotIn(comp, resp.context['picked_competences'])
+        self.assertNotIn(comp, resp.context['competences_list'])
+
+        root = Competence.objects.get(name='test1')
+        with self.captureOnCommitCallbacks(execute=True):
+            for competence in root.get_descendants():
+                competence.directions.add(self.master_direction_1)
+        resp = self.client.get(url)
+        self.assertNotIn(root, resp.context['picking_competences'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Competence.objects.create(name='test1new', parent_node=root)
+        resp = self.client.get(url)
+        self.assertIn(root, resp.context['picking_competences'])
+
+    def test_direction_competences_cache_cleared_after_commit(self):
+        """
+        Проверяет, что кэш сбрасывается только после фиксации транзакции: данные, закэшированные параллельным
+        запросом до коммита, не остаются в кэше
+        """
+        comp = Competence.objects.get(name='test3')
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                comp.directions.add(self.master_direction_1)
+                # параллельный запрос кэширует данные до коммита
+                cache.set(DirectionCompetences.get_cache_key(self.master_direction_1.id), ([], {}))
+            self.assertEqual(DirectionCompetences.load(self.master_direction_1.id).picked_ids, set())
+        self.assertIn(comp.id, DirectionCompetences.load(self.master_direction_1.id).picked_ids)
+
 
 class BookMemberViewTest(TestCase):
 
@@ -1357,3 +1588,76 @@ class WorkingListViewTest(TestCase):
                          tuple(Application.objects.filter(member__user__username='testuser2'), ))
         self.assertEqual(resp.context['chosen_company'], 3)
         self.assertEqual(resp.context['chosen_platoon'], 3)
+
+    def test_export_number_of_queries(self):
+        """Проверяет, что количество запросов при экспорте рабочего списка не зависит от количества заявок"""
+        self.client.login(username='master', password='master')
+        Application.objects.update(draft_season=get_current_draft_year()[1][0])
+        booked = BookingType.objects.get(name=BOOKED)
+        competence = Competence.objects.create(name='Python')
+        competence.directions.add(self.aff3.direction)
+        url = reverse('export_work_list') + f'?affiliation={self.aff3.id}&booking_type={booked.id}'
+
+        def export():
+            with self.assertNumQueries(5):
+                resp = self.client.get(url)
+                content = b''.join(resp.streaming_content)
+            return list(load_workbook(BytesIO(content)).active.values)
+
+        rows = export()
+        self.assertEqual(list(rows[0]), WORK_LIST_HEADERS_FOR_EXCEL)
+        self.assertEqual(len(rows), 2)
+        for i in (0, 3, 5):
+            app = Application.objects.get(member__user__username=f'testuser{i}')
+            Booking.objects.create(booking_type=booked, master=self.master_member, slave=app.member,
+                                   affiliation=self.aff3)
+            ApplicationCompetencies.objects.create(application=app, competence=competence, level=i % 3 + 1)
+        rows = export()
+        self.assertEqual(len(rows), 5)
+        python_levels = [[row[j] for j in range(6, 9)].index('Python') for row in rows[1:] if 'Python' in row]
+        self.assertEqual(sorted(python_levels), [0, 2, 2])
+
+
+class ImportJobAdminViewTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        Role.objects.create(role_name=SLAVE_ROLE_NAME)
+        BookingType.objects.create(name=BOOKED)
+        User.objects.create_user(username='admin', password='admin', is_superuser=True, is_staff=True)
+
+    def upload(self):
+        file = SimpleUploadedFile('apps.xlsx', create_import_workbook([
+            {'full_name': 'Иванов Иван Иванович', 'phone': '8(900)-000-00-01', 'email': 'ivanov@test.ru'}]).getvalue())
+        return self.client.post(reverse('admin:process_import'), {'downloaded_files': [file]})
+
+    def test_process_import_without_permission(self):
+        response = self.upload()
+        self.assertEquals(response.status_code, 302)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_process_import(self):
+        self.client.login(username='admin', password='admin')
+        response = self.upload()
+        self.assertEquals(response.status_code, 200)
+        job = ImportJob.objects.get()
+        self.assertEquals((job.status, job.file_name, job.author.username), (ImportJob.QUEUED, 'apps.xlsx', 'admin'))
+        self.assertFalse(Application.objects.exists())
+        progress_url = reverse('admin:import_job_progress', args=[job.pk])
+        self.assertContains(response, progress_url)
+
+        progress = self.client.get(progress_url).json()
+        self.assertEquals((progress['status'], progress['is_finished'], progress['report_url']),
+                          (ImportJob.QUEUED, False, None))
+
+        call_command('run_jobs', once=True, stdout=StringIO())
+        progress = self.client.get(progress_url).json()
+        self.assertEquals((progress['status'], progress['rows_processed'], progress['accepted_count']),
+                          (ImportJob.DONE, 1, 1))
+        report = self.client.get(progress['report_url'])
+        self.assertEquals(report['Content-Disposition'], f'attachment; filename="import_report_{job.pk}.txt"')
+        self.assertIn('Анкета пользователя Иванов Иван Иванович с id: 1 успешно создана!', report.content.decode())
@@ -1,12 +1,35 @@
-from datetime import datetime
-
-from django.test import TestCase
+import logging
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 from django.contrib.auth.models import User
+from docxtpl import DocxTemplate
+from openpyxl import Workbook
 
 from application.models import Direction, File, Competence, Universities, Education, Application, validate_draft_year, \
-    ApplicationScores, Specialization, MilitaryCommissariat
-from account.models import Member, Role
-from utils.constants import DEFAULT_FILED_BLOCKS
+    ApplicationScores, Specialization, MilitaryCommissariat, ApplicationCompetencies, ImportJob, AppsViewedByMaster, \
+    SeasonAppsCounter, ViewedAppsCounter, ViewedAppsBuffer, viewed_apps_buffer, SEARCH_TABLE_NAME
+from application.utils import recompute_scores, Questionnaires, render_word_documents
+from account.models import Member, Role, Booking, BookingType
+from utils.docx_templates import DocxTemplateCache, docx_template_cache
+from utils.constants import DEFAULT_FILED_BLOCKS, EXCEL_TABLE_HEADERS_FOR_IMPORT_APPS, EXIST_COMPETENCIES_ON_SITE, \
+    BOOKED, SLAVE_ROLE_NAME
+
+logger = logging.getLogger(__name__)
 
 
 class DirectionModelTest(TestCase):
@@ -132,6 +155,32 @@ class ApplicationModelTest(TestCase):
         app = Application.objects.get(id=1)
         self.assertEquals(app.get_draft_time(), 'Весна 2020')
 
+    def test_recompute_scores(self):
+        app = Application.objects.get(id=1)
+        app.patents = app.science_experience = app.compliance_prior_direction = True
+        app.save()
+        app.update_scores()
+        expected_scores = ApplicationScores.objects.values('a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7').get(application=app)
+        Application.objects.filter(id=1).update(final_score=0)
+        ApplicationScores.objects.filter(application=app).delete()
+        with self.assertNumQueries(8):
+            self.assertEquals(recompute_scores(Application.objects.all()), 1)
+        self.assertEquals(Application.objects.get(id=1).final_score, app.final_score)
+        self.assertEquals(ApplicationScores.objects.values('a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7').get(
+            application=app), expected_scores)
+
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 таблица поиска есть только в SQLite')
+    def test_delete_search_document(self):
+        """Проверяет, что при удалении заявки ее строка удаляется из FTS5 таблицы поиска"""
+        app = Application.objects.get(id=1)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE_NAME} WHERE rowid = %s', [app.pk])
+            self.assertEquals(cursor.fetchone()[0], 1)
+            app.member.user.delete()
+            cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE_NAME} WHERE rowid = %s', [app.pk])
+            self.assertEquals(cursor.fetchone()[0], 0)
+
 
 class EducationModelTest(TestCase):
 
@@ -175,6 +224,92 @@ class EducationModelTest(TestCase):
         education = Education.objects.get(id=1)
         self.assertEquals(education.get_education_type_display(), Education.education_program[0][1])
 
+    def test_last_education_on_save(self):
+        app = Application.objects.get(id=1)
+        self.assertEquals(app.last_university, 'МЭИ')
+        self.assertEquals(app.last_education_type, Education.education_program[0][0])
+        Education.objects.create(application=app, education_type=Education.education_program[1][0], university='МГУ',
+                                 specialization='ПМИ', avg_score=4.5, end_year=2022, is_ended=True,
+                                 name_of_education_doc='Высшее', theme_of_diploma='Тест')
+        app.refresh_from_db()
+        self.assertEquals(app.last_university, 'МГУ')
+        self.assertEquals(app.last_specialization, 'ПМИ')
+        self.assertEquals(app.last_avg_score, 4.5)
+        self.assertEquals(app.last_education_type, Education.education_program[1][0])
+
+    def test_last_education_on_delete(self):
+        Education.objects.get(id=1).delete()
+        app = Application.objects.get(id=1)
+        self.assertEquals(app.last_university, '')
+        self.assertIsNone(app.last_avg_score)
+
+
+class CompetenceTreeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.direction = Direction.objects.create(name='ИВТ', description='описание')
+        cls.root = Competence.objects.create(name='Программирование')
+        cls.python = Competence.objects.create(name='Python', parent_node=cls.root)
+        cls.django = Competence.objects.create(name='Django', parent_node=cls.python)
+        cls.orm = Competence.objects.create(name='ORM', parent_node=cls.django)
+        cls.other_root = Competence.objects.create(name='Сети')
+
+    def test_path_and_depth(self):
+        self.assertEquals((self.orm.path, self.orm.depth),
+                          (f'{self.root.id}/{self.python.id}/{self.django.id}/{self.orm.id}/', 3))
+        self.orm.refresh_from_db()
+        self.assertEquals(self.orm.path.count('/'), 4)
+        self.assertEquals((self.root.path, self.root.depth), (f'{self.root.id}/', 0))
+
+    def test_descendants_and_ancestors(self):
+        with self.assertNumQueries(1):
+            self.assertEquals(set(self.python.get_descendants()), {self.python, self.django, self.orm})
+        self.assertEquals(set(self.python.get_descendants(include_self=False)), {self.django, self.orm})
+        with self.assertNumQueries(1):
+            self.assertEquals(list(self.orm.get_ancestors()), [self.root, self.python, self.django])
+
+    def test_subtree_without_id_prefix_neighbours(self):
+        """Проверяет, что в поддерево не попадают компетенции с id, начинающимся с id корня, на любой БД"""
+        neighbour = Competence.objects.create(pk=self.root.id * 10, name='Соседняя')
+        Competence.objects.create(pk=self.root.id * 10 + 1, name='Дочерняя соседней', parent_node=neighbour)
+        expected = {self.root, self.python, self.django, self.orm}
+        self.assertEquals(set(self.root.get_descendants()), expected)
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertEquals(Competence.subtree_q(self.root.path), Q(path__startswith=self.root.path))
+            self.assertEquals(set(self.root.get_descendants()), expected)
+
+    def test_move_subtree(self):
+        self.python.parent_node = self.other_root
+        self.python.save()
+        self.orm.refresh_from_db()
+        self.assertEquals((self.orm.path, self.orm.depth),
+                          (f'{self.other_root.id}/{self.python.id}/{self.django.id}/{self.orm.id}/', 3))
+        self.assertEquals(set(self.root.get_descendants()), {self.root})
+
+        self.django.parent_node = None
+        self.django.save()
+        self.orm.refresh_from_db()
+        self.assertEquals((self.orm.path, self.orm.depth), (f'{self.django.id}/{self.orm.id}/', 1))
+
+    def test_parent_from_own_subtree(self):
+        self.root.parent_node = self.orm
+        with self.assertRaises(ValidationError):
+            self.root.full_clean()
+
+    def test_get_tree(self):
+        with self.assertNumQueries(1):
+            roots = Competence.get_tree()
+        self.assertEquals(roots, [self.root, self.other_root])
+        self.assertEquals(roots[0].children[0].children[0].children, [self.orm])
+
+    def test_get_direction_coverage(self):
+        self.django.directions.add(self.direction)
+        self.orm.directions.add(self.direction)
+        with self.assertNumQueries(1):
+            coverage = Competence.get_direction_coverage(self.direction)
+        self.assertEquals(coverage, {self.root.id: (2, 4), self.other_root.id: (0, 1)})
+
 
 class SpecializationModelTest(TestCase):
 
@@ -209,3 +344,480 @@ class MilitaryCommissariatModelTest(TestCase):
         mc = MilitaryCommissariat.objects.get(id=1)
         max_length = mc._meta.get_field('city').max_length
         self.assertEquals(max_length, 128)
+
+
+def create_import_workbook(apps):
+    """
+    Создает excel файл в формате импорта анкет
+    :param apps: список словарей с параметрами анкет, directions и achievements - списки значений,
+     которые записываются в строку анкеты и строки продолжения
+    """
+    wb = Workbook()
+    sheet = wb.active
+    sheet.append(EXCEL_TABLE_HEADERS_FOR_IMPORT_APPS)
+    for i, app in enumerate(apps, start=1):
+        row = {
+            'id': i, 'full_name': app['full_name'], 'phone': app['phone'], 'email': app['email'],
+            'birth_day': '01.01.2000 0:00:00', 'birth_place': 'Москва', 'nationality': 'РФ',
+            'military_commissariat': 'Московский', 'group_of_health': 'А1', 'draft_year': '2022',
+            'draft_season': '[Весна]', 'ready_to_secret': '[Да]', 'education_type': '[Бакалавриат]',
+            'university': 'МЭИ', 'specialization': 'ИВТ', 'avg_score': app.get('avg_score', '4,5'), 'end_year': '2021',
+            'name_of_education_doc': 'Диплом', 'theme_of_diploma': 'Тема', 'hobby': 'Шахматы',
+        }
+        row.update({name: app.get('competencies', {}).get(name, '[0]') for name in EXIST_COMPETENCIES_ON_SITE})
+        directions, achievements = app.get('directions', []), app.get('achievements', [])
+        for j in range(max(len(directions), len(achievements), 1)):
+            if j:
+                row = {}
+            if j < len(directions):
+                row['directions'] = f'[{directions[j]}]'
+            if j < len(achievements):
+                row['achievements'] = f'[{achievements[j]}]'
+            sheet.append([row.get(name) for name in EXCEL_TABLE_HEADERS_FOR_IMPORT_APPS])
+    file = BytesIO()
+    wb.save(file)
+    file.seek(0)
+    return file
+
+
+class QuestionnairesTest(TestCase):
+    apps = [
+        {'full_name': 'Иванов Иван Иванович', 'phone': '8(900)-000-00-01', 'email': 'ivanov@test.ru',
+         'directions': ['ИВТ', 'Связь'], 'achievements': ['Патенты на изобретения и полезные модели'],
+         'competencies': {'Python': '[3]', 'C': '[1]'}},
+        {'full_name': 'Петров Петр', 'phone': '8(900)-000-00-02', 'email': 'petrov@test.ru', 'avg_score': '5'},
+        {'full_name': 'Сидоров Сидор', 'phone': '8(900)-000-00-03', 'email': 'sidorov@test.ru', 'avg_score': 'нет'},
+        {'full_name': 'Иванов Иван Иванович', 'phone': '8(900)-000-00-01', 'email': 'ivanov@test.ru',
+         'directions': ['Связь']},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        Role.objects.create(role_name=SLAVE_ROLE_NAME)
+        BookingType.objects.create(name=BOOKED)
+        Direction.objects.create(name='ИВТ', description='описание')
+        Direction.objects.create(name='Связь', description='описание')
+        Competence.objects.create(name='Python')
+        Competence.objects.create(name='C')
+
+    @staticmethod
+    def get_imported_data():
+        apps = Application.objects.order_by('member__phone').values(
+            'member__user__username', 'member__user__first_name', 'member__father_name', 'member__phone',
+            'birth_day', 'draft_season', 'ready_to_secret', 'patents', 'hobby', 'fullness', 'final_score',
+            'last_university', 'last_avg_score', 'search_document', 'scores__a1', 'scores__a2')
+        return {
+            'apps': list(apps),
+            'directions': sorted(Application.directions.through.objects.values_list(
+                'application__member__phone', 'direction__name')),
+            'competencies': sorted(ApplicationCompetencies.objects.values_list(
+                'application__member__phone', 'competence__name', 'level')),
+            'educations': sorted(Education.objects.values_list('application__member__phone', 'education_type',
+                                                               'university', 'avg_score')),
+        }
+
+    def test_add_applications_to_db_in_bulk(self):
+        expected_result = Questionnaires(create_import_workbook(self.apps)).add_applications_to_db()
+        expected_data = self.get_imported_data()
+        User.objects.all().delete()
+
+        with self.assertNumQueries(21):
+            result = Questionnaires(create_import_workbook(self.apps)).add_applications_to_db_in_bulk()
+        self.assertEquals(result, expected_result)
+        self.assertEquals(len(result['accepted']), 3)
+        self.assertEquals(result['errors'][0], 'Ошибка при создании анкеты с id:3 - could not convert string to float: \'нет\'')
+        self.assertEquals(self.get_imported_data(), expected_data)
+        self.assertEquals(expected_data['directions'], [('89000000001', 'Связь')])
+        self.assertEquals(list(SeasonAppsCounter.objects.values_list('count', flat=True)), [Application.objects.count()])
+
+    def test_iter_applications(self):
+        questionnaires = Questionnaires(create_import_workbook(self.apps[:2]))
+        questionnaires.sheet.iter_rows = mock.Mock(wraps=questionnaires.sheet.iter_rows)
+        questionnaires.sheet.cell = mock.Mock(side_effect=AssertionError('Чтение таблицы по ячейкам'))
+        applications = list(questionnaires._iter_applications())
+        questionnaires.sheet.iter_rows.assert_called_once()
+        self.assertEquals([params['id'] for params, _ in applications], [1, 2])
+        self.assertEquals(applications[0][1]['user_directions'], ['ИВТ', 'Связь'])
+        self.assertEquals(applications[0][1]['user_achievements'], ['Патенты на изобретения и полезные модели'])
+        self.assertEquals(applications[0][1]['hobby'], ['Шахматы'])
+        self.assertEquals(applications[1][1]['user_directions'], [])
+
+    def test_add_applications_to_db_in_bulk_with_existing_members(self):
+        Questionnaires(create_import_workbook(self.apps[:2])).add_applications_to_db_in_bulk(chunk_size=1)
+        booked_member = Member.objects.get(phone='89000000002')
+        Booking.objects.create(booking_type=BookingType.objects.get(name=BOOKED), slave=booked_member,
+                               master=booked_member)
+        old_app_id = Application.objects.get(member__phone='89000000001').id
+
+        result = Questionnaires(create_import_workbook(self.apps[:2])).add_applications_to_db_in_bulk()
+        self.assertEquals(result['accepted'], ['Анкета пользователя Иванов Иван Иванович с id: 1 успешно создана!'])
+        self.assertEquals(result['errors'], [
+            'Анкета пользователя Иванов Иван Иванович (id: 1) уже была создана и была обновлена!',
+            'Анкета пользователя Петров Петр (id: 2) уже была создана и забронированна ранее!'])
+        self.assertEquals(Member.objects.count(), 2)
+        self.assertNotEquals(Application.objects.get(member__phone='89000000001').id, old_app_id)
+        self.assertEquals(ApplicationScores.objects.count(), 2)
+
+    def test_add_applications_to_db_in_bulk_fallback(self):
+        User.objects.create(username='petrov@test.ru')
+        result = Questionnaires(create_import_workbook(self.apps[:2])).add_applications_to_db_in_bulk()
+        self.assertEquals(result['accepted'], ['Анкета пользователя Иванов Иван Иванович с id: 1 успешно создана!'])
+        self.assertEquals(len(result['errors']), 1)
+        self.assertTrue(result['errors'][0].startswith('Ошибка при создании анкеты с id:2 - '))
+        self.assertEquals(Application.objects.count(), 1)
+
+
+class ImportJobTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Role.objects.create(role_name=SLAVE_ROLE_NAME)
+        BookingType.objects.create(name=BOOKED)
+        Direction.objects.create(name='ИВТ', description='описание')
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def create_job(self, apps):
+        return ImportJob.objects.create(
+            file=SimpleUploadedFile('apps.xlsx', create_import_workbook(apps).getvalue()), file_name='apps.xlsx')
+
+    def test_take_next(self):
+        first_job, second_job = self.create_job([]), self.create_job([])
+        self.assertEquals(ImportJob.take_next(), first_job)
+        self.assertEquals(ImportJob.objects.get(pk=first_job.pk).status, ImportJob.RUNNING)
+        self.assertEquals(ImportJob.take_next(), second_job)
+        self.assertIsNone(ImportJob.take_next())
+
+    def test_run_jobs(self):
+        job = self.create_job(QuestionnairesTest.apps[:3])
+        progress, update_progress = [], ImportJob.update_progress
+        with mock.patch.object(ImportJob, 'update_progress', autospec=True, side_effect=lambda self, *args: (
+                progress.append(args[0]), update_progress(self, *args))):
+            with mock.patch('utils.constants.IMPORT_APPS_CHUNK_SIZE', 2):
+                call_command('run_jobs', once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEquals(job.status, ImportJob.DONE)
+        self.assertEquals((job.rows_processed, job.accepted_count, job.errors_count), (3, 2, 1))
+        self.assertEquals(len(job.report['accepted']), 2)
+        self.assertIsNotNone(job.end_date)
+        self.assertEquals(progress, [2, 3])
+        self.assertIn('Ошибка при создании анкеты с id:3', job.get_report_text())
+
+    def test_fail_stale_jobs(self):
+        """Проверяет, что задача, брошенная упавшим обработчиком, завершается с ошибкой при следующем запуске"""
+        stale_job, running_job = self.create_job([]), self.create_job([])
+        ImportJob.objects.filter(pk=stale_job.pk).update(status=ImportJob.RUNNING,
+                                                         start_date=timezone.now() - timedelta(hours=2))
+        ImportJob.objects.filter(pk=running_job.pk).update(status=ImportJob.RUNNING, start_date=timezone.now())
+        call_command('run_jobs', once=True, running_timeout=3600, stdout=StringIO())
+        stale_job.refresh_from_db()
+        self.assertEquals(stale_job.status, ImportJob.FAILED)
+        self.assertTrue(stale_job.is_finished())
+        self.assertIsNotNone(stale_job.end_date)
+        self.assertIn('Задача прервана', stale_job.get_report_text())
+        self.assertEquals(ImportJob.objects.get(pk=running_job.pk).status, ImportJob.RUNNING)
+
+    def test_run_jobs_with_broken_file(self):
+        job = ImportJob.objects.create(file=SimpleUploadedFile('apps.xlsx', b'not excel'), file_name='apps.xlsx')
+        call_command('run_jobs', once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEquals(job.status, ImportJob.FAILED)
+        self.assertTrue(job.error)
+
+
+class AppsCountersTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        role = Role.objects.create(role_name=SLAVE_ROLE_NAME)
+        cls.master = Member.objects.create(user=User.objects.create(username='master'), phone='89000000000', role=role)
+        cls.apps = [cls.create_app(f'slave{i}', role, draft_season=1 if i < 3 else 2) for i in range(4)]
+
+    @staticmethod
+    def create_app(username, role, draft_season=1):
+        member = Member.objects.create(user=User.objects.create(username=username), phone='89000000001', role=role)
+        return Application.objects.create(member=member, birth_day=datetime.strptime('18/09/00', '%d/%m/%y'),
+                                          birth_place='Test', nationality='РФ', military_commissariat='Йо',
+                                          group_of_health='А1', draft_year=2020, draft_season=draft_season)
+
+    @staticmethod
+    def get_counters():
+        """Ненулевые счетчики: команда пересчета не создает пустых счетчиков"""
+        return {
+            'season': dict(((year, season), count) for year, season, count in SeasonAppsCounter.objects.exclude(
+                count=0).values_list('draft_year', 'draft_season', 'count')),
+            'viewed': dict(((member, year, season), count) for member, year, season, count in
+                           ViewedAppsCounter.objects.exclude(count=0).values_list(
+                               'member', 'draft_year', 'draft_season', 'count')),
+        }
+
+    def assertCountersRebuilt(self):
+        counters = self.get_counters()
+        call_command('rebuild_apps_counters', stdout=StringIO())
+        self.assertEquals(self.get_counters(), counters)
+
+    def test_count_on_create_and_delete(self):
+        self.assertEquals(self.get_counters()['season'], {(2020, 1): 3, (2020, 2): 1})
+        self.apps[0].member.user.delete()
+        self.assertEquals(self.get_counters()['season'], {(2020, 1): 2, (2020, 2): 1})
+        self.assertCountersRebuilt()
+
+    def test_count_viewed(self):
+        AppsViewedByMaster.objects.create(member=self.master, application=self.apps[0])
+        AppsViewedByMaster.objects.create(member=self.master, application=self.apps[3])
+        self.assertEquals(self.get_counters()['viewed'], {(self.master.id, 2020, 1): 1, (self.master.id, 2020, 2): 1})
+        with self.assertNumQueries(1):
+            self.assertEquals(SeasonAppsCounter.count_not_viewed(self.master, 2020, 1), 2)
+        self.assertEquals(SeasonAppsCounter.count_not_viewed(self.master, 2020, 2), 0)
+        self.assertEquals(SeasonAppsCounter.count_not_viewed(self.master, 2021, 1), 0)
+
+        self.apps[0].delete()
+        self.assertEquals(self.get_counters()['viewed'], {(self.master.id, 2020, 2): 1})
+        self.assertEquals(SeasonAppsCounter.count_not_viewed(self.master, 2020, 1), 2)
+        self.assertCountersRebuilt()
+
+    def test_change_draft_season(self):
+        AppsViewedByMaster.objects.create(member=self.master, application=self.apps[0])
+        self.apps[0].draft_season = 2
+        self.apps[0].save()
+        self.assertEquals(self.get_counters(), {
+            'season': {(2020, 1): 2, (2020, 2): 2},
+            'viewed': {(self.master.id, 2020, 2): 1},
+        })
+        self.assertEquals(SeasonAppsCounter.count_not_viewed(self.master, 2020, 2), 1)
+        self.assertCountersRebuilt()
+
+    def test_add_viewed_apps(self):
+        AppsViewedByMaster.objects.create(member=self.master, application=self.apps[0])
+        deleted_app_id = self.apps[2].id
+        self.apps[2].delete()
+        marks = [(self.master.id, app.id) for app in self.apps] + [(self.apps[0].member_id, self.apps[1].id)]
+        self.assertEquals(AppsViewedByMaster.add_viewed_apps(marks), 3)
+        self.assertEquals(AppsViewedByMaster.add_viewed_apps(marks), 0)
+        self.assertFalse(AppsViewedByMaster.objects.filter(application=deleted_app_id).exists())
+        self.assertEquals(self.get_counters()['viewed'], {
+            (self.master.id, 2020, 1): 2, (self.master.id, 2020, 2): 1, (self.apps[0].member_id, 2020, 1): 1})
+        self.assertCountersRebuilt()
+
+    def test_viewed_apps_buffer(self):
+        buffer = ViewedAppsBuffer(flush_size=3, flush_interval=3600)
+        self.addCleanup(buffer.clear)
+        buffer.add(self.master.id, self.apps[0].id)
+        buffer.add(self.master.id, self.apps[0].id)
+        buffer.add(self.master.id, self.apps[1].id)
+        self.assertEquals(len(buffer), 2)
+        self.assertFalse(AppsViewedByMaster.objects.exists())
+        self.assertEquals(buffer.get_pending_app_ids(self.master.id, [app.id for app in self.apps]),
+                          {self.apps[0].id, self.apps[1].id})
+
+        buffer.add(self.master.id, self.apps[3].id)
+        self.assertEquals(len(buffer), 0)
+        self.assertIsNone(buffer._timer)
+        self.assertEquals(set(AppsViewedByMaster.objects.values_list('application', flat=True)),
+                          {self.apps[0].id, self.apps[1].id, self.apps[3].id})
+        self.assertEquals(SeasonAppsCounter.count_not_viewed(self.master, 2020, 1), 1)
+
+    def test_viewed_apps_buffer_timer(self):
+        """Проверяет, что первая метка запускает один таймер сохранения, а очистка буфера его останавливает"""
+        buffer = ViewedAppsBuffer(flush_size=100, flush_interval=3600)
+        buffer.add(self.master.id, self.apps[0].id)
+        timer = buffer._timer
+        self.assertTrue(timer.is_alive())
+        self.assertTrue(timer.daemon)
+        buffer.add(self.master.id, self.apps[1].id)
+        self.assertIs(buffer._timer, timer)
+        buffer.clear()
+        timer.join(1)
+        self.assertFalse(timer.is_alive())
+        self.assertIsNone(buffer._timer)
+
+    def test_get_viewed_app_ids_with_pending_marks(self):
+        AppsViewedByMaster.objects.create(member=self.master, application=self.apps[0])
+        viewed_apps_buffer.clear()
+        self.addCleanup(viewed_apps_buffer.clear)
+        with mock.patch.object(viewed_apps_buffer, 'flush_interval', 3600):
+            viewed_apps_buffer.add(self.master.id, self.apps[1].id)
+        self.assertEquals(AppsViewedByMaster.objects.count(), 1)
+        self.assertEquals(AppsViewedByMaster.get_viewed_app_ids_from_member(self.master, [app.id for app in self.apps]),
+                          {self.apps[0].id, self.apps[1].id})
+
+    def test_rebuild_apps_counters(self):
+        AppsViewedByMaster.objects.create(member=self.master, application=self.apps[1])
+        SeasonAppsCounter.objects.update(count=100)
+        ViewedAppsCounter.objects.all().delete()
+        call_command('rebuild_apps_counters', stdout=StringIO())
+        self.assertEquals(self.get_counters(), {
+            'season': {(2020, 1): 3, (2020, 2): 1},
+            'viewed': {(self.master.id, 2020, 1): 1},
+        })
+
+
+class ViewedAppsBufferTimerTest(TransactionTestCase):
+    """Сохранение по таймеру идет в отдельном потоке со своим соединением, поэтому без транзакции теста"""
+
+    def test_flush_by_timer(self):
+        role = Role.objects.create(role_name=SLAVE_ROLE_NAME)
+        master = Member.objects.create(user=User.objects.create(username='master'), phone='89000000000', role=role)
+        app = AppsCountersTest.create_app('slave', role)
+        buffer = ViewedAppsBuffer(flush_size=100, flush_interval=0.1)
+        buffer.add(master.id, app.id)
+        buffer._timer.join(5)
+        self.assertEquals(len(buffer), 0)
+        self.assertIsNone(buffer._timer)
+        self.assertTrue(AppsViewedByMaster.objects.filter(member=master, application=app).exists())
+
+
+class DocxTemplateCacheTest(TestCase):
+    context = {'first_name': 'Иван', 'last_name': 'Иванов', 'father_name': 'Иванович', 'phone': '89000000000'}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'interview_list.docx')
+        shutil.copy('static/docx/templates/interview_list.docx', self.path)
+
+    @staticmethod
+    def render(template, context):
+        template.render(context)
+        buffer = BytesIO()
+        template.save(buffer)
+        with zipfile.ZipFile(buffer) as docx:
+            return {name: docx.read(name) for name in docx.namelist()}
+
+    def test_render_same_as_docx_template(self):
+        cache = DocxTemplateCache()
+        expected = self.render(DocxTemplate(self.path), self.context)
+        self.assertEquals(self.render(cache.get(self.path), self.context), expected)
+        self.assertEquals(self.render(cache.get(self.path), self.context), expected)
+        other_context = {**self.context, 'first_name': 'Петр'}
+        self.assertEquals(self.render(cache.get(self.path), other_context),
+                          self.render(DocxTemplate(self.path), other_context))
+
+    def test_reload_changed_file(self):
+        cache = DocxTemplateCache()
+        entry = cache.get(self.path)._entry
+        self.assertIs(cache.get(self.path)._entry, entry)
+        os.utime(self.path, ns=(entry.mtime + 10 ** 9, entry.mtime + 10 ** 9))
+        self.assertIsNot(cache.get(self.path)._entry, entry)
+
+    def test_max_size(self):
+        cache = DocxTemplateCache(max_size=2)
+        paths = [self.path]
+        for i in range(2):
+            paths.append(os.path.join(self.directory, f'template_{i}.docx'))
+            shutil.copy(self.path, paths[-1])
+        for path in paths:
+            cache.get(path)
+        self.assertEquals(len(cache), 2)
+        self.assertNotIn(paths[0], cache)
+        cache.invalidate(paths[1])
+        self.assertEquals(len(cache), 1)
+        cache.invalidate()
+        self.assertEquals(len(cache), 0)
+
+    def test_invalidate_on_template_file_change(self):
+        member = Member.objects.create(user=User.objects.create(username='master'),
+                                       role=Role.objects.create(role_name='Отбирающий'))
+        file = File(member=member, file_name='interview_list.docx', file_path='interview_list.docx', is_template=True)
+        docx_template_cache.get(self.path)
+        with override_settings(MEDIA_ROOT=self.directory):
+            file.save()
+        self.assertNotIn(self.path, docx_template_cache)
+        docx_template_cache.get(self.path)
+        with override_settings(MEDIA_ROOT=self.directory):
+            file.delete()
+        self.assertNotIn(self.path, docx_template_cache)
+
+
+class RenderWordDocumentsTest(TestCase):
+    path = 'static/docx/templates/interview_list.docx'
+    documents = [(f'document_{i}.docx', {'first_name': f'Имя{i}'}) for i in range(5)]
+
+    def test_render_all_documents(self):
+        documents = dict(render_word_documents(self.path, self.documents, workers=2, max_pending=2))
+        self.assertEquals(set(documents), {name for name, _ in self.documents})
+        for content in documents.values():
+            with zipfile.ZipFile(BytesIO(content)) as docx:
+                self.assertIn('word/document.xml', docx.namelist())
+
+    def test_close_before_all_documents_rendered(self):
+        """
+        Проверяет, что генератор можно закрыть, не дочитав документы: оставшиеся документы не отправляются в пул,
+        ожидающие задачи отменяются, а процессы пула завершаются
+        """
+        patch_submit = mock.patch.object(ProcessPoolExecutor, 'submit', autospec=True,
+                                         side_effect=ProcessPoolExecutor.submit)
+        patch_cancel = mock.patch.object(Future, 'cancel', autospec=True, side_effect=Future.cancel)
+        patch_shutdown = mock.patch.object(ProcessPoolExecutor, 'shutdown', autospec=True,
+                                           side_effect=ProcessPoolExecutor.shutdown)
+        with patch_submit as submit, patch_cancel as cancel, patch_shutdown as shutdown:
+            generator = render_word_documents(self.path, self.documents, workers=1, max_pending=3)
+            name, content = next(generator)
+            self.assertIn(name, {name for name, _ in self.documents})
+            cancel.assert_not_called()
+            generator.close()
+        self.assertEqual(submit.call_count, 3)
+        cancelled = [call.args[0] for call in cancel.call_args_list]
+        self.assertEqual(len(cancelled), 2)
+        self.assertTrue(all(future.done() for future in cancelled))
+        shutdown.assert_called_once()
+        executor = shutdown.call_args.args[0]
+        self.assertFalse(executor._processes)
+        with self.assertRaises(StopIteration):
+            next(generator)
+
+
+@skipUnless(os.environ.get('DJANGO_BENCHMARK'), 'Замер времени импорта запускается с DJANGO_BENCHMARK=1')
+class QuestionnairesBenchmarkTest(TestCase):
+    apps_count = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        Role.objects.create(role_name=SLAVE_ROLE_NAME)
+        BookingType.objects.create(name=BOOKED)
+        Direction.objects.create(name='ИВТ', description='описание')
+        Direction.objects.create(name='Связь', description='описание')
+        Competence.objects.create(name='Python')
+        cls.file = create_import_workbook([
+            {'full_name': f'Фамилия{i} Имя{i} Отчество', 'phone': f'8(900)-{i:07d}', 'email': f'user{i}@test.ru',
+             'directions': ['ИВТ', 'Связь'], 'achievements': ['Патенты на изобретения и полезные модели'],
+             'competencies': {'Python': '[2]'}} for i in range(cls.apps_count)]).getvalue()
+
+    def test_iter_applications(self):
+        start = time.perf_counter()
+        count = sum(1 for _ in Questionnaires(BytesIO(self.file))._iter_applications())
+        logger.info(f'Чтение {count} анкет: {time.perf_counter() - start:.2f} с')
+        self.assertEquals(count, self.apps_count)
+
+    def test_add_applications_to_db_in_bulk(self):
+        start = time.perf_counter()
+        result = Questionnaires(BytesIO(self.file)).add_applications_to_db_in_bulk()
+        logger.info(f'Импорт {len(result["accepted"])} анкет: {time.perf_counter() - start:.2f} с')
+        self.assertEquals(len(result['accepted']), self.apps_count)
+        self.assertEquals(Application.directions.through.objects.count(), 2 * self.apps_count)
+
+
+@skipUnless(os.environ.get('DJANGO_BENCHMARK'), 'Замер времени рендера запускается с DJANGO_BENCHMARK=1')
+class DocxTemplateCacheBenchmarkTest(TestCase):
+    documents_count = 1000
+    path = 'static/docx/templates/interview_list.docx'
+
+    def render_interview_lists(self, get_template):
+        start = time.perf_counter()
+        for i in range(self.documents_count):
+            template = get_template(self.path)
+            template.render({'first_name': f'Имя{i}', 'last_name': f'Фамилия{i}', 'birth_place': 'Москва'})
+            template.save(BytesIO())
+        return time.perf_counter() - start
+
+    def test_render_interview_lists(self):
+        without_cache = self.render_interview_lists(DocxTemplate)
+        with_cache = self.render_interview_lists(DocxTemplateCache().get)
+        logger.info(f'Рендер {self.documents_count} листов собеседования: без кэша {without_cache:.2f} с, '
+                    f'с кэшем {with_cache:.2f} с')
+        self.assertLess(with_cache, without_cache)
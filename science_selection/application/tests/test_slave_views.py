@@ -2,13 +2,16 @@ import datetime
 import json
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
 from django.urls import reverse
 
-from account.models import Role, Member
+from account.models import Role, Member, Affiliation, Booking, BookingType
 from application.models import Direction, Education, Application, AdditionField, Competence, ApplicationCompetencies, \
-    Universities, MilitaryCommissariat, Specialization
-from utils.constants import SLAVE_ROLE_NAME, MASTER_ROLE_NAME
+    Universities, MilitaryCommissariat, Specialization, ApplicationScores, viewed_apps_buffer
+from application.utils import WordTemplate
+from utils.calculations import get_current_draft_year
+from utils.constants import SLAVE_ROLE_NAME, MASTER_ROLE_NAME, BOOKED, PATH_TO_CANDIDATES_LIST, PATH_TO_RATING_LIST, \
+    PATH_TO_EVALUATION_STATEMENT
 
 
 class CreateApplicationViewTest(TestCase):
@@ -192,6 +195,8 @@ class ApplicationViewTest(TestCase):
         }
         self.app = Application.objects.create(member=member, **self.form_data)
         Education.objects.create(application=self.app, **self.education_form_data)
+        viewed_apps_buffer.clear()
+        self.addCleanup(viewed_apps_buffer.clear)
 
     def test_redirect_if_not_logged_in(self):
         resp = self.client.get(reverse('application', kwargs={'pk': self.app.id}))
@@ -631,6 +636,48 @@ class CreateServiceDocumentViewTest(TestCase):
             resp = self.client.get(reverse('create_word_service_document') + '?doc=' + query)
             self.assertEqual(resp.status_code, 403)
 
+    def test_create_context_to_word_files(self):
+        """ Проверяет контексты итоговых документов и то, что количество запросов не зависит от числа заявок """
+        draft_year, draft_season = get_current_draft_year()
+        officer_member = self.user_officer.member
+        booked = BookingType.objects.create(name=BOOKED)
+        slave_role = Role.objects.get(role_name=SLAVE_ROLE_NAME)
+        affiliations = [Affiliation.objects.create(direction=Direction.objects.create(name=f'Направление {i}'),
+                                                   company=i, platoon=i) for i in range(1, 3)]
+        officer_member.affiliations.add(affiliations[0])
+        MilitaryCommissariat.objects.create(name='Йо', subject='Тестовый субъект', city='Тест')
+        for i in range(3):
+            user = User.objects.create(username=f'booked{i}', first_name=f'Имя{i}', last_name=f'Фамилия{i}')
+            member = Member.objects.create(user=user, role=slave_role, phone=f'22222222{i}')
+            app = Application.objects.create(member=member, **{**self.form_data, 'draft_year': draft_year,
+                                                               'draft_season': draft_season[0],
+                                                               'military_commissariat': 'Йо' if i else 'Нет'})
+            Education.objects.create(application=app, education_type='b', university='МЭИ', specialization='ИВТ',
+                                     avg_score=4.5, end_year=2020, theme_of_diploma='Тест')
+            ApplicationScores.objects.create(application=app)
+            Booking.objects.create(booking_type=booked, master=officer_member, slave=member,
+                                   affiliation=affiliations[i // 2])
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='officer')
+
+        with self.assertNumQueries(5):
+            context = WordTemplate(request, PATH_TO_CANDIDATES_LIST).create_context_to_word_files(
+                PATH_TO_CANDIDATES_LIST)
+        self.assertEqual(len(context['directions']), 1)
+        self.assertEqual(context['directions'][0]['name'], 'Направление 1')
+        self.assertEqual([(m['number'], m['last_name'], m['subject']) for m in context['directions'][0]['members']],
+                         [(1, 'Фамилия0', ''), (2, 'Фамилия1', 'Тестовый субъект')])
+
+        with self.assertNumQueries(3):
+            context = WordTemplate(request, PATH_TO_RATING_LIST).create_context_to_word_files(PATH_TO_RATING_LIST,
+                                                                                              True)
+        self.assertEqual([(d['company_number'], len(d['members'])) for d in context['directions']], [(1, 2), (2, 1)])
+        self.assertEqual(context['directions'][1]['members'][0]['avg_score'], '4,5')
+
+        context = WordTemplate(request, PATH_TO_EVALUATION_STATEMENT).create_context_to_word_files(
+            PATH_TO_EVALUATION_STATEMENT, True)
+        self.assertEqual(context['directions'][0]['members'][0]['a1'], '0,0')
+
 
 class CompetenceAutocompleteTest(TestCase):
 
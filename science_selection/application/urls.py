@@ -14,6 +14,8 @@ urlpatterns = [
     path('application/<int:pk>/unsuitable/', views.AddAppToUnsuitable.as_view(), name='add_to_unsuitable'),
     path('application/list/', views.ApplicationListView.as_view(), name='application_list'),
     path('application/list/download/', views.ApplicationsDownloadingView.as_view(), name='downloading_applications'),
+    path('application/list/download/interview-lists/', views.InterviewListsDownloadingView.as_view(),
+         name='downloading_interview_lists'),
     path('application/<int:pk>/finished/', views.ChangeAppFinishedView.as_view(), name='change_finished'),
     path('application/list/service-document/', views.CreateServiceDocumentView.as_view(),
          name='create_word_service_document'),
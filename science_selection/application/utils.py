@@ -1,33 +1,52 @@
+import csv
 import datetime
+import hashlib
 import re
+import tempfile
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from io import BytesIO
+from itertools import islice
 from openpyxl import load_workbook, Workbook
 from openpyxl.utils.cell import get_column_letter
 
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.core.exceptions import PermissionDenied
-from django.db import transaction
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, EmptyResultSet
+from django.core.paginator import Paginator, Page
+from django.db import transaction, connection
+from django.db.models import F, Q, QuerySet, prefetch_related_objects
+from django.db.models.expressions import RawSQL
 from django.db.models.functions import Lower
 from django.shortcuts import get_object_or_404, redirect
-from docxtpl import DocxTemplate
+from django.utils.functional import cached_property
 
 from account.models import Member, Affiliation, Booking, Role, BookingType
+from testing.models import TestSnapshot, UserAnswer
 from engine.middleware import logger
 from utils.calculations import get_current_draft_year, convert_float
-from utils.constants import BOOKED, MEANING_COEFFICIENTS, PATH_TO_RATING_LIST, \
+from utils.constants import BOOKED, IN_WISHLIST, MEANING_COEFFICIENTS, PATH_TO_RATING_LIST, \
     PATH_TO_CANDIDATES_LIST, PATH_TO_EVALUATION_STATEMENT
 from utils import constants as const
 from utils.exceptions import MaxAffiliationBookingException
 from utils.calculations import convert_date_str_to_datetime, convert_datetime_to_str, convert_phone_format
+from utils.docx_templates import docx_template_cache
 
 from .models import Application, AdditionField, AdditionFieldApp, MilitaryCommissariat, Education, Universities, \
-    Specialization, Competence, ApplicationCompetencies, Direction
+    Specialization, Competence, ApplicationCompetencies, Direction, ApplicationScores, calculate_scores, \
+    SEARCH_TABLE_NAME, File, SeasonAppsCounter, ApplicationNote, ApplicationNotes
 
 
 def check_role(user, role_name):
-    """ Проверяет, совпадает ли роль пользователя с заданной через параметр role_name """
-    member = Member.objects.select_related('role').get(user=user)
-    if member.role.role_name == role_name:
+    """
+    Проверяет, совпадает ли роль пользователя с заданной через параметр role_name.
+    Для request.user участник с ролью уже загружен MemberMiddleware, поэтому запросов к БД не делается
+    """
+    member = getattr(user, 'member', None)
+    if member and member.role and member.role.role_name == role_name:
         return True
     return False
 
@@ -71,6 +90,46 @@ def check_permission_decorator(role_names=None):
     return decorator
 
 
+def recompute_scores(apps, batch_size=500):
+    """
+    Пересчитывает оценки a1-a7 и рейтинговый балл заявок пачками: на каждую пачку приходится несколько запросов
+    на чтение и bulk_create/bulk_update вместо поштучного сохранения
+    :param apps: queryset заявок
+    :param batch_size: количество заявок, обрабатываемых за раз
+    :return: количество пересчитанных заявок
+    """
+    app_ids = list(apps.order_by().values_list('id', flat=True))
+    for i in range(0, len(app_ids), batch_size):
+        _recompute_scores_batch(app_ids[i:i + batch_size])
+    return len(app_ids)
+
+
+def _recompute_scores_batch(app_ids):
+    apps = list(Application.objects.filter(id__in=app_ids))
+    postgraduate_app_ids = set(Education.objects.filter(
+        application__in=app_ids, education_type=Education.education_program[2][0], is_ended=True
+    ).values_list('application_id', flat=True))
+    app_scores = {scores.application_id: scores for scores in ApplicationScores.objects.filter(application__in=app_ids)}
+
+    new_scores, updated_scores = [], []
+    for app in apps:
+        scores = calculate_scores(app, app.id in postgraduate_app_ids)
+        app.final_score = scores.pop('final_score')
+        app_score = app_scores.get(app.id)
+        if app_score:
+            updated_scores.append(app_score)
+        else:
+            app_score = ApplicationScores(application=app)
+            new_scores.append(app_score)
+        for criterion, score in scores.items():
+            setattr(app_score, criterion, score)
+
+    with transaction.atomic():
+        ApplicationScores.objects.bulk_create(new_scores)
+        ApplicationScores.objects.bulk_update(updated_scores, ['a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7'])
+        Application.objects.bulk_update(apps, ['final_score'])
+
+
 def check_final_decorator(func):
     """Декоратор, который проверяет, что анкету пользователя можно редактировать.
      В противном случае редиректит на предыдущую страницу"""
@@ -93,7 +152,7 @@ class WordTemplate:
 
     def create_word_in_buffer(self, context):
         """ Создает ворд документ и добавлет в него данные и сохраняет в буфер """
-        template = DocxTemplate(self.path)
+        template = docx_template_cache.get(self.path)
         user_docx = BytesIO()
         template.render(context=context)
         template.save(user_docx)
@@ -105,16 +164,44 @@ class WordTemplate:
         user_app = Application.objects.select_related('member').prefetch_related('education').defer('id').get(pk=pk)
         user_education = user_app.education.order_by('-end_year').values()
         user_education = user_education[0] if user_education else {}
-        context = {**user_app.__dict__, **user_education}
+        return self._get_interview_list_context(user_app, user_education)
+
+    def create_contexts_to_interview_lists(self, apps_id, chunk_size=const.WORD_EXPORT_CHUNK_SIZE):
+        """
+        Генератор контекстов для шаблона - 'Лист собеседования' в порядке apps_id. Заявки и их последнее
+        образование загружаются пачками по chunk_size заявок
+        """
+        for chunk in split_into_chunks(apps_id, chunk_size):
+            user_apps = Application.objects.select_related('member__user').in_bulk(chunk)
+            user_educations = {}
+            for education in Education.objects.filter(application__in=chunk).order_by('application_id',
+                                                                                      '-end_year').values():
+                user_educations.setdefault(education['application_id'], education)
+            for app_id in chunk:
+                yield self._get_interview_list_context(user_apps[app_id], user_educations.get(app_id, {}))
+
+    @staticmethod
+    def _get_interview_list_context(user_app, user_education):
+        context = {k: v for k, v in user_app.__dict__.items() if not k.startswith('_')}
+        context.update(user_education)
         context.update({'father_name': user_app.member.father_name, 'phone': user_app.member.phone})
         context.update({'first_name': user_app.member.user.first_name, 'last_name': user_app.member.user.last_name})
         return context
 
     def create_context_to_word_files(self, document_type, all_directions=None):
-        """ Создает контексты для шаблонов итоговых документов """
+        """
+        Создает контексты для шаблонов итоговых документов. Отобранные заявки всех принадлежностей загружаются
+        одним запросом, субъекты военных комиссариатов - одним запросом по названиям
+        """
         current_year, current_season = get_current_draft_year()
-        fixed_directions = self.request.user.member.affiliations.select_related('direction').all() \
-            if not all_directions else Affiliation.objects.select_related('direction').all()
+        fixed_directions = list(self.request.user.member.affiliations.select_related('direction').all()
+                                if not all_directions else Affiliation.objects.select_related('direction').all())
+        booked_apps_by_affiliation = self._get_booked_apps_by_affiliation(fixed_directions, current_year,
+                                                                          current_season[0])
+        commissariat_subjects = {}
+        if document_type == PATH_TO_CANDIDATES_LIST:
+            commissariat_subjects = self._get_commissariat_subjects(
+                {app.military_commissariat for apps in booked_apps_by_affiliation.values() for app in apps})
 
         context = {'directions': []}
         for direction in fixed_directions:
@@ -123,11 +210,7 @@ class WordTemplate:
                 'company_number': direction.company,
                 'members': []
             }
-            booked = Booking.objects.select_related('slave').filter(affiliation=direction, booking_type__name=BOOKED)
-            booked_slaves = [b.slave for b in booked]
-            booked_user_apps = Application.objects.select_related('scores', 'member__user').prefetch_related(
-                'education'). \
-                filter(member__in=booked_slaves, draft_year=current_year, draft_season=current_season[0]).all()
+            booked_user_apps = booked_apps_by_affiliation.get(direction.id, [])
 
             for i, user_app in enumerate(booked_user_apps):
                 user_last_education = user_app.education.all()[0]
@@ -138,7 +221,7 @@ class WordTemplate:
                                                  'final_score': convert_float(user_app.final_score),
                                                  }, {}
                 if document_type == PATH_TO_CANDIDATES_LIST:
-                    additional_info = self._get_candidates_info(user_app, user_last_education)
+                    additional_info = self._get_candidates_info(user_app, user_last_education, commissariat_subjects)
                 elif document_type == PATH_TO_RATING_LIST:
                     additional_info = self._get_rating_info(user_app, user_last_education)
                 elif document_type == PATH_TO_EVALUATION_STATEMENT:
@@ -148,22 +231,72 @@ class WordTemplate:
                 context['directions'].append(platoon_data)
         return context
 
+    @staticmethod
+    def _get_booked_apps_by_affiliation(affiliations, draft_year, draft_season):
+        """
+        Возвращает заявки призыва, отобранные на переданные принадлежности, сгруппированные по id принадлежности.
+        Заявки внутри принадлежности идут в порядке сортировки Application
+        """
+        booked_user_apps = Application.objects.select_related('scores', 'member__user').prefetch_related(
+            'education').filter(member__candidate__affiliation__in=[affiliation.id for affiliation in affiliations],
+                                member__candidate__booking_type__name=BOOKED, draft_year=draft_year,
+                                draft_season=draft_season).annotate(
+            booked_affiliation_id=F('member__candidate__affiliation'))
+        booked_apps_by_affiliation = {}
+        for user_app in booked_user_apps:
+            booked_apps_by_affiliation.setdefault(user_app.booked_affiliation_id, {}).setdefault(user_app.id, user_app)
+        return {affiliation_id: list(apps.values()) for affiliation_id, apps in booked_apps_by_affiliation.items()}
+
+    @staticmethod
+    def _get_commissariat_subjects(names):
+        """Возвращает словарь {название военного комиссариата: субъект}"""
+        commissariat_subjects = {}
+        for name, subject in MilitaryCommissariat.objects.filter(name__in=names).values_list('name', 'subject'):
+            commissariat_subjects.setdefault(name, subject)
+        return commissariat_subjects
+
     def create_context_to_psychological_test(self, user_test_result, questions, user_answers):
         """ Создает контекст для шаблона - 'Психологического теста ОПВС - 2' """
         user_app = Application.objects.only('birth_day').get(member=user_test_result.member)
-        member = user_test_result.member
+        return self._get_psychological_test_context(user_test_result.member, user_app.birth_day,
+                                                    self._get_psychological_test_questions(questions), user_answers)
+
+    def create_contexts_to_psychological_tests(self, test, test_results, chunk_size=const.WORD_EXPORT_CHUNK_SIZE):
+        """
+        Генератор контекстов для шаблона психологического теста test в порядке test_results. Вопросы теста
+        загружаются один раз, ответы пользователей - одним запросом на каждые chunk_size результатов
+        :param test_results: результаты теста test с select_related('member__user') и аннотацией birth_day
+        """
+        questions = self._get_psychological_test_questions(TestSnapshot.load(test.pk, test.version).questions)
+        for chunk in split_into_chunks(test_results, chunk_size):
+            user_answers = {}
+            for member_id, question_id, answer_option in UserAnswer.objects.filter(
+                    question__test=test, member__in=[test_result.member_id for test_result in chunk]).values_list(
+                    'member_id', 'question_id', 'answer_option'):
+                user_answers.setdefault(member_id, {})[question_id] = answer_option[0]
+            for test_result in chunk:
+                yield self._get_psychological_test_context(test_result.member, test_result.birth_day, questions,
+                                                           user_answers.get(test_result.member_id, {}))
+
+    @staticmethod
+    def _get_psychological_test_questions(questions):
+        """Возвращает список пар (id вопроса, id вариантов ответа) в порядке вопросов теста"""
+        return [(question.id, [ans.id for ans in question.answer_options.all()]) for question in questions]
+
+    @staticmethod
+    def _get_psychological_test_context(member, birth_day, questions, user_answers):
         context = {
             'full_name': f'{member.user.last_name} {member.user.first_name} {member.father_name}',
-            'b_day': user_app.birth_day.strftime('%d %m %Y'),
+            'b_day': birth_day.strftime('%d %m %Y'),
             'now': datetime.datetime.now().strftime('%d %m %Y'),
             'position': 'гражданин',
             'questions': []
         }
-        for i, question in enumerate(questions, 1):
+        for i, (question_id, answers) in enumerate(questions, 1):
             context['questions'].append({
                 'num': i,
-                'answers': [ans.id for ans in question.answer_options.all()],
-                'response': user_answers.get(question.id)
+                'answers': answers,
+                'response': user_answers.get(question_id)
             })
         return context
 
@@ -182,10 +315,9 @@ class WordTemplate:
             'avg_score': convert_float(user_last_education.avg_score),
         }
 
-    def _get_candidates_info(self, user_app, user_last_education):
-        commissariat = MilitaryCommissariat.objects.filter(name=user_app.military_commissariat).first()
+    def _get_candidates_info(self, user_app, user_last_education, commissariat_subjects):
         return {
-            'subject': commissariat.subject if commissariat else '',
+            'subject': commissariat_subjects.get(user_app.military_commissariat, ''),
             'birth_day': user_app.birth_day.year,
             'avg_score': convert_float(user_last_education.avg_score),
         }
@@ -204,11 +336,72 @@ def is_booked_our(pk, user):
     в обратном случае - False
     """
     app = get_object_or_404(Application, pk=pk)
-    master_affiliations = Affiliation.objects.filter(member=user.member)
+    master_affiliations = user.member.get_master_context().affiliations_id
     return Booking.objects.filter(slave=app.member, booking_type__name=BOOKED,
                                   affiliation__in=master_affiliations).exists()
 
 
+def set_booking_status(apps, member, master_affiliations_id):
+    """
+    Рассчитывает статусы бронирования заявок одним запросом к Booking и сохраняет их в атрибуты заявок:
+    is_booked, company, platoon, booked_id - забронирована ли заявка и куда;
+    is_booked_our, can_unbook - забронирована ли на принадлежности мастера и может ли он ее разбронировать;
+    wishlist_len, is_in_wishlist, our_wishlist - количество добавлений в избранное, в том числе мастером
+    :param apps: итерируемый объект заявок (queryset страницы или список)
+    :param member: мастер, для которого рассчитываются статусы
+    :param master_affiliations_id: id принадлежностей мастера
+    :return: переданные заявки
+    """
+    master_affiliations_id = set(master_affiliations_id)
+    apps_by_member = {}
+    for app in apps:
+        app.is_booked = app.is_booked_our = app.can_unbook = app.is_in_wishlist = False
+        app.company = app.platoon = app.booked_id = None
+        app.wishlist_len = 0
+        app.our_wishlist = []
+        apps_by_member[app.member_id] = app
+    if not apps_by_member:
+        return apps
+
+    bookings = Booking.objects.filter(slave__in=apps_by_member.keys(), booking_type__name__in=[BOOKED, IN_WISHLIST]) \
+        .select_related('booking_type', 'affiliation').only('slave_id', 'master_id', 'booking_type__name',
+                                                            'affiliation__id', 'affiliation__company',
+                                                            'affiliation__platoon', 'affiliation__direction_id')
+    for booking in bookings:
+        app = apps_by_member[booking.slave_id]
+        is_our_affiliation = booking.affiliation_id in master_affiliations_id
+        if booking.booking_type.name == BOOKED:
+            if not app.is_booked:
+                app.is_booked = True
+                app.booked_id = booking.affiliation_id
+                app.company = booking.affiliation.company if booking.affiliation else None
+                app.platoon = booking.affiliation.platoon if booking.affiliation else None
+            app.is_booked_our = app.is_booked_our or is_our_affiliation
+            app.can_unbook = app.can_unbook or (is_our_affiliation and booking.master_id == member.id)
+        else:
+            app.wishlist_len += 1
+            if is_our_affiliation:
+                app.is_in_wishlist = True
+                app.our_wishlist.append(booking)
+    return apps
+
+
+def set_application_notes(apps, member, master_affiliations_id):
+    """
+    Загружает заметки заявок, видимые мастеру, одним запросом (см. ApplicationNote.get_visible_notes) и сохраняет их
+    в атрибуты заявок: app_note и other_notes - заметка мастера и заметки других авторов,
+    author_note и note - текст заметки мастера и текст первой видимой заметки для списков заявок
+    :return: переданные заявки
+    """
+    notes = ApplicationNote.get_visible_notes([app.id for app in apps], member, master_affiliations_id)
+    for app in apps:
+        app.app_note, app.other_notes = notes.get(app.id, ApplicationNotes(None, []))
+        app.author_note = app.app_note.text if app.app_note else None
+        first_note = app.other_notes[0] if app.other_notes else app.app_note
+        app.note = first_note.text if first_note else None
+    return apps
+
+
 def add_additional_fields(request, user_app):
     additional_fields = [int(re.search('\d+', field).group(0)) for field in request.POST
                          if const.NAME_ADDITIONAL_FIELD_TEMPLATE in field]
@@ -227,32 +420,162 @@ def get_additional_fields(request):
 
 
 def get_cleared_query_string_of_page(query_string):
-    """Возвращает строку query-параметров без параметра page"""
+    """Возвращает строку query-параметров без параметров page и cursor"""
     if not query_string:
         return ''
-    return '&'.join(param for param in query_string.split('&') if 'page=' not in param) + '&'
+    return '&'.join(param for param in query_string.split('&')
+                    if 'page=' not in param and 'cursor=' not in param) + '&'
 
 
 def get_sorted_queryset(apps, ordering):
-    """Возвращает отсортированый queryset по our_direction и ordering(если есть)"""
+    """
+    Возвращает отсортированый queryset по our_direction и ordering(если есть).
+    Заявки с одинаковыми значениями ordering упорядочиваются по id в том же направлении
+    """
     if ordering:
+        pk_ordering = '-pk' if ordering.startswith('-') else 'pk'
         if ordering in ['subject_name', 'birth_place']:
             # если поля для поиска текстовое, то сортируем в lowercase
             ordering = Lower(ordering)
-        return apps.order_by('-our_direction', ordering)
-    return apps.order_by('-our_direction', '-create_date')
+        return apps.order_by('-our_direction', ordering, pk_ordering)
+    return apps.order_by('-our_direction', '-create_date', '-pk')
+
+
+class KeysetPage(Page):
+    """Страница, полученная пагинацией по ключу. Вместо номеров соседних страниц хранит курсоры на них"""
+
+    def __init__(self, object_list, number, paginator, next_cursor=None, previous_cursor=None):
+        super().__init__(object_list, number, paginator)
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def start_index(self):
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self) - 1
+
+
+class KeysetPaginator(Paginator):
+    """
+    Пагинатор, который помимо обычного разбиения на страницы через OFFSET умеет выбирать страницу по ключу
+    сортировки (keyset pagination): следующая страница - это записи, идущие по ключу после последней записи текущей.
+    Общее количество записей считается только по id, без аннотаций и сортировки. Если задан count_cache_timeout,
+    то количество кэшируется на это время и может отставать от реального
+    """
+    cursor_salt = 'application.keyset_paginator'
+
+    def __init__(self, *args, count_cache_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_cache_timeout = count_cache_timeout
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        ids = self.object_list.order_by().values('pk')
+        if not self.count_cache_timeout:
+            return ids.count()
+        try:
+            sql, params = ids.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'keyset_paginator_count_' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = ids.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+    def keyset_page(self, keys, cursor):
+        """
+        Возвращает страницу, на которую указывает cursor
+        :param keys: ключ сортировки - список пар (поле, по убыванию); последнее поле должно быть уникальным
+        :param cursor: курсор из next_cursor/previous_cursor другой страницы. Пустой или испорченный курсор
+        указывает на первую страницу
+        :return: KeysetPage
+        """
+        try:
+            cursor = signing.loads(cursor, salt=self.cursor_salt) if cursor else None
+        except signing.BadSignature:
+            cursor = None
+        number, values, backward = (cursor['n'], cursor['v'], cursor['b']) if cursor else (1, None, False)
+
+        queryset = self.object_list.order_by(*[('-' if desc != backward else '') + field for field, desc in keys])
+        if values:
+            queryset = queryset.filter(self._get_keyset_filter(keys, values, backward))
+        objects = list(queryset[:self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if backward:
+            objects.reverse()
+        has_next = not backward and has_more or backward and bool(objects)
+        has_previous = number > 1 and bool(objects) and (not backward or has_more)
+        next_cursor = self._make_cursor(number + 1, keys, objects[-1], False) if has_next else None
+        previous_cursor = self._make_cursor(number - 1, keys, objects[0], True) if has_previous else None
+        return KeysetPage(objects, number, self, next_cursor, previous_cursor)
+
+    @staticmethod
+    def _get_keyset_filter(keys, values, backward):
+        """Возвращает условие на записи, идущие по ключу keys после (или до, если backward) записи со значениями values"""
+        q = Q()
+        for i, (field, desc) in enumerate(keys):
+            equal_fields = {prev_field: value for (prev_field, _), value in zip(keys[:i], values[:i])}
+            lookup = 'lt' if desc != backward else 'gt'
+            q |= Q(**equal_fields, **{f'{field}__{lookup}': values[i]})
+        return q
+
+    def _make_cursor(self, number, keys, obj, backward):
+        values = []
+        for field, _ in keys:
+            value = getattr(obj, field)
+            values.append(value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value)
+        return signing.dumps({'n': number, 'v': values, 'b': backward}, salt=self.cursor_salt)
+
+
+def filter_by_search_document(apps, search):
+    """
+    Фильтрует заявки, в поисковом документе которых встречается вся строка search или любое слово из нее.
+    В PostgreSQL поиск использует триграммный индекс по search_document, в SQLite - FTS5 таблицу SEARCH_TABLE_NAME
+    (FTS5 с триграммами ищет только строки от 3 символов, более короткие ищутся по search_document)
+    :param apps: queryset заявок
+    :param search: строка поиска
+    :return: отфильтрованный queryset
+    """
+    search = search.lower()
+    q = Q()
+    for term in {search, *search.split()}:
+        if connection.vendor == 'sqlite' and len(term) >= 3:
+            match = '"' + term.replace('"', '""') + '"'
+            q |= Q(id__in=RawSQL(f'SELECT rowid FROM {SEARCH_TABLE_NAME} WHERE {SEARCH_TABLE_NAME} MATCH %s', (match,)))
+        else:
+            q |= Q(search_document__contains=term)
+    return apps.filter(q)
 
 
 def get_form_data(get_dict):
-    """Если в словаре get_dict содержится что-то кроме page, то возвращает его. В противном случае возвращает None"""
+    """Если в словаре get_dict содержится что-то кроме page и cursor, то возвращает его.
+    В противном случае возвращает None"""
     orig_dict = dict(get_dict)
     orig_dict.pop('page', None)
+    orig_dict.pop('cursor', None)
     if not orig_dict:
         return None
     return get_dict
 
 
 class Questionnaires:
+    # поля, значения которых могут занимать несколько строк таблицы, начиная с 23 колонки
+    user_info_fields = ('user_directions', 'user_achievements', 'scientific_achievements', 'scholarships',
+                        'candidate_exams', 'sporting_achievements', 'hobby', 'other_information')
+    user_info_first_column = 22
+
     def __init__(self, file):
         wb = load_workbook(file, read_only=True)
         sheet = wb.active
@@ -268,32 +591,240 @@ class Questionnaires:
             'errors': [],
             'accepted': [],
         }
-        for line_number, row in enumerate(self.sheet.iter_rows(min_row=2, values_only=True), start=1):
-            params = {name: cell for name, cell in zip(const.EXCEL_TABLE_HEADERS_FOR_IMPORT_APPS, row)}
-            if not params['id']:
+        for params, user_info in self._iter_applications():
+            self._add_application_to_db(result, params, user_info)
+        return result
+
+    def add_applications_to_db_in_bulk(self, chunk_size=const.IMPORT_APPS_CHUNK_SIZE, progress_callback=None):
+        """
+        Импорт заявок пачками: справочники загружаются один раз, существующие участники ищутся одним запросом
+        на пачку, пользователи, участники, заявки, образование, направления, компетенции и оценки создаются через
+        bulk_create. Если пачку не удалось сохранить целиком, ее заявки загружаются по одной
+        :param chunk_size: количество заявок в пачке
+        :param progress_callback: функция, которая после каждой пачки получает количество обработанных заявок
+         и текущий словарь с сообщениями
+        :return: словарь с сообщениями errors и accepted, как у add_applications_to_db
+        """
+        result = {
+            'errors': [],
+            'accepted': [],
+        }
+        self._load_import_references()
+        rows_processed = 0
+        for chunk in split_into_chunks(self._iter_applications(), chunk_size):
+            chunk_result = {'errors': [], 'accepted': []}
+            try:
+                with transaction.atomic():
+                    self._add_chunk_to_db(chunk_result, chunk)
+            except Exception as e:
+                logger.error(f'Ошибка при пакетной загрузке анкет, анкеты будут загружены по одной - {e}')
+                chunk_result = {'errors': [], 'accepted': []}
+                for params, user_info in chunk:
+                    self._add_application_to_db(chunk_result, params, user_info)
+            result['errors'].extend(chunk_result['errors'])
+            result['accepted'].extend(chunk_result['accepted'])
+            rows_processed += len(chunk)
+            if progress_callback:
+                progress_callback(rows_processed, result)
+        return result
+
+    def _iter_applications(self):
+        """
+        Читает таблицу за один проход и возвращает параметры каждой заявки вместе с информацией о направлениях,
+        достижениях и т.д. из строки заявки и следующих за ней строк продолжения (строк без id)
+        """
+        params, user_info = None, None
+        for row in self.sheet.iter_rows(min_row=2, values_only=True):
+            if row and row[0]:
+                if params:
+                    yield params, self._convert_user_info(user_info)
+                params = {name: cell for name, cell in zip(const.EXCEL_TABLE_HEADERS_FOR_IMPORT_APPS, row)}
+                user_info = {field_name: [] for field_name in self.user_info_fields}
+            if not params:
                 continue
-            user_params = self._get_params_for_member_create(params)
-            if member := Member.if_member_exists(user_params['phone'], user_params['email']):
-                if not self._delete_app_if_not_booked(member):
+            for i, field_name in enumerate(self.user_info_fields, start=self.user_info_first_column):
+                cell = row[i] if i < len(row) else None
+                user_info[field_name].append(cell.strip()) if cell else None
+        if params:
+            yield params, self._convert_user_info(user_info)
+
+    @staticmethod
+    def _convert_user_info(user_info):
+        user_info['user_directions'] = [_[1:-1] for _ in user_info['user_directions']]
+        user_info['user_achievements'] = [_[1:-1] for _ in user_info['user_achievements']]
+        return user_info
+
+    def _add_application_to_db(self, result, params, user_info):
+        user_params = self._get_params_for_member_create(params)
+        if member := Member.if_member_exists(user_params['phone'], user_params['email']):
+            if not self._delete_app_if_not_booked(member):
+                result['errors'].append(
+                    f"Анкета пользователя {params['full_name']} (id: {params['id']}) уже была создана и забронированна ранее!")
+                return
+            result['errors'].append(
+                f"Анкета пользователя {params['full_name']} (id: {params['id']}) уже была создана и была обновлена!")
+
+        try:
+            with transaction.atomic():
+                member = self.create_member(user_params) if not member else member
+                new_app = self.create_application(member, params)
+                self.add_education(new_app, params)
+                self.add_additional_values(new_app, params, user_info)
+                new_app.update_scores()
+            result['accepted'].append(
+                f"Анкета пользователя {params['full_name']} с id: {params['id']} успешно создана!")
+        except Exception as e:
+            result['errors'].append(f"Ошибка при создании анкеты с id:{params['id']} - {e}")
+            logger.error(f'Ошибка в анкете с id: {params["id"]} - {e}')
+
+    def _load_import_references(self):
+        """Загружает справочники, необходимые для пакетного импорта"""
+        self._slave_role = Role.objects.get(role_name=const.SLAVE_ROLE_NAME)
+        self._password_hash = make_password(const.USER_PASSWORD)
+        self._directions_by_name = {}
+        for direction_id, name in Direction.objects.values_list('id', 'name'):
+            self._directions_by_name.setdefault(name, []).append(direction_id)
+        self._competencies_by_name = {}
+        for competence_id, name in Competence.objects.filter(name__in=const.EXIST_COMPETENCIES_ON_SITE).values_list(
+                'id', 'name'):
+            self._competencies_by_name.setdefault(name, []).append(competence_id)
+
+    def _add_chunk_to_db(self, result, chunk):
+        """
+        Сохраняет пачку заявок. Сообщения формируются в том же порядке и с тем же текстом, что и при загрузке по одной.
+        :param result: словарь с сообщениями errors и accepted
+        :param chunk: список пар (параметры заявки, информация из строк заявки)
+        """
+        rows = [(params, user_info, self._get_params_for_member_create(params)) for params, user_info in chunk]
+        members_by_phone, members_by_email = self._get_existing_members(rows)
+        existing_members_id = {member.id for member in members_by_phone.values()} | {
+            member.id for member in members_by_email.values()}
+        booked_members_id = set(Booking.objects.filter(
+            slave__in=existing_members_id, booking_type__name=BOOKED).values_list('slave_id', flat=True))
+        members_with_files = set(File.objects.filter(member__in=existing_members_id).values_list('member_id', flat=True))
+
+        members_to_clear, imported_apps = set(), {}
+        for params, user_info, user_params in rows:
+            member = members_by_phone.get(user_params['phone']) or members_by_email.get(user_params['email'])
+            if member:
+                if member.id in booked_members_id:
                     result['errors'].append(
                         f"Анкета пользователя {params['full_name']} (id: {params['id']}) уже была создана и забронированна ранее!")
                     continue
                 result['errors'].append(
                     f"Анкета пользователя {params['full_name']} (id: {params['id']}) уже была создана и была обновлена!")
+                if member.id:
+                    members_to_clear.add(member.id)
+                imported_apps.pop(id(member), None)
 
             try:
-                with transaction.atomic():
-                    member = self.create_member(user_params) if not member else member
-                    new_app = self.create_application(member, params)
-                    self.add_education(new_app, params)
-                    self.add_additional_values(line_number, new_app, params)
-                    new_app.update_scores()
-                result['accepted'].append(
-                    f"Анкета пользователя {params['full_name']} с id: {params['id']} успешно создана!")
+                imported_app = self._build_imported_app(params, user_info, member.id in members_with_files
+                                                        if member else False)
             except Exception as e:
                 result['errors'].append(f"Ошибка при создании анкеты с id:{params['id']} - {e}")
                 logger.error(f'Ошибка в анкете с id: {params["id"]} - {e}')
-        return result
+                continue
+            if not member:
+                member = self._build_member(user_params)
+                members_by_phone[user_params['phone']] = members_by_email[user_params['email']] = member
+            imported_app['member'] = member
+            imported_apps[id(member)] = imported_app
+            result['accepted'].append(
+                f"Анкета пользователя {params['full_name']} с id: {params['id']} успешно создана!")
+
+        Application.objects.filter(member__in=members_to_clear).delete()
+        self._save_imported_apps(list(imported_apps.values()))
+
+    def _get_existing_members(self, rows):
+        """Ищет участников, уже зарегистрированных с телефонами или почтами из пачки, одним запросом"""
+        phones = {user_params['phone'] for _, _, user_params in rows}
+        emails = {user_params['email'] for _, _, user_params in rows}
+        members_by_phone, members_by_email = {}, {}
+        for member in Member.objects.filter(Q(phone__in=phones) | Q(user__email__in=emails)).select_related('user'):
+            if member.phone in phones:
+                members_by_phone.setdefault(member.phone, member)
+            if member.user.email in emails:
+                members_by_email.setdefault(member.user.email, member)
+        return members_by_phone, members_by_email
+
+    def _build_member(self, user_params):
+        """Создает несохраненного участника с несохраненным пользователем"""
+        user = User(username=User.normalize_username(user_params.get('email')),
+                    email=User.objects.normalize_email(user_params.get('email')),
+                    first_name=user_params.get('first_name'), last_name=user_params.get('last_name'),
+                    password=self._password_hash)
+        return Member(user=user, role=self._slave_role, father_name=user_params.get('father_name'),
+                      phone=user_params.get('phone'))
+
+    def _build_imported_app(self, params, user_info, member_has_files):
+        """
+        Подготавливает несохраненные заявку, образование, оценки и связи заявки без обращений к БД
+        :param member_has_files: есть ли у участника загруженные файлы (для подсчета заполненности)
+        :return: словарь с заявкой и связанными с ней объектами
+        """
+        app = self._build_application(params)
+        education = self._build_education(params)
+        self._set_achievements(app, user_info['user_achievements'])
+        self._set_additional_app_params(app, user_info)
+        directions_id = [direction_id for name in set(user_info['user_directions'])
+                         for direction_id in self._directions_by_name.get(name, [])]
+        competencies = [(competence_id, int(params[name][1:-1])) for name in const.EXIST_COMPETENCIES_ON_SITE
+                        if params[name] != '[0]' for competence_id in self._competencies_by_name.get(name, [])]
+
+        app.last_university = education.university
+        app.last_specialization = education.specialization
+        app.last_avg_score = education.avg_score
+        app.last_education_type = education.education_type
+        # блоки заполненности в том же порядке, что и в Application.get_filed_blocks
+        filed_blocks = [True, True, bool(directions_id), bool(competencies), member_has_files]
+        app.fullness = int(len([block for block in filed_blocks if block]) / len(filed_blocks) * 100)
+        has_ended_postgraduate = education.education_type == Education.education_program[2][0] and education.is_ended
+        scores = calculate_scores(app, has_ended_postgraduate)
+        app.final_score = scores.pop('final_score')
+        return {'app': app, 'education': education, 'scores': scores, 'directions_id': directions_id,
+                'competencies': competencies}
+
+    def _save_imported_apps(self, imported_apps):
+        """Сохраняет подготовленные заявки и связанные с ними объекты через bulk_create"""
+        new_members = [imported_app['member'] for imported_app in imported_apps if not imported_app['member'].pk]
+        User.objects.bulk_create([member.user for member in new_members])
+        users_id = dict(User.objects.filter(username__in=[member.user.username for member in new_members]).values_list(
+            'username', 'id'))
+        for member in new_members:
+            member.user.pk = users_id[member.user.username]
+            member.user = member.user
+        Member.objects.bulk_create(new_members)
+        members_id = dict(Member.objects.filter(user__in=users_id.values()).values_list('user_id', 'id'))
+        for member in new_members:
+            member.pk = members_id[member.user_id]
+
+        for imported_app in imported_apps:
+            imported_app['app'].member = imported_app['member']
+        Application.objects.bulk_create([imported_app['app'] for imported_app in imported_apps])
+        # bulk_create не отправляет post_save, поэтому счетчики заявок призывов обновляются здесь
+        draft_times = Counter((imported_app['app'].draft_year, imported_app['app'].draft_season)
+                              for imported_app in imported_apps)
+        for (draft_year, draft_season), count in draft_times.items():
+            SeasonAppsCounter.change_count(count, draft_year=draft_year, draft_season=draft_season)
+        apps_id = dict(Application.objects.filter(
+            member__in=[imported_app['member'].pk for imported_app in imported_apps]).values_list('member_id', 'id'))
+
+        educations, directions, competencies, scores = [], [], [], []
+        for imported_app in imported_apps:
+            app_id = apps_id[imported_app['member'].pk]
+            imported_app['app'].pk = app_id
+            imported_app['education'].application_id = app_id
+            educations.append(imported_app['education'])
+            directions.extend(Application.directions.through(application_id=app_id, direction_id=direction_id)
+                              for direction_id in imported_app['directions_id'])
+            competencies.extend(ApplicationCompetencies(application_id=app_id, competence_id=competence_id, level=level)
+                                for competence_id, level in imported_app['competencies'])
+            scores.append(ApplicationScores(application_id=app_id, **imported_app['scores']))
+        Education.objects.bulk_create(educations)
+        Application.directions.through.objects.bulk_create(directions)
+        ApplicationCompetencies.objects.bulk_create(competencies)
+        ApplicationScores.objects.bulk_create(scores)
+        Application.update_search_documents(Application.objects.filter(id__in=apps_id.values()))
 
     def _delete_app_if_not_booked(self, member):
         if not Booking.objects.filter(slave=member, booking_type=BookingType.objects.get(name=BOOKED)):
@@ -302,58 +833,68 @@ class Questionnaires:
         return False
 
     def create_application(self, member, params):
+        app = self._build_application(params)
+        app.member = member
+        app.save()
+        return app
+
+    def _build_application(self, params):
         birth_day = convert_date_str_to_datetime(params['birth_day'].split()[0], '%d.%m.%Y')
         ready_to_secret = self._convert_ready_to_secret(params['ready_to_secret'])
         draft_season = Converter.convert_draft_season_by_name(params['draft_season'][1:-1])
-        return Application.objects.create(member=member, birth_day=birth_day, birth_place=params['birth_place'],
-                                          nationality=params['nationality'],
-                                          military_commissariat=params['military_commissariat'],
-                                          group_of_health=params['group_of_health'],
-                                          draft_year=int(params['draft_year']),
-                                          draft_season=draft_season, ready_to_secret=ready_to_secret, )
+        return Application(birth_day=birth_day, birth_place=params['birth_place'],
+                           nationality=params['nationality'],
+                           military_commissariat=params['military_commissariat'],
+                           group_of_health=params['group_of_health'],
+                           draft_year=int(params['draft_year']),
+                           draft_season=draft_season, ready_to_secret=ready_to_secret, )
 
     def _convert_ready_to_secret(self, ready_to_secret):
         return True if ready_to_secret == '[Да]' else False
 
     def add_education(self, app, params):
+        education = self._build_education(params)
+        education.application = app
+        education.save()
+        return education
+
+    def _build_education(self, params):
         education_type = Converter.convert_education_type_by_name(params['education_type'][1:-1])
-        university, specialization = self._get_university_and_specialization(params['university'],
-                                                                             params['specialization'])
-        return Education.objects.create(application=app, education_type=education_type, university=university,
-                                        specialization=specialization, end_year=int(params['end_year']),
-                                        avg_score=round(float(params['avg_score'].replace(',', '.')), 2),
-                                        name_of_education_doc=params['name_of_education_doc'],
-                                        theme_of_diploma=params['theme_of_diploma'])
-
-    def _get_university_and_specialization(self, university, specialization):
-        uni = Universities.get_by_name_or_leave(university)
-        spec = Specialization.get_by_name_or_leave(specialization)
-        return uni, spec
-
-    def add_additional_values(self, line_number, app, params):
-        user_info = self._get_user_directions_achievements_and_other_info(line_number)
+        return Education(education_type=education_type, university=params['university'],
+                         specialization=params['specialization'], end_year=int(params['end_year']),
+                         avg_score=round(float(params['avg_score'].replace(',', '.')), 2),
+                         name_of_education_doc=params['name_of_education_doc'],
+                         theme_of_diploma=params['theme_of_diploma'])
+
+    def add_additional_values(self, app, params, user_info):
         self.add_directions_to_app(app, user_info['user_directions'])
         self.add_achievements_to_app(app, user_info['user_achievements'])
         self.update_additional_app_params(app, user_info)
         self.add_competencies_to_app(app, params)
 
     def add_achievements_to_app(self, app, user_achievements):
+        self._set_achievements(app, user_achievements)
+        app.save()
+
+    def _set_achievements(self, app, user_achievements):
         for achievement in user_achievements:
             setattr(app, const.CONVERTER_ACHIEVEMENTS_NAMES_TO_MODEL_FIELDS[achievement], True)
-        app.save()
 
     def add_directions_to_app(self, app, user_directions):
         directions = Direction.objects.filter(name__in=user_directions)
         app.directions.add(*directions)
 
     def update_additional_app_params(self, app, user_info):
+        self._set_additional_app_params(app, user_info)
+        app.save()
+
+    def _set_additional_app_params(self, app, user_info):
         app.scientific_achievements = '\n'.join(user_info['scientific_achievements']) or ''
         app.scholarships = '\n'.join(user_info['scholarships']) or ''
         app.candidate_exams = '\n'.join(user_info['candidate_exams']) or ''
         app.sporting_achievements = '\n'.join(user_info['sporting_achievements']) or ''
         app.other_information = '\n'.join(user_info['other_information']) or ''
         app.hobby = '\n'.join(user_info['hobby']) or ''
-        app.save()
 
     def add_competencies_to_app(self, app, params):
         user_selected_competencies = [comp for comp in const.EXIST_COMPETENCIES_ON_SITE if params[comp] != '[0]']
@@ -363,34 +904,6 @@ class Questionnaires:
                                     for competence in competencies]
         ApplicationCompetencies.objects.bulk_create(competencies_with_levels)
 
-    def _get_user_directions_achievements_and_other_info(self, line_number):
-        following_app = None
-        for j, row in enumerate(self.sheet.iter_rows(min_row=line_number + 2, values_only=True)):
-            if row[0]:
-                following_app = j + line_number + 2  # номер итерации + номер текущей строки с данными + номер 1 строки с данными excel
-                break
-
-        user_info = {
-            'user_directions': [],
-            'user_achievements': [],
-            'scientific_achievements': [],
-            'scholarships': [],
-            'candidate_exams': [],
-            'sporting_achievements': [],
-            'hobby': [],
-            'other_information': [],
-        }
-
-        last_row_with_user_info = following_app if following_app else self.sheet.max_row + 1
-        for row in range(line_number + 2 - 1, last_row_with_user_info):
-            for i, field_name, in enumerate(user_info.keys()):
-                cell = self.sheet.cell(row=row, column=23 + i).value
-                user_info[field_name].append(cell.strip()) if cell else None
-
-        user_info['user_directions'] = [_[1:-1] for _ in user_info['user_directions']]
-        user_info['user_achievements'] = [_[1:-1] for _ in user_info['user_achievements']]
-        return user_info
-
     def _create_new_user(self, member_params):
         return User.objects.create_user(username=member_params.get('email'),
                                         password=const.USER_PASSWORD,
@@ -410,9 +923,171 @@ class Questionnaires:
         }
 
 
+def run_import_job(job):
+    """
+    Выполняет задачу импорта анкет: загружает анкеты из файла задачи, сохраняя прогресс после каждой пачки,
+    и сохраняет итоговый отчет
+    :param job: задача ImportJob в статусе выполнения
+    """
+    try:
+        with job.file.open('rb') as file:
+            result = Questionnaires(file=file).add_applications_to_db_in_bulk(
+                chunk_size=const.IMPORT_APPS_CHUNK_SIZE, progress_callback=job.update_progress)
+    except Exception as e:
+        logger.error(f'Ошибка при выполнении задачи импорта {job.pk} - {e}')
+        job.finish(error=str(e))
+        return
+    logger.info(f'Задача импорта {job.pk} выполнена: {len(result["accepted"])} анкет загружено, '
+                f'{len(result["errors"])} ошибок')
+    job.finish(result=result)
+
+
+def render_word_document(path_to_template, context):
+    """Создает ворд документ по шаблону и возвращает его содержимое (выполняется в процессах пула)"""
+    return WordTemplate(None, path_to_template).create_word_in_buffer(context).getvalue()
+
+
+def render_word_documents(path_to_template, documents, workers=const.WORD_EXPORT_WORKERS,
+                          max_pending=const.WORD_EXPORT_MAX_PENDING):
+    """
+    Генератор, создающий ворд документы в пуле из workers процессов. Документы возвращаются по мере готовности,
+    а не в порядке documents. В работе одновременно находится не больше max_pending документов, поэтому
+    контексты и готовые документы не накапливаются в памяти
+    :param documents: итерируемый объект пар (имя документа, контекст)
+    :return: пары (имя документа, содержимое документа)
+    """
+    documents = iter(documents)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = {}
+    try:
+        while True:
+            for name, context in islice(documents, max_pending - len(pending)):
+                pending[executor.submit(render_word_document, path_to_template, context)] = name
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    finally:
+        # cancel_futures у shutdown появился только в python 3.9
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class ZipStreamBuffer:
+    """Буфер, в который zipfile пишет архив без перемотки. Записанные байты забираются методом pop"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files):
+    """
+    Генератор, отдающий zip архив по частям по мере добавления в него файлов. Файлы не сжимаются,
+    так как docx и xlsx уже являются zip архивами
+    :param files: итерируемый объект пар (имя файла, содержимое). Если скачивание прервано, а files - генератор,
+    он закрывается сразу, чтобы освободить пул процессов, создающий документы
+    """
+    buffer = ZipStreamBuffer()
+    try:
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for name, data in files:
+                archive.writestr(name, data)
+                yield buffer.pop()
+        yield buffer.pop()
+    finally:
+        if hasattr(files, 'close'):
+            files.close()
+
+
+class CsvStreamBuffer:
+    """Буфер для csv.writer, который не хранит строку, а возвращает ее из write"""
+
+    def write(self, value):
+        return value
+
+
+def escape_spreadsheet_formula(value):
+    """
+    Экранирует апострофом строку, которую Excel выполнил бы как формулу (начинается с =, +, -, @ или управляющего
+    символа). Применяется к данным пользователей, попадающим в выгрузки csv и xlsx
+    """
+    if isinstance(value, str) and value.startswith(const.SPREADSHEET_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_csv(header, rows):
+    """
+    Генератор, отдающий csv таблицу построчно. Разделитель - точка с запятой, а в начале файла стоит BOM,
+    чтобы русский Excel открывал файл без настройки импорта
+    """
+    writer = csv.writer(CsvStreamBuffer(), delimiter=';')
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def split_into_chunks(iterable, chunk_size):
+    """Генератор, возвращающий элементы iterable списками по chunk_size элементов"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iterate_in_chunks(queryset, chunk_size):
+    """
+    Итерирует queryset через .iterator(chunk_size), не загружая его в память целиком.
+    prefetch_related, который .iterator() игнорирует, выполняется отдельно для каждой пачки из chunk_size записей
+    :param queryset: queryset или итерируемый объект (тогда он возвращается как есть)
+    :param chunk_size: размер пачки
+    :return: генератор записей
+    """
+    if not isinstance(queryset, QuerySet):
+        yield from queryset
+        return
+    lookups = queryset._prefetch_related_lookups
+    iterator = queryset.iterator(chunk_size=chunk_size)
+    if not lookups:
+        # без prefetch записи не собираются в пачки: объекты, связанные через select_related, ссылаются
+        # друг на друга и, переживая пачку, освобождаются сборщиком мусора только при полной сборке
+        yield from iterator
+        return
+    for chunk in split_into_chunks(iterator, chunk_size):
+        prefetch_related_objects(chunk, *lookups)
+        yield from chunk
+
+
 class ExcelFromApps:
-    def __init__(self, apps):
+    """
+    Создает excel таблицу из заявок apps. Заявки загружаются из БД пачками по chunk_size, строки пишутся
+    в write-only книгу, а итоговый файл сохраняется во временный файл, поэтому память не растет с размером выгрузки
+    """
+
+    def __init__(self, apps=None, chunk_size=const.EXCEL_EXPORT_CHUNK_SIZE):
         self.apps = apps
+        self.chunk_size = chunk_size
         self.wb = Workbook(write_only=True)
         self.sheet = self.wb.create_sheet()
 
@@ -420,17 +1095,35 @@ class ExcelFromApps:
         header = const.HEADERS_FOR_EXCEL_APP_TABLES
         self._update_column_dimensions(header)
         self.sheet.append(header)
-        for app in self.apps:
+        for app in iterate_in_chunks(self.apps, self.chunk_size):
             row = self._convert_app_to_required_format(app)
             self.sheet.append(row)
         return self._save()
 
-    def add_work_list_to_sheet(self):
+    def add_work_list_to_sheet(self, competencies):
+        """
+        Выгружает рабочий список. Заявки читаются словарями через values(), а компетенции каждой пачки заявок
+        загружаются одним запросом, поэтому количество запросов не зависит от количества заявок в пачке
+        :param competencies: queryset ApplicationCompetencies, которые нужно показать в таблице
+        """
         header = const.WORK_LIST_HEADERS_FOR_EXCEL
         self._update_column_dimensions(header)
         self.sheet.append(header)
-        for app in self.apps:
-            row = self._convert_work_list_to_required_format(app)
+        apps = self.apps.values('id', 'final_score', 'last_university', 'last_specialization', 'member__phone',
+                                'member__father_name', 'member__user__first_name', 'member__user__last_name',
+                                'member__user__email')
+        for chunk in split_into_chunks(apps.iterator(chunk_size=self.chunk_size), self.chunk_size):
+            chunk_competencies = self._get_competencies_by_app(competencies, [app['id'] for app in chunk])
+            for app in chunk:
+                row = self._convert_work_list_to_required_format(app, chunk_competencies.get(app['id'], {}))
+                self.sheet.append(row)
+        return self._save()
+
+    def add_rows_to_sheet(self, header, rows):
+        """Выгружает строки rows, уже преобразованные в списки значений, с заголовком header"""
+        self._update_column_dimensions(header)
+        self.sheet.append(header)
+        for row in rows:
             self.sheet.append(row)
         return self._save()
 
@@ -438,34 +1131,38 @@ class ExcelFromApps:
         birth_day = convert_datetime_to_str(app.birth_day, '%d.%m.%Y')
         draft_season = app.get_draft_time()
         full_name = self._get_full_name(app)
-        education_type = Education.get_education_type_display(app)
+        education_type = dict(Education.education_program).get(app.last_education_type)
         return [full_name, draft_season, birth_day, app.birth_place, app.subject_name,
-                app.university, education_type, app.specialization, app.avg_score]
+                app.last_university, education_type, app.last_specialization, app.last_avg_score]
 
-    def _convert_work_list_to_required_format(self, app):
-        full_name = self._get_full_name(app)
-        user_competencies = self._get_user_competencies(app)
-        return [full_name, app.member.phone, app.member.user.email, app.final_score, app.university, app.specialization,
-                ', '.join(user_competencies[3]), ', '.join(user_competencies[2]), ', '.join(user_competencies[1])]
-
-    def _get_user_competencies(self, app):
-        competence_levels = {
-            3: [],
-            2: [],
-            1: [],
-        }
-        for comp in app.app_competence.all():
-            competence_levels[comp.level].append(comp.competence.name)
-        return competence_levels
+    def _convert_work_list_to_required_format(self, app, user_competencies):
+        full_name = f"{app['member__user__last_name']} {app['member__user__first_name']} {app['member__father_name']}"
+        return [full_name, app['member__phone'], app['member__user__email'], app['final_score'],
+                app['last_university'], app['last_specialization'],
+                ', '.join(user_competencies.get(3, [])), ', '.join(user_competencies.get(2, [])),
+                ', '.join(user_competencies.get(1, []))]
+
+    @staticmethod
+    def _get_competencies_by_app(competencies, app_ids):
+        """
+        Возвращает названия компетенций заявок app_ids одним запросом
+        :return: словарь {id заявки: {уровень: [названия компетенций]}}
+        """
+        competencies_by_app = {}
+        for app_id, level, name in competencies.filter(application__id__in=app_ids).values_list(
+                'application_id', 'level', 'competence__name'):
+            competencies_by_app.setdefault(app_id, {}).setdefault(level, []).append(name)
+        return competencies_by_app
 
     def _get_full_name(self, app):
         return f"{app.member.user.last_name} {app.member.user.first_name} {app.member.father_name}"
 
     def _save(self):
-        buffer = BytesIO()
-        self.wb.save(buffer)
-        buffer.seek(0)
-        return buffer
+        """Сохраняет книгу во временный файл, который удаляется после закрытия, и возвращает его"""
+        excel_file = tempfile.SpooledTemporaryFile(max_size=const.EXCEL_EXPORT_SPOOL_MAX_SIZE)
+        self.wb.save(excel_file)
+        excel_file.seek(0)
+        return excel_file
 
     def _update_column_dimensions(self, columns):
         for i in range(1, len(columns) + 1):
@@ -6,9 +6,9 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied, BadRequest
 from django.db import transaction
-from django.db.models import F, Q, Count, OuterRef, Subquery, Prefetch, Case, When, Value
+from django.db.models import F, Q, Count, OuterRef, Prefetch, Case, When, Value, Exists
 from django.db.models.functions import Lower
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect, HttpResponse
 from django.urls import reverse, reverse_lazy
 from django.utils.encoding import escape_uri_path
@@ -25,12 +25,14 @@ from utils import constants as const
 from utils.calculations import get_current_draft_year
 from utils.exceptions import MasterHasNoDirectionsException
 from .forms import ApplicationCreateForm, EducationFormSet, ApplicationMasterForm
-from .mixins import OnlySlaveAccessMixin, OnlyMasterAccessMixin, MasterDataMixin, DataApplicationMixin
+from .mixins import OnlySlaveAccessMixin, OnlyMasterAccessMixin, MasterDataMixin, DataApplicationMixin, \
+    KeysetPaginationMixin
 from .models import Direction, Application, Education, Competence, ApplicationCompetencies, File, ApplicationNote, \
-    Universities, AdditionFieldApp, AdditionField, Specialization, MilitaryCommissariat, WorkGroup, AppsViewedByMaster
+    Universities, AdditionFieldApp, AdditionField, Specialization, MilitaryCommissariat, WorkGroup, AppsViewedByMaster, \
+    DirectionCompetences, viewed_apps_buffer
 from .utils import check_permission_decorator, WordTemplate, check_booking_our_or_exception, check_final_decorator, \
     add_additional_fields, get_cleared_query_string_of_page, get_sorted_queryset, get_form_data, get_additional_fields, \
-    ExcelFromApps, check_affiliation_max_count
+    ExcelFromApps, check_affiliation_max_count, filter_by_search_document, render_word_documents, stream_zip
 
 
 class ChooseDirectionInAppView(DataApplicationMixin, LoginRequiredMixin, View):
@@ -120,8 +122,7 @@ class ApplicationView(LoginRequiredMixin, DataApplicationMixin, View):
         context = {}
         user_application = self.get_user_application(pk)
         if request.user.member.is_master():
-            if not AppsViewedByMaster.objects.filter(member=request.user.member, application=user_application).exists():
-                AppsViewedByMaster.objects.create(member=request.user.member, application=user_application)
+            viewed_apps_buffer.add(request.user.member.id, user_application.id)
 
         user_education = user_application.education.order_by('end_year').all()
         context['master_directions_affiliations'] = self.get_master_direction_affiliations(
@@ -132,49 +133,11 @@ class ApplicationView(LoginRequiredMixin, DataApplicationMixin, View):
         return render(request, 'application/application_detail.html', context=context)
 
     def get_user_application(self, pk):
-        wishlist_affiliations = Booking.objects.filter(affiliation__in=self.get_master_affiliations(),
-                                                       booking_type__name=const.IN_WISHLIST).select_related(
-            'affiliation').only('affiliation', 'slave')
-
-        booked_member_affiliation = Booking.objects.filter(slave=OuterRef('member'), booking_type__name=const.BOOKED)
         app = Application.objects.filter(pk=pk).select_related('member', 'member__user').prefetch_related(
-            Prefetch('member__candidate', queryset=wishlist_affiliations),
             Prefetch('directions', queryset=self.get_master_directions().only('id'), to_attr='aval_dir'),
         ).only('id', 'member', 'directions', 'birth_day', 'birth_place', 'draft_year', 'draft_season', 'final_score',
                'fullness', 'member__user__id', 'member__user__first_name', 'member__user__last_name',
                'member__father_name').annotate(
-            is_booked=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED),
-                distinct=True
-            ),
-            company=Subquery(booked_member_affiliation.values('affiliation__company')),
-            platoon=Subquery(booked_member_affiliation.values('affiliation__platoon')),
-            booked_id=Subquery(booked_member_affiliation.values('affiliation__id')),
-            is_booked_our=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED,
-                         member__candidate__affiliation__in=self.get_master_affiliations()),
-                distinct=True
-            ),
-            can_unbook=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED,
-                         member__candidate__affiliation__in=self.get_master_affiliations(),
-                         member__candidate__master=self.request.user.member),
-                distinct=True
-            ),
-            wishlist_len=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.IN_WISHLIST),
-                distinct=True
-            ),
-            is_in_wishlist=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.IN_WISHLIST,
-                         member__candidate__affiliation__in=self.get_master_affiliations()),
-                distinct=True
-            ),
             our_direction_count=Count(
                 F('directions'),
                 filter=Q(directions__id__in=self.get_master_directions_id()),
@@ -185,6 +148,9 @@ class ApplicationView(LoginRequiredMixin, DataApplicationMixin, View):
                 default=Value(False),
             ),
         ).first()
+        if app:
+            self.add_booking_status_to_apps([app])
+            self.add_notes_to_apps([app])
         return app
 
 
@@ -296,24 +262,12 @@ class DeleteCompetenceView(MasterDataMixin, View):
         return redirect(reverse('competence_list') + f'?direction={direction_id}')
 
     def delete_competence(self, competence_id, direction_id):
-        """Todo: перевести на mptt и сделать get_descendants(include_self=False)"""
-        competence = Competence.objects.prefetch_related(
-            Prefetch('directions', queryset=Direction.objects.filter(id=direction_id)),
-            Prefetch('child__directions', queryset=Direction.objects.filter(id=direction_id)),
-            Prefetch('child__child__directions', queryset=Direction.objects.filter(id=direction_id)),
-        ).get(id=competence_id)
-        all_competences = []
-        if competence.directions.all().exists():
-            all_competences.append(competence)
-        for comp in competence.child.all():
-            if comp.directions.all().exists():
-                all_competences.append(comp)
-            for comp2 in comp.child.all():
-                if comp2.directions.all().exists():
-                    all_competences.append(comp2)
-        with transaction.atomic():
-            for comp in all_competences:
-                comp.directions.remove(direction_id)
+        """Удаляет из направления компетенцию и все ее поддерево любой глубины одним запросом по пути в дереве"""
+        competence = Competence.objects.only('path').get(id=competence_id)
+        Competence.directions.through.objects.filter(competence__in=competence.get_descendants(),
+                                                     direction=direction_id).delete()
+        # удаление через промежуточную таблицу не отправляет m2m_changed
+        DirectionCompetences.clear_cache([direction_id])
 
 
 class CreateCompetenceView(MasterDataMixin, CreateView):
@@ -348,11 +302,7 @@ class ChooseCompetenceInAppView(LoginRequiredMixin, View):
             user_competencies = ApplicationCompetencies.objects.select_related('competence').filter(
                 application=user_app)
             selected_competencies = {_.competence.id: _.level for _ in user_competencies}
-            competencies = Competence.objects.filter(parent_node__isnull=True,
-                                                     directions__in=user_directions).prefetch_related('child',
-                                                                                                      'child__child',
-                                                                                                      'directions').distinct()
-            picked_competencies = Competence.objects.filter(directions__in=user_directions).only('name')
+            competencies, picked_competencies = self.get_competencies_of_directions(user_directions)
             competence_levels = ApplicationCompetencies.competence_levels
             context.update({'levels': competence_levels, 'selected_competencies': selected_competencies,
                             'competencies': competencies, 'selected_directions': user_directions,
@@ -379,17 +329,23 @@ class ChooseCompetenceInAppView(LoginRequiredMixin, View):
         user_app.update_scores(update_fields=['fullness', 'final_score'])
         user_competencies = ApplicationCompetencies.objects.select_related('competence').filter(application=user_app)
         selected_competencies = {_.competence.id: _.level for _ in user_competencies}
-        competencies = Competence.objects.filter(parent_node__isnull=True,
-                                                 directions__in=user_directions).prefetch_related('child',
-                                                                                                  'child__child',
-                                                                                                  'directions').distinct()
-        picked_competencies = Competence.objects.filter(directions__in=user_directions).only('name')
+        competencies, picked_competencies = self.get_competencies_of_directions(user_directions)
 
         context = {'competencies': competencies, 'levels': ApplicationCompetencies.competence_levels,
                    'selected_competencies': selected_competencies, 'pk': pk, 'competence_active': True,
                    'selected_directions': user_directions, 'picked_competencies': picked_competencies}
         return render(request, 'application/application_competence_choose.html', context=context)
 
+    @staticmethod
+    def get_competencies_of_directions(directions):
+        """
+        Возвращает корни деревьев компетенций, выбранные в направлениях directions, и множество всех выбранных
+        в них компетенций
+        """
+        picked_competencies = set(Competence.objects.filter(directions__in=directions).values_list('id', flat=True))
+        roots = [root for root in Competence.get_tree() if root.id in picked_competencies]
+        return roots, picked_competencies
+
 
 class MasterFileTemplatesView(LoginRequiredMixin, OnlyMasterAccessMixin, View):
     """Показывает список уже загруженных файлов на сервер и позволяет загрузить новые"""
@@ -434,7 +390,7 @@ class DownloadFileView(LoginRequiredMixin, View):
         return response
 
 
-class ApplicationListView(MasterDataMixin, ListView):
+class ApplicationListView(MasterDataMixin, KeysetPaginationMixin, ListView):
     """
     Класс отображения списка заявок.
 
@@ -450,81 +406,27 @@ class ApplicationListView(MasterDataMixin, ListView):
     Если человек подавал на одно из направлений отбирающего, то анкета этого человека показывается белым цветом, если
     не подавал - серым.
     Забронированные на направление отбирающего показываются зеленым цветом.
+    При сортировке по умолчанию и по итоговому баллу доступна пагинация по ключу (параметр cursor)
     """
     model = Application
     paginate_by = 50
+    keyset_orderings = {
+        None: [('our_direction', True), ('create_date', True), ('pk', True)],
+        '-final_score': [('our_direction', True), ('final_score', True), ('pk', True)],
+        'final_score': [('our_direction', True), ('final_score', False), ('pk', False)],
+    }
 
     def get_queryset(self):
-        wishlist_affiliations = Booking.objects.filter(affiliation__in=self.get_master_affiliations(),
-                                                       booking_type__name=const.IN_WISHLIST).select_related(
-            'affiliation').only('affiliation', 'slave')
-
-        booked_member_affiliation = Booking.objects.filter(slave=OuterRef('member'), booking_type__name=const.BOOKED)
         apps = Application.objects.all().select_related('member', 'member__user').prefetch_related(
-            Prefetch('member__candidate', queryset=wishlist_affiliations),
             Prefetch('directions', queryset=self.get_master_directions().only('id'), to_attr='aval_dir'),
         ).only('id', 'member', 'directions', 'birth_day', 'birth_place', 'draft_year', 'draft_season', 'final_score',
-               'fullness', 'member__user__id', 'member__user__first_name', 'member__user__last_name',
+               'fullness', 'create_date', 'last_university', 'last_specialization', 'last_avg_score',
+               'last_education_type', 'member__user__id', 'member__user__first_name', 'member__user__last_name',
                'member__father_name')
         apps = self.get_filtered_queryset(apps)
         apps = apps.annotate(
-            is_booked=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED),
-                distinct=True
-            ),
-            company=Subquery(booked_member_affiliation.values('affiliation__company')),
-            platoon=Subquery(booked_member_affiliation.values('affiliation__platoon')),
-            booked_id=Subquery(booked_member_affiliation.values('affiliation__id')),
-            is_booked_our=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED,
-                         member__candidate__affiliation__in=self.get_master_affiliations()),
-                distinct=True
-            ),
-            can_unbook=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED,
-                         member__candidate__affiliation__in=self.get_master_affiliations(),
-                         member__candidate__master=self.request.user.member),
-                distinct=True
-            ),
-            wishlist_len=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.IN_WISHLIST),
-                distinct=True
-            ),
-            is_in_wishlist=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.IN_WISHLIST,
-                         member__candidate__affiliation__in=self.get_master_affiliations()),
-                distinct=True
-            ),
-            university=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'university')[:1]),
-            specialization=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'specialization')[:1]),
-            avg_score=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'avg_score')[:1]),
-            education_type=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'education_type')[:1]),
-            our_direction_count=Count(
-                F('directions'),
-                filter=Q(directions__id__in=self.get_master_directions_id()),
-                distinct=True
-            ),
-            our_direction=Case(
-                When(our_direction_count__gt=0, then=Value(True)),
-                default=Value(False),
-            ),
-            author_note=Subquery(
-                ApplicationNote.objects.filter(application=OuterRef('pk'), author=self.request.user.member,
-                                               affiliations__in=self.get_master_affiliations(),
-                                               ).values('text')[:1]),
-            note=Subquery(
-                ApplicationNote.objects.filter(application=OuterRef('pk'),
-                                               affiliations__in=self.get_master_affiliations(),
-                                               ).values('text')[:1]),
+            our_direction=Exists(Application.directions.through.objects.filter(
+                application=OuterRef('pk'), direction__id__in=self.get_master_directions_id())),
             subject=(MilitaryCommissariat.objects.filter(
                 name=OuterRef('military_commissariat')).values_list('subject')[:1]),
             subject_name=Case(
@@ -551,16 +453,22 @@ class ApplicationListView(MasterDataMixin, ListView):
         context['master_affiliations'] = master_affiliations
         context['master_directions_affiliations'] = self.get_master_direction_affiliations(master_affiliations)
         context['cleaned_query_string'] = get_cleared_query_string_of_page(self.request.META['QUERY_STRING'])
+        self.add_booking_status_to_apps(context['object_list'])
+        self.add_notes_to_apps(context['object_list'])
         app_ids_on_page = [app.id for app in context['application_list']]
         context['viewed_apps'] = AppsViewedByMaster.get_viewed_app_ids_from_member(self.request.user.member, app_ids_on_page)
         return context
 
+    def get_keyset_ordering(self):
+        return self.keyset_orderings.get(self.request.GET.get('ordering', None) or None)
+
     def get_filtered_queryset(self, apps):
         """Возвращает отфильтрованный  список анкет. Если в self.request.GET пусто, то
         фильтрует по текущему году и сезону призыва"""
         args = dict(self.request.GET)
         if args:
             args.pop('page', None)
+            args.pop('cursor', None)
         if not args:
             current_year, current_season = get_current_draft_year()
             return apps.filter(draft_year=current_year, draft_season=current_season[0], unsuitable=False).distinct()
@@ -606,14 +514,7 @@ class ApplicationListView(MasterDataMixin, ListView):
         # Фильтрация с помощью поиска по всем словам в запросе в фамилии, имени и отчестве, названию вуза и субъекту РФ
         search = self.request.GET.get('search', None)
         if search:
-            q = Q()
-            for param in search.split():
-                q |= Q(member__user__first_name__icontains=param)
-                q |= Q(member__user__last_name__icontains=param)
-                q |= Q(member__father_name__icontains=param)
-            q |= Q(university__icontains=search)
-            q |= Q(subject_name__icontains=search)
-            apps = apps.filter(q).distinct()
+            apps = filter_by_search_document(apps, search)
         return apps
 
 
@@ -624,11 +525,13 @@ class CompetenceListView(MasterDataMixin, View):
         if chosen_direction is None:
             raise MasterHasNoDirectionsException(
                 'У вас нет ни одного направления, по которому вы можете осуществлять отбор.')
-        competences_list, picking_competences = self.get_competences_lists(self.get_root_competences(),
-                                                                           chosen_direction)
-        picked_competences = Competence.objects.alias(
-            picked=Count(F'directions', filter=Q(directions=chosen_direction))
-        ).filter(picked__gt=0)
+        direction_competences = DirectionCompetences.load(chosen_direction.id)
+        competences = list(Competence.objects.all())
+        for competence in competences:
+            competence.picked = competence.id in direction_competences.picked_ids
+        competences_list, picking_competences = self.get_competences_lists(Competence.get_tree(competences),
+                                                                           direction_competences)
+        picked_competences = [competence for competence in competences if competence.picked]
         context = {'competences_list': competences_list, 'picked_competences': picked_competences,
                    'picking_competences': picking_competences,
                    'selected_direction': chosen_direction, 'directions': self.get_master_directions(),
@@ -643,26 +546,17 @@ class CompetenceListView(MasterDataMixin, View):
             return Direction.objects.get(id=int(selected_direction_id))
         return self.get_first_master_direction_or_exception()
 
-    def get_competences_lists(self, roots, selected_direction):
+    def get_competences_lists(self, roots, direction_competences):
         """
         Возвращает кортеж листов доступных корневых компетенций для выбора и уже выбранных
         :param roots: Корни всех компетенций
-        :param selected_direction: Выбранное направлени
+        :param direction_competences: DirectionCompetences выбранного направления или None
         :return: кортеж <корни всех выбранных компетенций> <корни всех доступных компетенций>
         """
-        if selected_direction is None:
+        if direction_competences is None:
             return [], roots
-        exsist_coms = roots.filter(parent_node__isnull=True).alias(
-            lvl1=Count(F('directions'), filter=Q(directions=selected_direction), distinct=True),
-            lvl2=Count(F('child'), filter=Q(child__directions=selected_direction), distinct=True),
-            lvl3=Count(F('child__child'), filter=Q(child__child__directions=selected_direction), distinct=True),
-            lvl2all=Count(F('child'), distinct=True),
-            lvl3all=Count(F('child__child'), distinct=True),
-        ).annotate(exist_competences=F('lvl1') + F('lvl2') + F('lvl3'),
-                   not_exist_competences=F('lvl2all') - F('lvl2') + F('lvl3all') - F('lvl3') + 1 - F('lvl1'),
-                   ).prefetch_related('child', 'child__child')
-        chosen_competences_list = exsist_coms.filter(exist_competences__gt=0)
-        for_pick_competences_list = exsist_coms.filter(not_exist_competences__gt=0)
+        chosen_competences_list = [root for root in roots if root.id in direction_competences.chosen_roots_id]
+        for_pick_competences_list = [root for root in roots if root.id not in direction_competences.completed_roots_id]
         return chosen_competences_list, for_pick_competences_list
 
 
@@ -900,7 +794,7 @@ class RemoveApplicationWorkGroupView(MasterDataMixin, View):
         return self.get_redirect_on_previous_page(request)
 
 
-class WorkingListView(MasterDataMixin, ListView):
+class WorkingListView(MasterDataMixin, KeysetPaginationMixin, ListView):
     """
     Показывает список заявок по одному из направлений мастера.
     В таблице показываются все компетенции кандидатов, сгруппированные по уровню владению.
@@ -911,18 +805,12 @@ class WorkingListView(MasterDataMixin, ListView):
     model = Application
     template_name = 'application/working_list.html'
     paginate_by = 50
+    keyset_ordering = [('our_direction', True), ('create_date', False), ('pk', False)]
 
     def get_queryset(self):
         self.chosen_affiliation_id = self.get_chosen_affiliation_id()
         chosen_direction = Direction.objects.get(affiliation__id=self.chosen_affiliation_id)
-        wishlist_affiliations = Booking.objects.filter(affiliation__in=self.get_master_affiliations(),
-                                                       booking_type__name=const.IN_WISHLIST).select_related(
-            'affiliation').only('affiliation', 'slave')
-
-        booked_member_affiliation = Booking.objects.filter(slave=OuterRef('member'),
-                                                           booking_type__name=const.BOOKED)
         apps = Application.objects.all().select_related('member', 'member__user', 'work_group').prefetch_related(
-            Prefetch('member__candidate', queryset=wishlist_affiliations),
             Prefetch('directions', queryset=self.get_master_directions().only('id'), to_attr='aval_dir'),
             Prefetch('app_competence',
                      queryset=ApplicationCompetencies.objects.filter(
@@ -932,60 +820,13 @@ class WorkingListView(MasterDataMixin, ListView):
                                                         status=TestResult.test_statuses[2][0]).select_related('test'),
                      to_attr='test_results')
         ).only('id', 'member', 'directions', 'birth_day', 'birth_place', 'draft_year', 'draft_season',
-               'final_score', 'work_group',
+               'final_score', 'work_group', 'create_date',
                'fullness', 'member__user__id', 'member__user__first_name', 'member__user__last_name',
                'member__father_name')
         apps = self.get_filtered_queryset(apps, self.chosen_affiliation_id)
         apps = apps.annotate(
-            is_booked=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED),
-                distinct=True
-            ),
-            company=Subquery(booked_member_affiliation.values('affiliation__company')),
-            platoon=Subquery(booked_member_affiliation.values('affiliation__platoon')),
-            booked_id=Subquery(booked_member_affiliation.values('affiliation__id')),
-            is_booked_our=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED,
-                         member__candidate__affiliation__in=self.get_master_affiliations()),
-                distinct=True
-            ),
-            can_unbook=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.BOOKED,
-                         member__candidate__affiliation__in=self.get_master_affiliations(),
-                         member__candidate__master=self.request.user.member),
-                distinct=True
-            ),
-            wishlist_len=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.IN_WISHLIST),
-                distinct=True
-            ),
-            our_direction_count=Count(
-                F('directions'),
-                filter=Q(directions__id__in=self.get_master_directions_id()),
-                distinct=True
-            ),
-            our_direction=Case(
-                When(our_direction_count__gt=0, then=Value(True)),
-                default=Value(False),
-            ),
-            is_in_wishlist=Count(
-                F('member__candidate'),
-                filter=Q(member__candidate__booking_type__name=const.IN_WISHLIST,
-                         member__candidate__affiliation__in=self.get_master_affiliations()),
-                distinct=True
-            ),
-            author_note=Subquery(
-                ApplicationNote.objects.filter(application=OuterRef('pk'), author=self.request.user.member,
-                                               affiliations__in=self.get_master_affiliations(),
-                                               ).values('text')[:1]),
-            note=Subquery(
-                ApplicationNote.objects.filter(application=OuterRef('pk'),
-                                               affiliations__in=self.get_master_affiliations(),
-                                               ).values('text')[:1]),
+            our_direction=Exists(Application.directions.through.objects.filter(
+                application=OuterRef('pk'), direction__id__in=self.get_master_directions_id())),
         ).order_by('-our_direction')
         return apps
 
@@ -1009,12 +850,17 @@ class WorkingListView(MasterDataMixin, ListView):
         context['master_directions_affiliations'] = self.get_master_direction_affiliations(master_affiliations)
         chosen_affiliation = get_object_or_404(Affiliation.objects.select_related('direction'),
                                                pk=self.chosen_affiliation_id)
+        self.add_booking_status_to_apps(context['object_list'])
+        self.add_notes_to_apps(context['object_list'])
         context['chosen_company'] = chosen_affiliation.company
         context['chosen_platoon'] = chosen_affiliation.platoon
         context['direction_tests'] = Test.objects.filter(directions=chosen_affiliation.direction)
         context['cleaned_query_string'] = get_cleared_query_string_of_page(self.request.META['QUERY_STRING'])
         return context
 
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
     def get_chosen_affiliation_id(self):
         """Возвращает выбранную принадлежность из get или первую принадлежность мастера"""
         chosen_competence = self.request.GET.get('affiliation', None)
@@ -1035,6 +881,7 @@ class WorkingListView(MasterDataMixin, ListView):
         args = dict(self.request.GET)
         if args:
             args.pop('page', None)
+            args.pop('cursor', None)
         if not args:
             return apps.filter(directions__affiliation__id=chosen_affiliation_id,
                                member__id__in=booked_members).distinct()
@@ -1054,33 +901,18 @@ class WorkingListView(MasterDataMixin, ListView):
 class ExportWorkListView(MasterDataMixin, View):
 
     def get(self, request):
-        apps = self.get_work_list()
-        excel_from_apps = ExcelFromApps(apps)
-        excel_file = excel_from_apps.add_work_list_to_sheet()
-
-        response = HttpResponse(excel_file, content_type='application/xlsx')
-        response['Content-Disposition'] = 'attachment; filename="' + escape_uri_path('Рабочий список.xlsx') + '"'
-        return response
-
-    def get_work_list(self):
         chosen_affiliation_id = WorkingListView(request=self.request).get_chosen_affiliation_id()
-        chosen_direction = Direction.objects.get(affiliation__id=chosen_affiliation_id)
-
-        apps = Application.objects.all().select_related('member', 'member__user').prefetch_related(
-            Prefetch('app_competence',
-                     queryset=ApplicationCompetencies.objects.filter(
-                         competence__directions=chosen_direction, level__in=[1, 2, 3]).select_related('competence')),
+        apps = self.get_work_list(chosen_affiliation_id)
+        competencies = ApplicationCompetencies.objects.filter(competence__directions__affiliation__id=chosen_affiliation_id,
+                                                              level__in=[1, 2, 3])
+        excel_from_apps = ExcelFromApps(apps)
+        excel_file = excel_from_apps.add_work_list_to_sheet(competencies)
+        return FileResponse(excel_file, as_attachment=True, filename='Рабочий список.xlsx',
+                            content_type='application/xlsx')
 
-        ).only('id', 'member', 'final_score', 'member__user__first_name', 'member__user__last_name', 'member__user__email',
-               'member__father_name')
-        apps = WorkingListView(request=self.request).get_filtered_queryset(apps, chosen_affiliation_id)
-        apps = apps.annotate(
-            university=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'university')[:1]),
-            specialization=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'specialization')[:1]),
-        )
-        return apps
+    def get_work_list(self, chosen_affiliation_id):
+        return WorkingListView(request=self.request).get_filtered_queryset(Application.objects.all(),
+                                                                           chosen_affiliation_id)
 
 
 class ChangeWorkGroupView(MasterDataMixin, View):
@@ -1114,22 +946,14 @@ class ApplicationsDownloadingView(MasterDataMixin, View):
         apps = self.get_apps_with_filters_and_sorting()
         excel_from_apps = ExcelFromApps(apps)
         excel_file = excel_from_apps.add_app_to_sheet()
-
-        response = HttpResponse(excel_file, content_type='application/xlsx')
-        response['Content-Disposition'] = 'attachment; filename="' + escape_uri_path('Список заявок.xlsx') + '"'
-        return response
+        return FileResponse(excel_file, as_attachment=True, filename='Список заявок.xlsx',
+                            content_type='application/xlsx')
 
     def get_apps_with_filters_and_sorting(self):
         apps = Application.objects.all().select_related('member', 'member__user')\
-            .only('id', 'member', 'birth_day', 'birth_place', 'draft_year', 'draft_season',)
-        apps = apps.annotate(university=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'university')[:1]),
-            avg_score=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'avg_score')[:1]),
-            education_type=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'education_type')[:1]),
-            specialization=Subquery(Education.objects.filter(application=OuterRef('pk')).order_by('-end_year').values(
-                'specialization')[:1]),
+            .only('id', 'member', 'birth_day', 'birth_place', 'draft_year', 'draft_season', 'last_university',
+                  'last_specialization', 'last_avg_score', 'last_education_type')
+        apps = apps.annotate(
             subject=(MilitaryCommissariat.objects.filter(
                 name=OuterRef('military_commissariat')).values_list('subject')[:1]),
             subject_name=Case(
@@ -1150,6 +974,20 @@ class ApplicationsDownloadingView(MasterDataMixin, View):
         return apps.order_by('-create_date')
 
 
+class InterviewListsDownloadingView(ApplicationsDownloadingView):
+    """ Скачивание листов собеседования отфильтрованного/отсортированного списка заявок zip архивом """
+
+    def get(self, request):
+        apps_id = list(self.get_apps_with_filters_and_sorting().values_list('id', flat=True))
+        word_template = WordTemplate(request, const.PATH_TO_INTERVIEW_LIST)
+        documents = ((f'Анкета_{context["last_name"]}_{app_id}.docx', context) for app_id, context in
+                     zip(apps_id, word_template.create_contexts_to_interview_lists(apps_id)))
+        response = StreamingHttpResponse(stream_zip(render_word_documents(const.PATH_TO_INTERVIEW_LIST, documents)),
+                                         content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="' + escape_uri_path('Листы собеседования.zip') + '"'
+        return response
+
+
 class AddAppToUnsuitable(MasterDataMixin, View):
     """ Добавление анкеты в список неподходящих ко какому-либо критерию (маленький средний балл и т.д.) - новый статус """
 
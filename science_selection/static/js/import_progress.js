@@ -0,0 +1,22 @@
+const progress_poll_interval = 2000;
+
+function updateImportJob(job) {
+    $.getJSON(job.dataset.progressUrl, function (data) {
+        job.querySelector(".job-status").textContent = data.status_display;
+        job.querySelector(".job-rows-processed").textContent = data.rows_processed;
+        job.querySelector(".job-accepted-count").textContent = data.accepted_count;
+        job.querySelector(".job-errors-count").textContent = data.errors_count;
+        job.querySelector(".job-error").textContent = data.error;
+        if (data.is_finished) {
+            let report = job.querySelector(".job-report");
+            report.href = data.report_url;
+            report.classList.remove("d-none");
+        } else {
+            setTimeout(updateImportJob, progress_poll_interval, job);
+        }
+    });
+}
+
+document.querySelectorAll(".import-job").forEach(function (job) {
+    updateImportJob(job);
+});
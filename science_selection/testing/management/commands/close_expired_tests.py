@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from testing.models import TestResult
+from utils import constants as const
+
+
+class Command(BaseCommand):
+    help = 'Закрывает тесты, время выполнения которых истекло, но кандидат так и не отправил ответы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=const.EXPIRED_TESTS_BATCH_SIZE,
+                            help='Количество тестов, закрываемых одним запросом')
+        parser.add_argument('--interval', type=float, nargs='?', const=const.EXPIRED_TESTS_SWEEP_INTERVAL,
+                            help='Не завершать работу, а повторять закрытие с указанным интервалом в секундах '
+                                 f'(по умолчанию {const.EXPIRED_TESTS_SWEEP_INTERVAL})')
+
+    def handle(self, *args, **options):
+        while True:
+            closed = TestResult.close_expired(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Закрыто просроченных тестов: {closed}'))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.9 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testing', '0004_alter_test_time_limit'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='testresult',
+            index=models.Index(fields=['status', 'end_date'], name='testresult_status_end_date_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:44
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testing', '0005_testresult_status_end_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='test',
+            name='version',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, help_text='Меняется при любом изменении теста или его вопросов (TestSnapshot)', verbose_name='Версия теста'),
+        ),
+    ]
@@ -1,7 +1,14 @@
+import uuid
+from collections import namedtuple
+
 from django.db import models
+from django.dispatch import receiver
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from utils.constants import PSYCHOLOGICAL_TYPE_OF_TEST
+from utils.constants import PSYCHOLOGICAL_TYPE_OF_TEST, EXPIRED_TESTS_BATCH_SIZE
+
+QuestionKey = namedtuple('QuestionKey', ['answers', 'correct_answers'])
 
 
 class TypeOfTest(models.Model):
@@ -30,6 +37,8 @@ class Test(models.Model):
     creator = models.ForeignKey('account.Member', on_delete=models.CASCADE, verbose_name='Создатель теста')
     type = models.ForeignKey(TypeOfTest, on_delete=models.CASCADE, verbose_name='Тип теста')
     create_date = models.DateTimeField(auto_now_add=True)
+    version = models.UUIDField(default=uuid.uuid4, editable=False, verbose_name='Версия теста',
+                               help_text='Меняется при любом изменении теста или его вопросов (TestSnapshot)')
 
     class Meta:
         ordering = ['create_date']
@@ -65,10 +74,27 @@ class TestResult(models.Model):
         ordering = ['pk']
         verbose_name = "Результаты теста"
         verbose_name_plural = "Результаты тестов"
+        indexes = [models.Index(fields=['status', 'end_date'], name='testresult_status_end_date_idx')]
 
     def __str__(self):
         return f'{self.test} {self.status}'
 
+    @staticmethod
+    def close_expired(batch_size=EXPIRED_TESTS_BATCH_SIZE):
+        """
+        Переводит в статус "Закончен" все незаконченные тесты, время выполнения которых истекло. Тесты закрываются
+        пачками по batch_size одним UPDATE на пачку, который выбирает строки по индексу (status, end_date)
+        :return: количество закрытых тестов
+        """
+        finished = TestResult.test_statuses[-1][0]
+        expired = TestResult.objects.filter(status__in=[status for status, _ in TestResult.test_statuses[:-1]],
+                                            end_date__lt=timezone.now())
+        closed = 0
+        while updated := TestResult.objects.filter(pk__in=expired.order_by().values('pk')[:batch_size]) \
+                .update(status=finished):
+            closed += updated
+        return closed
+
 
 class Question(models.Model):
     """ Таблица с вопросами для тестов """
@@ -122,3 +148,73 @@ class UserAnswer(models.Model):
 
     def __str__(self):
         return f'{self.question} {self.answer_option}'
+
+
+class TestSnapshot:
+    """
+    Снимок теста для прохождения и просмотра результатов:
+    questions - вопросы теста с загруженными вариантами ответа (question.answer_options.all() не делает запросов),
+    answer_key - ключ ответов {id вопроса: QuestionKey}, где answers - множество id вариантов ответа вопроса,
+    correct_answers - множество id правильных вариантов.
+    Снимки хранятся в памяти процесса, а версия теста - в БД (Test.version), поэтому изменение теста видят все
+    процессы. Версия меняется при любом сохранении или удалении теста, его вопросов и ответов (в том числе в админке),
+    после чего каждый процесс один раз загружает снимок из БД заново. Снимок общий для всех запросов процесса
+    и не должен изменяться
+    """
+    _snapshots = {}
+
+    def __init__(self, version, questions):
+        self.version = version
+        self.questions = questions
+        self.answer_key = {}
+        for question in questions:
+            answers = question.answer_options.all()
+            self.answer_key[question.id] = QuestionKey({ans.id for ans in answers},
+                                                       {ans.id for ans in answers if ans.is_correct})
+
+    @classmethod
+    def load(cls, test_id, version=None):
+        """
+        Возвращает снимок теста с id test_id из памяти процесса, если его версия актуальна, или из БД
+        :param version: версия теста, если тест уже загружен (test.version), иначе она читается из БД
+        """
+        if version is None:
+            version = Test.objects.filter(pk=test_id).values_list('version', flat=True).first()
+        snapshot = cls._snapshots.get(test_id)
+        if snapshot is None or snapshot.version != version:
+            questions = list(Question.objects.filter(test=test_id).prefetch_related('answer_options'))
+            snapshot = cls._snapshots[test_id] = cls(version, questions)
+        return snapshot
+
+    @staticmethod
+    def update_version(test_id):
+        """Меняет версию теста. Другие процессы увидят новую версию вместе с изменениями теста после коммита"""
+        Test.objects.filter(pk=test_id).update(version=uuid.uuid4())
+
+    @classmethod
+    def clear_cache(cls, test_id):
+        cls._snapshots.pop(test_id, None)
+
+
+@receiver(models.signals.pre_save, sender=Test)
+def update_test_version(sender, instance, **kwargs):
+    """
+    Меняет версию теста при каждом сохранении, в том числе в админке. Сохранение загруженного ранее теста
+    не может вернуть старую версию, для которой в процессах остался снимок
+    """
+    instance.version = uuid.uuid4()
+
+
+@receiver(models.signals.post_delete, sender=Test)
+def clear_test_snapshot_on_test_delete(sender, instance, **kwargs):
+    TestSnapshot.clear_cache(instance.pk)
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Question)
+def update_test_version_on_question_change(sender, instance, **kwargs):
+    TestSnapshot.update_version(instance.test_id)
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Answer)
+def update_test_version_on_answer_change(sender, instance, **kwargs):
+    TestSnapshot.update_version(instance.question.test_id)
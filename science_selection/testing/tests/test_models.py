@@ -1,12 +1,16 @@
 import datetime
+from io import StringIO
+from unittest import skipUnless
 
-from django.db import models
+from django.core.management import call_command
+from django.db import models, connection
 from django.test import TestCase
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 from account.models import Role, Member
 from application.models import Direction
-from testing.models import TypeOfTest, Test, TestResult, validate_result, Question, Answer, UserAnswer
+from testing.models import TypeOfTest, Test, TestResult, validate_result, Question, Answer, UserAnswer, TestSnapshot
 from utils.constants import SLAVE_ROLE_NAME
 
 
@@ -73,6 +77,47 @@ class TestResultTest(TestCase):
         self.assertEquals(validators, [validate_result])
 
 
+class CloseExpiredTestResultsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        test_role = Role.objects.create(role_name=SLAVE_ROLE_NAME)
+        creator = Member.objects.create(user=User.objects.create(username='creator'), role=test_role, phone='89998887711')
+        test1 = Test.objects.create(name='Обычный', time_limit=20, type=TypeOfTest.objects.create(name='Обычный'),
+                                    creator=creator)
+        now = timezone.now()
+        # (статус, сдвиг окончания теста относительно текущего времени в минутах)
+        cls.results = []
+        for i, (status, end_shift) in enumerate([(1, -5), (2, -5), (2, -60), (2, 5), (3, -5), (2, -1)]):
+            member = Member.objects.create(user=User.objects.create(username=f'test{i}'), role=test_role,
+                                           phone='89998887711')
+            cls.results.append(TestResult.objects.create(test=test1, member=member, result=0, status=status,
+                                                         end_date=now + datetime.timedelta(minutes=end_shift)))
+
+    def test_close_expired(self):
+        """ Проверяет, что закрываются только незаконченные тесты с истекшим временем, в том числе пачками """
+        with self.assertNumQueries(3):
+            self.assertEqual(TestResult.close_expired(batch_size=2), 4)
+        self.assertEqual([res.status for res in TestResult.objects.order_by('pk')], [3, 3, 3, 2, 3, 3])
+        self.assertEqual(TestResult.close_expired(), 0)
+
+    def test_close_expired_command(self):
+        out = StringIO()
+        call_command('close_expired_tests', stdout=out)
+        self.assertIn('Закрыто просроченных тестов: 4', out.getvalue())
+        self.assertEqual(TestResult.objects.filter(status=2).count(), 1)
+
+    @skipUnless(connection.vendor == 'sqlite', 'План запроса проверяется только для SQLite')
+    def test_close_expired_uses_index(self):
+        """ Проверяет, что просроченные тесты выбираются по индексу (status, end_date) """
+        expired = TestResult.objects.filter(status__in=[1, 2], end_date__lt=timezone.now()).values('pk')
+        sql, params = expired.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('testresult_status_end_date_idx', plan)
+
+
 class QuestionTest(TestCase):
 
     @classmethod
@@ -126,3 +171,73 @@ class UserAnswerTest(TestCase):
         user_ans = UserAnswer.objects.get(id=1)
         filed_type = user_ans._meta.get_field('answer_option').get_internal_type()
         self.assertEquals(filed_type, models.JSONField.__name__)
+
+
+class TestSnapshotTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create(username='test')
+        member = Member.objects.create(user=test_user, role=Role.objects.create(role_name=SLAVE_ROLE_NAME),
+                                       phone='89998887711')
+        cls.test = Test.objects.create(name='Обычный', time_limit=20, type=TypeOfTest.objects.create(name='Обычный'),
+                                       creator=member)
+        cls.question = Question.objects.create(test=cls.test, wording='Вопрос1', question_type=2)
+        cls.answers = [Answer.objects.create(question=cls.question, meaning=f'Отв{i}', is_correct=i > 0)
+                       for i in range(3)]
+        cls.test.refresh_from_db(fields=['version'])
+
+    def setUp(self):
+        TestSnapshot.clear_cache(self.test.pk)
+
+    def test_load_from_cache(self):
+        """ Проверяет, что снимок загружается из БД один раз, а затем берется из кэша по версии теста """
+        with self.assertNumQueries(3):
+            snapshot = TestSnapshot.load(self.test.pk)
+        with self.assertNumQueries(1):
+            self.assertIs(TestSnapshot.load(self.test.pk), snapshot)
+        with self.assertNumQueries(0):
+            cached_snapshot = TestSnapshot.load(self.test.pk, self.test.version)
+            self.assertEqual([list(q.answer_options.all()) for q in cached_snapshot.questions], [self.answers])
+        self.assertEqual(cached_snapshot.version, snapshot.version)
+        self.assertEqual(snapshot.answer_key[self.question.pk].answers, {ans.pk for ans in self.answers})
+        self.assertEqual(snapshot.answer_key[self.question.pk].correct_answers, {ans.pk for ans in self.answers[1:]})
+
+    def test_update_version(self):
+        """ Проверяет, что после добавления вопроса версия теста в БД меняется и снимок загружается заново """
+        old_snapshot = TestSnapshot.load(self.test.pk)
+        new_question = Question.objects.create(test=self.test, wording='Вопрос2', question_type=3)
+        snapshot = TestSnapshot.load(self.test.pk)
+        self.assertNotEqual(snapshot.version, old_snapshot.version)
+        self.assertEqual(snapshot.questions, [self.question, new_question])
+        self.assertEqual(snapshot.answer_key[new_question.pk].answers, set())
+
+    def test_version_changes_on_answer_change(self):
+        """ Проверяет, что изменение и удаление ответа, в том числе в админке, меняет версию теста """
+        old_snapshot = TestSnapshot.load(self.test.pk)
+        self.answers[0].is_correct = True
+        self.answers[0].save()
+        snapshot = TestSnapshot.load(self.test.pk)
+        self.assertNotEqual(snapshot.version, old_snapshot.version)
+        self.assertEqual(snapshot.answer_key[self.question.pk].correct_answers, {ans.pk for ans in self.answers})
+        self.answers[0].delete()
+        snapshot = TestSnapshot.load(self.test.pk)
+        self.assertEqual(snapshot.answer_key[self.question.pk].answers, {ans.pk for ans in self.answers[1:]})
+
+    def test_version_changes_on_save(self):
+        """ Проверяет, что сохранение ранее загруженного теста не возвращает старую версию """
+        stale_test = Test.objects.get(pk=self.test.pk)
+        TestSnapshot.update_version(self.test.pk)
+        version = Test.objects.get(pk=self.test.pk).version
+        stale_test.save()
+        new_version = Test.objects.get(pk=self.test.pk).version
+        self.assertEqual(new_version, stale_test.version)
+        self.assertNotIn(new_version, (version, self.test.version))
+
+    def test_clear_cache_on_test_delete(self):
+        """ Проверяет, что снимок удаленного теста не достается новому тесту с тем же id """
+        TestSnapshot.load(self.test.pk)
+        test_id = self.test.pk
+        Test.objects.filter(pk=test_id).delete()
+        test = Test.objects.create(pk=test_id, name='Новый', type=self.test.type, creator=self.test.creator)
+        self.assertEqual(TestSnapshot.load(test.pk).questions, [])
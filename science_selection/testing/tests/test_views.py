@@ -1,16 +1,36 @@
+import csv
 import datetime
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from unittest import mock
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from account.models import Role, Member, Affiliation
 from application.models import Direction, Application
-from testing.models import Test, TypeOfTest, TestResult, Question, UserAnswer, Answer
+from application.utils import WordTemplate
+from openpyxl import load_workbook
+from testing.utils import TestResultsMatrix
+from testing.views import TestResultsView
+from testing.models import Test, TypeOfTest, TestResult, Question, UserAnswer, Answer, TestSnapshot
 from utils.constants import MASTER_ROLE_NAME, SLAVE_ROLE_NAME, PATH_TO_PSYCHOLOGICAL_TESTS
 from utils.calculations import get_current_draft_year
 
 
+shutdown = ProcessPoolExecutor.shutdown
+
+
+def shutdown_py38(executor, wait=True):
+    """ ProcessPoolExecutor.shutdown с сигнатурой python 3.8 (без cancel_futures), на котором собирается образ """
+    shutdown(executor, wait=wait)
+
+
 def default_db_users():
     master_role = Role.objects.create(role_name=MASTER_ROLE_NAME)
     slave_role = Role.objects.create(role_name=SLAVE_ROLE_NAME)
@@ -230,6 +250,8 @@ class TestResultsViewTest(TestCase):
         TestResult.objects.create(test=test1, member=slave_member1, result=75, status=3, end_date=datetime.datetime.now())
         TestResult.objects.create(test=test2, member=slave_member1, result=100, status=3, end_date=datetime.datetime.now())
         TestResult.objects.create(test=test1, member=slave_member2, result=50, status=3, end_date=datetime.datetime.now())
+        User.objects.filter(username='slave1').update(last_name='Иванов')
+        User.objects.filter(username='slave2').update(last_name='Петров')
 
     def setUp(self) -> None:
         pass
@@ -252,11 +274,64 @@ class TestResultsViewTest(TestCase):
         self.assertEqual(resp.status_code, 403)
 
     def test_get_valid_context(self):
-        """ Проверяет верно созданный контекст для списка результатов тестирования """
+        """ Проверяет верно созданную сводную таблицу результатов тестирования """
         self.client.login(username='master1', password='master1')
         resp = self.client.get(reverse('test_results'))
-        for member, res in resp.context['results'].items():
-            self.assertEqual(list(TestResult.objects.filter(member=member)), list(res))
+        tests = resp.context['tests']
+        self.assertEqual([test.name for test in tests], ['Test1', 'Test2'])
+        rows = {row['full_name']: [result and (result['id'], result['result'], result['status'])
+                                   for result in row['results']] for row in resp.context['rows']}
+        self.assertEqual(len(rows), 2)
+        for member in Member.objects.filter(user__username__in=['slave1', 'slave2']).select_related('user'):
+            results = [TestResult.objects.filter(member=member, test=test).first() for test in tests]
+            self.assertEqual(rows[member.user.last_name],
+                             [res and (res.pk, res.result, res.get_status_display()) for res in results])
+
+    def test_paginate_by_member(self):
+        """ Проверяет, что таблица строится одним запросом и пагинируется по кандидатам, а не по результатам """
+        self.client.login(username='master1', password='master1')
+        with mock.patch.object(TestResultsView, 'paginate_by', 1):
+            resp = self.client.get(reverse('test_results'))
+            self.assertEqual(resp.context['paginator'].num_pages, 2)
+            self.assertEqual(len(resp.context['rows']), 1)
+            self.assertEqual(len([res for res in resp.context['rows'][0]['results'] if res]), 2)
+            resp = self.client.get(reverse('test_results') + '?page=2')
+            self.assertEqual(len(resp.context['rows']), 1)
+        apps = Application.objects.all()
+        matrix = TestResultsMatrix(apps)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(matrix.get_rows(matrix.members))), 2)
+
+    def test_export(self):
+        """ Проверяет выгрузку сводной таблицы в csv и xlsx """
+        self.client.login(username='master1', password='master1')
+        resp = self.client.get(reverse('test_results_export', kwargs={'file_format': 'csv'}))
+        rows = [line.split(';') for line in b''.join(resp.streaming_content).decode('utf-8-sig').splitlines()]
+        self.assertEqual(rows[0], ['ФИО', 'Test1', 'Test2'])
+        self.assertEqual(rows[1:], [['Иванов', '75', '100'], ['Петров', '50', '']])
+
+        resp = self.client.get(reverse('test_results_export', kwargs={'file_format': 'xlsx'}))
+        sheet = load_workbook(BytesIO(b''.join(resp.streaming_content))).active
+        self.assertEqual([list(row) for row in sheet.iter_rows(values_only=True)][1:],
+                         [[row[0], *[int(v) if v else None for v in row[1:]]] for row in rows[1:]])
+
+        resp = self.client.get(reverse('test_results_export', kwargs={'file_format': 'pdf'}))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_export_escapes_formulas(self):
+        """ Проверяет, что ФИО и названия тестов, похожие на формулы, выгружаются как текст """
+        User.objects.filter(username='slave1').update(last_name='=HYPERLINK("http://evil")')
+        User.objects.filter(username='slave2').update(last_name='-2+3')
+        Test.objects.filter(name='Test2').update(name='@SUM(A1)')
+        self.client.login(username='master1', password='master1')
+        resp = self.client.get(reverse('test_results_export', kwargs={'file_format': 'csv'}))
+        rows = list(csv.reader(b''.join(resp.streaming_content).decode('utf-8-sig').splitlines(), delimiter=';'))
+        self.assertEqual(rows[0], ['ФИО', 'Test1', "'@SUM(A1)"])
+        self.assertEqual([row[0] for row in rows[1:]], ['\'-2+3', '\'=HYPERLINK("http://evil")'])
+
+        resp = self.client.get(reverse('test_results_export', kwargs={'file_format': 'xlsx'}))
+        sheet = load_workbook(BytesIO(b''.join(resp.streaming_content))).active
+        self.assertEqual([cell.data_type for cell in next(sheet.iter_cols(min_row=2))], ['s', 's'])
 
 
 class AddTestInDirectionViewTest(TestCase):
@@ -558,6 +633,24 @@ class AddQuestionToTestViewTest(TestCase):
         self.assertEqual(resp.status_code, 400)
         self.assertEqual(resp.context.get('msg'), 'Выбрано неправильное количество правильных ответов')
 
+    def test_snapshot_updated_after_question_changes(self):
+        """ Проверяет, что страница теста видит добавленный и удаленный вопрос, хотя читает вопросы из снимка """
+        self.client.login(username='master1', password='master1')
+        resp = self.client.get(reverse('test', kwargs={'pk': 1}))
+        self.assertEqual(list(resp.context['questions']), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_question_to_test', kwargs={'pk': 1}), data=self.data)
+        question = Question.objects.get(test=1)
+        resp = self.client.get(reverse('test', kwargs={'pk': 1}))
+        self.assertEqual(list(resp.context['questions']), [question])
+        self.assertEqual([ans.meaning for ans in resp.context['questions'][0].answer_options.all()],
+                         ['Отв1', 'Отв2', 'Отв3', 'Отв4'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('delete_question', kwargs={'pk': 1, 'question_id': question.pk}))
+        resp = self.client.get(reverse('test', kwargs={'pk': 1}))
+        self.assertEqual(list(resp.context['questions']), [])
+
 
 class UpdateQuestionViewTest(TestCase):
 
@@ -780,6 +873,40 @@ class AddTestResultViewTest(TestCase):
         self.assertEqual(test_res.status, 3)
         self.assertEqual(test_res.result, 0)
 
+    def test_add_answers_to_foreign_question(self):
+        """ Проверяет, что нельзя ответить на вопрос другого теста """
+        test2 = Test.objects.get(name='Test2')
+        question = Question.objects.create(test=test2, wording='Чужой вопрос', question_type=1)
+        answer = Answer.objects.create(meaning='Отв', question=question, is_correct=True)
+        self.client.login(username='slave1', password='slave1')
+        resp = self.client.post(reverse('add_test_result', kwargs={'pk': 1}),
+                                data={**self.data, f'answer_{question.id}_': [f'{answer.id}']})
+        self.assertEqual(resp.status_code, 404)
+        self.assertFalse(UserAnswer.objects.filter(question=question).exists())
+
+    def test_add_answers_in_constant_queries(self):
+        """ Проверяет, что количество запросов при сохранении ответов не зависит от количества вопросов """
+        master_member1 = Member.objects.get(user__username='master1')
+        slave_member1 = Member.objects.get(user__username='slave1')
+        type1 = TypeOfTest.objects.get(name='type1')
+        self.client.login(username='slave1', password='slave1')
+        queries = []
+        for questions_count in (10, 100):
+            test = Test.objects.create(name=f'Big{questions_count}', time_limit=10, creator=master_member1, type=type1)
+            data = {}
+            for i in range(questions_count):
+                question = Question.objects.create(test=test, wording=f'Вопрос{i}', question_type=2)
+                answers = [Answer.objects.create(meaning=f'Отв{j}', question=question, is_correct=j > 0) for j in range(3)]
+                data.update({f'answer_{question.id}_{ans.id}': ['on'] for ans in answers[1 if i % 2 else 0:]})
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.post(reverse('add_test_result', kwargs={'pk': test.pk}), data=data)
+            self.assertEqual(resp.status_code, 302)
+            queries.append(len(ctx))
+            self.assertEqual(UserAnswer.objects.filter(member=slave_member1, question__test=test).count(),
+                             questions_count)
+            self.assertEqual(TestResult.objects.get(test=test, member=slave_member1).result, 50)
+        self.assertEqual(queries[0], queries[1])
+
 
 class TestResultViewTest(TestCase):
 
@@ -903,3 +1030,97 @@ class TestResultInWordViewTest(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIsNotNone(resp._container)
         self.assertIsNotNone(resp.headers['Content-Disposition'])
+
+
+PSYCHOLOGICAL_TEST_NAME = 'ОПВС 2'
+
+
+@mock.patch('testing.views.PATH_TO_PSYCHOLOGICAL_TESTS',
+            {PSYCHOLOGICAL_TEST_NAME: 'static/docx/templates/psychological_test.docx'})
+class TestResultsInWordViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        default_db_users()
+        master_member1 = Member.objects.get(user__username='master1')
+        psychological_type = TypeOfTest.objects.create(name='Психологический')
+        usual_type = TypeOfTest.objects.create(name='Обычный')
+        cls.test = Test.objects.create(name=PSYCHOLOGICAL_TEST_NAME, creator=master_member1, type=psychological_type)
+        usual_test = Test.objects.create(name='Обычный', time_limit=10, creator=master_member1, type=usual_type)
+        questions = []
+        for i in range(3):
+            question = Question.objects.create(test=cls.test, wording=f'Вопрос {i}', question_type=3)
+            questions.append((question, [Answer.objects.create(question=question, meaning=f'Ответ {j}')
+                                         for j in range(2)]))
+
+        current_year, current_season = get_current_draft_year()
+        for i in range(3):
+            user = User.objects.create_user(username=f'candidate{i}', password='candidate', last_name=f'Фамилия{i}')
+            member = Member.objects.create(user=user, role=Role.objects.get(role_name=SLAVE_ROLE_NAME),
+                                           phone='89998887766')
+            Application.objects.create(member=member, birth_day=datetime.date(2000, 1, i + 1), birth_place='Test',
+                                       nationality='РФ', military_commissariat='Йо', group_of_health='А',
+                                       draft_year=current_year if i < 2 else current_year - 1,
+                                       draft_season=current_season[0])
+            TestResult.objects.create(test=cls.test, member=member, result=0, status=3,
+                                      end_date=datetime.datetime.now())
+            TestResult.objects.create(test=usual_test, member=member, result=50, status=3,
+                                      end_date=datetime.datetime.now())
+            for question, answers in questions:
+                UserAnswer.objects.create(question=question, member=member, answer_option=[answers[i % 2].id])
+
+        # начатый тест без ответов не попадает в архив
+        slave_member2 = Member.objects.get(user__username='slave2')
+        Application.objects.create(member=slave_member2, birth_day=datetime.date(2000, 1, 1), birth_place='Test',
+                                   nationality='РФ', military_commissariat='Йо', group_of_health='А',
+                                   draft_year=current_year, draft_season=current_season[0])
+        TestResult.objects.create(test=cls.test, member=slave_member2, result=0, status=2,
+                                  end_date=datetime.datetime.now() + datetime.timedelta(days=1))
+
+    def setUp(self):
+        TestSnapshot.clear_cache(self.test.pk)
+
+    def test_download_without_permission(self):
+        self.client.login(username='slave1', password='slave1')
+        resp = self.client.get(reverse('test_results_in_word'))
+        self.assertEqual(resp.status_code, 403)
+
+    def test_download_psychological_tests(self):
+        """ Проверяет, что в архив попадают завершенные психологические тесты призыва и совпадают с выгрузкой по одному """
+        self.client.login(username='master1', password='master1')
+        resp = self.client.get(reverse('test_results_in_word'))
+        self.assertTrue(resp.streaming)
+        with mock.patch.object(ProcessPoolExecutor, 'shutdown', shutdown_py38):
+            content = b''.join(resp.streaming_content)
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            documents = {name: archive.read(name) for name in archive.namelist()}
+        test_results = TestResult.objects.filter(test=self.test, status=3,
+                                                 member__application__draft_year=get_current_draft_year()[0])
+        self.assertEqual(len(documents), 2)
+
+        for test_result in test_results.select_related('member__user'):
+            single = self.client.get(reverse('test_result_in_word', kwargs={'pk': self.test.pk,
+                                                                            'result_id': test_result.pk})).content
+            name = f'{PSYCHOLOGICAL_TEST_NAME}_{test_result.member.user.last_name}_{test_result.pk}.docx'
+            with zipfile.ZipFile(BytesIO(documents[name])) as bulk_docx, zipfile.ZipFile(BytesIO(single)) as single_docx:
+                self.assertEqual(bulk_docx.read('word/document.xml'), single_docx.read('word/document.xml'))
+
+    def test_close_download(self):
+        """ Проверяет, что обрыв скачивания после первого документа не ломает остановку пула процессов """
+        self.client.login(username='master1', password='master1')
+        resp = self.client.get(reverse('test_results_in_word'))
+        with mock.patch.object(ProcessPoolExecutor, 'shutdown', shutdown_py38):
+            next(iter(resp.streaming_content))
+            resp.close()
+
+    def test_contexts_in_constant_queries(self):
+        """ Проверяет, что вопросы загружаются один раз, а ответы всех пользователей - одним запросом """
+        test_results = list(TestResult.objects.filter(test=self.test).select_related('member__user').annotate(
+            birth_day=F('member__application__birth_day')))
+        with self.assertNumQueries(3):
+            contexts = list(WordTemplate(None, '').create_contexts_to_psychological_tests(self.test, test_results))
+        self.assertEqual(len(contexts), 4)
+        self.assertEqual([q['response'] for q in contexts[1]['questions']],
+                         [UserAnswer.objects.get(member=test_results[1].member, question_id=q_id).answer_option[0]
+                          for q_id in Question.objects.filter(test=self.test).values_list('id', flat=True)])
+        self.assertEqual([q['response'] for q in contexts[-1]['questions']], [None] * 3)
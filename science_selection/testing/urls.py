@@ -5,6 +5,8 @@ urlpatterns = [
     path('', views.CreateTestView.as_view(), name='create_test'),
     path('list/',  views.TestListView.as_view(), name='test_list'),
     path('results/',  views.TestResultsView.as_view(), name='test_results'),
+    path('results/export/<str:file_format>/',  views.TestResultsExportView.as_view(), name='test_results_export'),
+    path('results/word/',  views.TestResultsInWordView.as_view(), name='test_results_in_word'),
     path('add/<int:direction_id>/', views.AddTestInDirectionView.as_view(), name='add_test'),
     path('exclude/<int:test_id>/<int:direction_id>/', views.ExcludeTestInDirectionView.as_view(), name='exclude_test'),
     path('<int:pk>/',  views.DetailTestView.as_view(), name='test'),
@@ -1,4 +1,92 @@
+from django.db.models import Q, Max
+
+from account.models import Member
+from application.utils import escape_spreadsheet_formula
+from utils import constants as const
+
+from .models import Test, TestResult
+
 
 def get_master_directions(user):
-    directions = [aff.direction.pk for aff in user.member.affiliations.prefetch_related('direction').all()]
-    return directions
+    return user.member.get_master_context().directions_id
+
+
+def grade_answers(answer_key, user_answers):
+    """
+    Возвращает результат теста в процентах - долю вопросов, на которые выбраны ровно все правильные варианты ответа
+    :param answer_key: ключ ответов теста (TestSnapshot.answer_key)
+    :param user_answers: словарь {id вопроса: список id выбранных вариантов ответа}
+    """
+    if not answer_key:
+        return 0
+    total = sum(1 for question_id, answers in user_answers.items()
+                if set(answers) == answer_key[question_id].correct_answers)
+    return int((total / len(answer_key)) * 100)
+
+
+class TestResultsMatrix:
+    """
+    Сводная таблица результатов тестирования: строки - кандидаты с заявками apps, столбцы - тесты, которые они
+    проходили. Результаты всех тестов кандидата собираются одним запросом с условной агрегацией по id тестов,
+    поэтому таблица пагинируется по кандидатам, а не по отдельным результатам
+    """
+
+    def __init__(self, apps):
+        self.tests = list(Test.objects.filter(test_res__member__application__in=apps).select_related('type')
+                          .distinct().order_by('create_date', 'pk'))
+        self.members = self._get_members(apps)
+
+    def _get_members(self, apps):
+        """Queryset словарей кандидатов с полями result_id_<id теста>, result_<id теста>, status_<id теста>"""
+        annotations = {}
+        for test in self.tests:
+            test_filter = Q(test_result__test=test.id)
+            annotations.update({
+                f'result_id_{test.id}': Max('test_result__id', filter=test_filter),
+                f'result_{test.id}': Max('test_result__result', filter=test_filter),
+                f'status_{test.id}': Max('test_result__status', filter=test_filter),
+            })
+        return Member.objects.filter(application__in=apps, test_result__isnull=False) \
+            .values('id', 'father_name', 'user__first_name', 'user__last_name').annotate(**annotations) \
+            .order_by('user__last_name', 'user__first_name', 'id')
+
+    def get_rows(self, members):
+        """
+        Преобразует кандидатов (элементы self.members) в строки таблицы: full_name - ФИО кандидата,
+        results - список по тестам self.tests, в котором для непройденных тестов None, а для остальных - словарь
+        с id, результатом (только для непсихологических тестов) и названием статуса результата
+        """
+        statuses = dict(TestResult.test_statuses)
+        for member in members:
+            results = []
+            for test in self.tests:
+                result_id = member[f'result_id_{test.id}']
+                results.append(result_id and {
+                    'id': result_id,
+                    'test_id': test.id,
+                    'result': None if test.type.is_psychological() else member[f'result_{test.id}'],
+                    'status': statuses.get(member[f'status_{test.id}']),
+                })
+            full_name = f"{member['user__last_name']} {member['user__first_name']} {member['father_name'] or ''}"
+            yield {'full_name': full_name.strip(), 'results': results}
+
+    def get_header(self):
+        return ['ФИО'] + [escape_spreadsheet_formula(test.name) for test in self.tests]
+
+    def iterate_export_rows(self, chunk_size=const.EXCEL_EXPORT_CHUNK_SIZE):
+        """
+        Генератор строк выгрузки таблицы: ФИО и по столбцу на тест (см. _get_export_value). ФИО вводят сами
+        кандидаты, поэтому оно экранируется от выполнения как формулы
+        """
+        for row in self.get_rows(self.members.iterator(chunk_size=chunk_size)):
+            yield [escape_spreadsheet_formula(row['full_name'])] + \
+                [self._get_export_value(result) for result in row['results']]
+
+    @staticmethod
+    def _get_export_value(result):
+        """ Результат в процентах для законченного непсихологического теста, иначе название статуса """
+        if not result:
+            return ''
+        if result['result'] is not None and result['status'] == TestResult.test_statuses[-1][1]:
+            return result['result']
+        return result['status']
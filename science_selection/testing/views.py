@@ -6,7 +6,9 @@ from operator import attrgetter
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied, BadRequest
-from django.db.models import Prefetch
+from django.db import transaction
+from django.db.models import Prefetch, Q, F
+from django.http import StreamingHttpResponse, FileResponse, Http404
 from django.shortcuts import render, get_object_or_404, redirect, HttpResponse
 from django.urls import reverse
 from django.utils import timezone
@@ -17,15 +19,16 @@ from django.views.generic.list import ListView
 
 from application.models import Application, Direction
 from application.mixins import OnlyMasterAccessMixin, MasterDataMixin, OnlySlaveAccessMixin
-from application.utils import WordTemplate, get_cleared_query_string_of_page, get_form_data
+from application.utils import WordTemplate, ExcelFromApps, get_cleared_query_string_of_page, get_form_data, \
+    render_word_documents, stream_zip, stream_csv
 from utils.calculations import get_current_draft_year
 from utils.exceptions import MasterHasNoDirectionsException
-from utils.constants import PATH_TO_PSYCHOLOGICAL_TESTS
+from utils.constants import PATH_TO_PSYCHOLOGICAL_TESTS, PSYCHOLOGICAL_TYPE_OF_TEST
 
 from .forms import TestCreateForm, QuestionForm, AnswerFormSetExtra1, AnswerFormSetExtra5, FilterTestResultForm
 from .mixins import TestAndQuestionMixin
-from .models import Test, TestResult, Question, UserAnswer, Answer
-from .utils import get_master_directions
+from .models import Test, TestResult, Question, UserAnswer, Answer, TestSnapshot
+from .utils import get_master_directions, grade_answers, TestResultsMatrix
 
 
 class TestListView(LoginRequiredMixin, View):
@@ -105,16 +108,13 @@ class ExcludeTestInDirectionView(MasterDataMixin, View):
 
 
 class TestResultsView(LoginRequiredMixin, OnlyMasterAccessMixin, ListView):
-    """ Получить список результатов тестирования операторов """
-    model = TestResult
+    """ Получить сводную таблицу результатов тестирования кандидатов (кандидаты x тесты) """
     template_name = 'testing/test_results.html'
     paginate_by = 50
 
     def get_queryset(self):
-        apps = Application.objects.select_related('member').only('member')
-        current_apps = self._get_filtered_queryset(apps)
-        members = [app.member for app in current_apps]
-        return TestResult.objects.filter(member__in=members).prefetch_related('test', 'member', 'test__type').order_by('member')
+        self.matrix = TestResultsMatrix(self._get_filtered_queryset(Application.objects.all()))
+        return self.matrix.members
 
     def _get_filtered_queryset(self, apps):
         """Фильтруует список анкет по году и сезону призыва. Если приходят пустые параметры, то текущий год и призыв"""
@@ -136,8 +136,8 @@ class TestResultsView(LoginRequiredMixin, OnlyMasterAccessMixin, ListView):
         context = super().get_context_data(**kwargs)
         args = get_form_data(self.request.GET)
 
-        results = {member: list(tests) for member, tests in groupby(context['testresult_list'], attrgetter('member'))}
-        context['results'] = results
+        context['tests'] = self.matrix.tests
+        context['rows'] = list(self.matrix.get_rows(context['object_list']))
 
         current_year, current_season = get_current_draft_year()
         initial = {
@@ -152,6 +152,55 @@ class TestResultsView(LoginRequiredMixin, OnlyMasterAccessMixin, ListView):
         return context
 
 
+class TestResultsExportView(TestResultsView):
+    """ Выгрузить сводную таблицу результатов тестирования выбранных годов и сезонов призыва в xlsx или csv """
+
+    def get(self, request, file_format):
+        matrix = TestResultsMatrix(self._get_filtered_queryset(Application.objects.all()))
+        if file_format == 'xlsx':
+            excel_file = ExcelFromApps().add_rows_to_sheet(matrix.get_header(), matrix.iterate_export_rows())
+            return FileResponse(excel_file, as_attachment=True, filename='Результаты тестирования.xlsx',
+                                content_type='application/xlsx')
+        if file_format == 'csv':
+            response = StreamingHttpResponse(stream_csv(matrix.get_header(), matrix.iterate_export_rows()),
+                                             content_type='text/csv; charset=utf-8')
+            filename = escape_uri_path('Результаты тестирования.csv')
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+        raise Http404('Неизвестный формат выгрузки')
+
+
+class TestResultsInWordView(TestResultsView):
+    """ Скачать zip архивом ворд анкеты всех завершенных психологических тестов выбранных годов и сезонов призыва """
+
+    def get(self, request):
+        test_results = self._get_psychological_test_results()
+        response = StreamingHttpResponse(stream_zip(self._create_words(test_results)), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="' + escape_uri_path('Психологические тесты.zip') + '"'
+        return response
+
+    def _get_psychological_test_results(self):
+        """ Завершенные результаты психологических тестов, для которых есть шаблон, сгруппированные по тестам """
+        apps = self._get_filtered_queryset(Application.objects.all())
+        return TestResult.objects.filter(
+            Q(status=TestResult.test_statuses[-1][0]) | Q(end_date__lt=timezone.now()),
+            member__application__in=apps, test__type__name=PSYCHOLOGICAL_TYPE_OF_TEST,
+            test__name__in=[name for name in PATH_TO_PSYCHOLOGICAL_TESTS if name]
+        ).select_related('test', 'member__user').annotate(birth_day=F('member__application__birth_day')) \
+            .order_by('test', 'member__user__last_name', 'pk')
+
+    def _create_words(self, test_results):
+        """ Генератор ворд документов: для каждого теста контексты создаются пачками и рендерятся в пуле процессов """
+        for _, results in groupby(test_results, attrgetter('test_id')):
+            results = list(results)
+            test = results[0].test
+            path_to_test = PATH_TO_PSYCHOLOGICAL_TESTS[test.name]
+            contexts = WordTemplate(self.request, path_to_test).create_contexts_to_psychological_tests(test, results)
+            documents = ((f'{test.name}_{test_result.member.user.last_name}_{test_result.pk}.docx', context)
+                         for test_result, context in zip(results, contexts))
+            yield from render_word_documents(path_to_test, documents)
+
+
 class CreateTestView(LoginRequiredMixin, OnlyMasterAccessMixin, View):
     """ Создание нового теста постоянным составом """
 
@@ -202,7 +251,7 @@ class DetailTestView(LoginRequiredMixin, DetailView):
             if user_test.status != TestResult.test_statuses[-1][0]:
                 TestResult.objects.filter(test=context['test'].pk, member=member) \
                     .update(status=TestResult.test_statuses[-1][0])
-        context['questions'] = Question.objects.filter(test=context['test']).only('wording')
+        context['questions'] = TestSnapshot.load(context['test'].pk, context['test'].version).questions
         return context
 
 
@@ -306,7 +355,7 @@ class AddTestResultView(LoginRequiredMixin, OnlySlaveAccessMixin, View):
 
     def _get_default_context(self, test, user_result):
         return {
-            'question_list': Question.objects.filter(test=test).prefetch_related('answer_options'),
+            'question_list': TestSnapshot.load(test.pk, test.version).questions,
             'test': test,
             'end_date': datetime.datetime.strftime(timezone.localtime(user_result.end_date) - timezone.timedelta(seconds=3), "%Y-%m-%d %H:%M:%S")
         }
@@ -329,52 +378,49 @@ class AddTestResultView(LoginRequiredMixin, OnlySlaveAccessMixin, View):
     def post(self, request, pk):
         """ Проверяет результаты теста пользователя, если он еще не был прорешен, то сохраняет результаты теста пользователя """
         member = request.user.member
-        test = get_object_or_404(Test, pk=pk)
+        test = get_object_or_404(Test.objects.select_related('type'), pk=pk)
         is_completed, user_test_result, _ = self._test_is_completed(member, test)
         if is_completed:
             return redirect('test_list')
-        answers = self._get_answers_from_page(request.POST)
-        question_ids = [str(_.pk) for _ in Question.objects.filter(test=test).only('pk')]
-        if test.type.is_psychological() and list(answers.keys()) != question_ids:
+        answer_key = TestSnapshot.load(test.pk, test.version).answer_key
+        answers = self._get_answers_from_page(request.POST, answer_key)
+        if test.type.is_psychological() and answers.keys() != answer_key.keys():
             user_answers = []
             for _ in answers.values():
-                user_answers.extend(_['user_answer'])
+                user_answers.extend(_)
 
             context = self._get_default_context(test, user_test_result)
             context.update({
                 'user_answers': user_answers, 'msg': 'Необходимо ответить на все вопросы'
             })
             return render(request, 'testing/add_test_result.html', context=context, status=400)
-        self._add_or_update_user_answers(member, answers, test)
+        self._add_or_update_user_answers(member, answers, test, answer_key)
         return redirect('test_list')
 
-    def _get_answers_from_page(self, params):
-        """ Генерирает словарь из вопросов и ответов пользователя на вопросы """
-        params_from_page = defaultdict(lambda: defaultdict(list))
+    def _get_answers_from_page(self, params, answer_key):
+        """ Генерирует словарь {id вопроса: список id выбранных вариантов ответа} по ответам пользователя """
+        params_from_page = defaultdict(list)
         for param in params:
             if 'answer' in param:
                 _, question_id, answer_id = param.split('_')
                 answer_id = params[param] if not answer_id else answer_id
-                question = get_object_or_404(Question.objects.prefetch_related('answer_options'), pk=question_id)
-                params_from_page[question_id]['correct_answer'] = [_.pk for _ in question.answer_options.all() if _.is_correct]
-                params_from_page[question_id]['question'] = question
-                params_from_page[question_id]['user_answer'].append(int(answer_id))
+                if int(question_id) not in answer_key:
+                    raise Http404('Вопрос не найден')
+                params_from_page[int(question_id)].append(int(answer_id))
         return params_from_page
 
-    def _add_or_update_user_answers(self, member, answers, test):
-        """ Сохраняет ответы пользователя на вопросы и обновляет общий результат """
-        questions = Question.objects.filter(test=test)
-        UserAnswer.objects.filter(member=member, question__in=questions).delete()
-        for question_id, val in answers.items():
-            UserAnswer.objects.create(question=val['question'], member=member, answer_option=val['user_answer'])
-
+    def _add_or_update_user_answers(self, member, answers, test, answer_key):
+        """ Сохраняет ответы пользователя на вопросы одним запросом и обновляет общий результат """
         final_value = 0
         if not test.type.is_psychological() and answers:
-            total = sum([1 for k, v in answers.items() if v['correct_answer'] == v['user_answer']])
-            final_value = int((total / len(questions)) * 100)
+            final_value = grade_answers(answer_key, answers)
 
-        TestResult.objects.filter(test=test, member=member).update(status=TestResult.test_statuses[-1][0],
-                                                                   result=final_value)
+        with transaction.atomic():
+            UserAnswer.objects.filter(member=member, question__test=test).delete()
+            UserAnswer.objects.bulk_create([UserAnswer(question_id=question_id, member=member, answer_option=user_answer)
+                                            for question_id, user_answer in answers.items()])
+            TestResult.objects.filter(test=test, member=member).update(status=TestResult.test_statuses[-1][0],
+                                                                       result=final_value)
 
 
 class TestResultView(LoginRequiredMixin, OnlyMasterAccessMixin, View):
@@ -394,8 +440,8 @@ class TestResultView(LoginRequiredMixin, OnlyMasterAccessMixin, View):
     def _get_user_questions_and_answers(self, user_test_result):
         """ Собирает данные по результатам теста пользователя: список вопросов, ответы пользователя и правильные ответы """
         user_answers = []
-        question_list = Question.objects.filter(test=user_test_result.test).prefetch_related('answer_options')
-        for _ in UserAnswer.objects.filter(question__in=question_list, member=user_test_result.member):
+        question_list = TestSnapshot.load(user_test_result.test_id, user_test_result.test.version).questions
+        for _ in UserAnswer.objects.filter(question__test=user_test_result.test_id, member=user_test_result.member):
             user_answers.extend(list(map(int, _.answer_option)))
         return question_list, user_answers
 
@@ -420,11 +466,8 @@ class TestResultInWordView(LoginRequiredMixin, OnlyMasterAccessMixin, View):
     def _create_word(self, user_test_result, path_to_file):
         """ Генерирует шаблон ворд документа по файлу и загруженному контексту """
         word_template = WordTemplate(self.request, path_to_file)
-        questions = Question.objects.filter(test=user_test_result.test).prefetch_related('answer_options')
+        questions = TestSnapshot.load(user_test_result.test_id, user_test_result.test.version).questions
         user_answers = {ans.question_id: ans.answer_option[0] for ans in
-                        UserAnswer.objects.filter(question__in=questions, member=user_test_result.member)}
+                        UserAnswer.objects.filter(question__test=user_test_result.test_id, member=user_test_result.member)}
         context = word_template.create_context_to_psychological_test(user_test_result, questions, user_answers)
         return word_template.create_word_in_buffer(context)
-
-# TODO:
-# Celery - добавлять задачу при начале выполнения нового теста и после истечения времени изменять статут, если не пришел запрос??
@@ -147,3 +147,44 @@ HEADERS_FOR_EXCEL_APP_TABLES = ['ФИО', 'Сезон призыва', 'Дата
 
 # заголовки для excel таблицы рабочего списка
 WORK_LIST_HEADERS_FOR_EXCEL = ['ФИО', 'Телефон', 'Email', 'Итоговый балл', 'ВУЗ', 'Специальность', 'Сильный уровень компетенций', 'Средний уровень компетенций', 'Базовый уровень компетенций']
+
+# время хранения в кэше общего количества заявок при пагинации по ключу (в секундах)
+PAGINATOR_COUNT_CACHE_TIMEOUT = 60
+
+# время хранения в кэше покрытия дерева компетенций направлением (в секундах)
+DIRECTION_COMPETENCES_CACHE_TIMEOUT = int(os.environ.get("DJANGO_DIRECTION_COMPETENCES_CACHE_TIMEOUT", 3600))
+
+# размер пачки заявок, загружаемых из БД при экспорте в excel
+EXCEL_EXPORT_CHUNK_SIZE = 2000
+# начала ячеек, которые Excel выполняет как формулу (экранируются в выгрузках csv и xlsx)
+SPREADSHEET_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# максимальный размер excel файла экспорта (в байтах), который хранится в памяти, а не во временном файле
+EXCEL_EXPORT_SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+# количество заявок, сохраняемых за раз при пакетном импорте из excel
+IMPORT_APPS_CHUNK_SIZE = 500
+# интервал проверки очереди задач импорта обработчиком run_jobs (в секундах)
+JOBS_POLL_INTERVAL = 5
+# время выполнения задачи импорта (в секундах), после которого она считается прерванной (обработчик упал или
+# контейнер перезапустился) и завершается с ошибкой
+JOBS_RUNNING_TIMEOUT = int(os.environ.get("DJANGO_JOBS_RUNNING_TIMEOUT", 3600))
+
+# максимальное количество ворд шаблонов, хранящихся в кэше процесса
+DOCX_TEMPLATE_CACHE_SIZE = 16
+
+# количество процессов, создающих ворд документы при выгрузке архивом
+WORD_EXPORT_WORKERS = int(os.environ.get("DJANGO_WORD_EXPORT_WORKERS", os.cpu_count() or 1))
+# максимальное количество ворд документов, одновременно находящихся в работе при выгрузке архивом
+WORD_EXPORT_MAX_PENDING = 2 * WORD_EXPORT_WORKERS
+# размер пачки заявок, загружаемых из БД при выгрузке ворд документов архивом
+WORD_EXPORT_CHUNK_SIZE = 500
+
+# количество просроченных результатов тестов, закрываемых одним UPDATE
+EXPIRED_TESTS_BATCH_SIZE = 1000
+# интервал запуска закрытия просроченных тестов командой close_expired_tests --interval (в секундах)
+EXPIRED_TESTS_SWEEP_INTERVAL = int(os.environ.get("DJANGO_EXPIRED_TESTS_SWEEP_INTERVAL", 60))
+
+# количество меток просмотра заявок в буфере процесса, при котором они сохраняются в БД
+VIEWED_APPS_FLUSH_SIZE = 100
+# максимальное время хранения меток просмотра заявок в буфере процесса до сохранения в БД (в секундах)
+VIEWED_APPS_FLUSH_INTERVAL = int(os.environ.get("DJANGO_VIEWED_APPS_FLUSH_INTERVAL", 10))
@@ -0,0 +1,102 @@
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from docxtpl import DocxTemplate
+from jinja2 import Environment
+
+from .constants import DOCX_TEMPLATE_CACHE_SIZE
+
+
+class CachedJinjaEnvironment(Environment):
+    """Окружение jinja, которое компилирует каждый исходный xml шаблона только один раз"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compiled_templates = {}
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class:
+            return super().from_string(source, globals, template_class)
+        template = self.compiled_templates.get(source)
+        if template is None:
+            template = self.compiled_templates[source] = super().from_string(source)
+        return template
+
+
+class CachedDocxTemplate(DocxTemplate):
+    """
+    Ворд шаблон, собранный из закэшированного файла. Подготовленный xml (patch_xml) и скомпилированные
+    jinja шаблоны частей документа общие для всех документов, созданных по одному файлу
+    """
+
+    def __init__(self, entry):
+        super().__init__(BytesIO(entry.data))
+        self._entry = entry
+
+    def patch_xml(self, src_xml):
+        patched_xml = self._entry.patched_xml.get(src_xml)
+        if patched_xml is None:
+            patched_xml = self._entry.patched_xml[src_xml] = super().patch_xml(src_xml)
+        return patched_xml
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        if jinja_env is None and not autoescape:
+            jinja_env = self._entry.jinja_env
+        super().render(context, jinja_env, autoescape)
+
+
+class DocxTemplateCacheEntry:
+    def __init__(self, mtime, data):
+        self.mtime = mtime
+        self.data = data
+        self.patched_xml = {}
+        self.jinja_env = CachedJinjaEnvironment()
+
+
+class DocxTemplateCache:
+    """
+    Кэш ворд шаблонов процесса: хранит содержимое файла и подготовленные части шаблона по ключу (путь, mtime).
+    Хранит не больше max_size шаблонов, вытесняя давно не использованные
+    """
+
+    def __init__(self, max_size=DOCX_TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Возвращает новый шаблон для рендера по файлу path, перечитывая файл, если он изменился"""
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime == mtime:
+                self._entries.move_to_end(path)
+                return CachedDocxTemplate(entry)
+        with open(path, 'rb') as file:
+            entry = DocxTemplateCacheEntry(mtime, file.read())
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return CachedDocxTemplate(entry)
+
+    def invalidate(self, path=None):
+        """Удаляет из кэша шаблон по пути path или все шаблоны, если путь не передан"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self._entries
+
+
+docx_template_cache = DocxTemplateCache()